@@ -36,7 +36,7 @@ from rag.nlp import rag_tokenizer, search
 from rag.prompts import cross_languages, keyword_extraction
 from rag.prompts.prompts import gen_meta_filter
 from rag.settings import PAGERANK_FLD
-from rag.utils import rmSpace
+from rag.utils import num_tokens_from_string, rmSpace
 
 
 @manager.route('/list', methods=['POST'])  # noqa: F821
@@ -170,6 +170,7 @@ def set():
         v, c = embd_mdl.encode([doc.name, req["content_with_weight"] if not d.get("question_kwd") else "\n".join(d["question_kwd"])])
         v = 0.1 * v[0] + 0.9 * v[1] if doc.parser_id != ParserType.QA else v[1]
         d["q_%d_vec" % len(v)] = v.tolist()
+        d["token_num_int"] = num_tokens_from_string(d["content_with_weight"])
         settings.docStoreConn.update({"id": req["chunk_id"]}, d, search.index_name(tenant_id), doc.kb_id)
         return get_json_result(data=True)
     except Exception as e:
@@ -270,6 +271,7 @@ def create():
         v, c = embd_mdl.encode([doc.name, req["content_with_weight"] if not d["question_kwd"] else "\n".join(d["question_kwd"])])
         v = 0.1 * v[0] + 0.9 * v[1]
         d["q_%d_vec" % len(v)] = v.tolist()
+        d["token_num_int"] = num_tokens_from_string(d["content_with_weight"])
         settings.docStoreConn.insert([d], search.index_name(tenant_id), doc.kb_id)
 
         DocumentService.increment_chunk_num(
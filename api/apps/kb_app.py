@@ -35,6 +35,7 @@ from api.db.db_models import File
 from api.utils.api_utils import get_json_result
 from api import settings
 from graphrag.search import KGSearch
+from graphrag.utils import set_graph_version
 from rag.nlp import search
 from api.constants import DATASET_NAME_LIMIT
 from rag.nlp.search import index_name
@@ -920,6 +921,7 @@ def delete_knowledge_graph(kb_id):
     _, kb = KnowledgebaseService.get_by_id(kb_id)
     settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "subgraph", "entity", "relation"]},
                                  search.index_name(kb.tenant_id), kb_id)
+    set_graph_version(kb_id)
 
     return get_json_result(data=True)
 
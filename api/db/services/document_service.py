@@ -276,6 +276,8 @@ class DocumentService(CommonService):
                                              search.index_name(tenant_id), doc.kb_id)
                 settings.docStoreConn.delete({"kb_id": doc.kb_id, "knowledge_graph_kwd": ["entity", "relation", "graph", "subgraph", "community_report"], "must_not": {"exists": "source_id"}},
                                              search.index_name(tenant_id), doc.kb_id)
+                from graphrag.utils import set_graph_version
+                set_graph_version(doc.kb_id)
         except Exception:
             pass
         return cls.delete_by_id(doc.id)
@@ -753,7 +755,7 @@ def doc_upload_and_parse(conversation_id, file_objs, user_id):
             "callback": dummy,
             "parser_config": parser_config,
             "from_page": 0,
-            "to_page": 100000,
+            "to_page": 100000000,
             "tenant_id": kb.tenant_id,
             "lang": kb.language
         }
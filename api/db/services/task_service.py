@@ -16,11 +16,12 @@
 import logging
 import os
 import random
+import re
 import xxhash
 from datetime import datetime
 
 from api.db.db_utils import bulk_insert_into_db
-from deepdoc.parser import PdfParser
+from deepdoc.parser import DocxParser, MarkdownParser, PdfParser, PptParser
 from peewee import JOIN
 from api.db.db_models import DB, File2Document, File
 from api.db import StatusEnum, FileType, TaskStatus
@@ -33,7 +34,7 @@ from rag.settings import get_svr_queue_name
 from rag.utils.storage_factory import STORAGE_IMPL
 from rag.utils.redis_conn import REDIS_CONN
 from api import settings
-from rag.nlp import search
+from rag.nlp import find_codec, search
 
 
 def trim_header_by_lines(text: str, max_length) -> str:
@@ -326,6 +327,8 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
     Note:
         - For PDF documents, tasks are created per page range based on configuration
         - For Excel documents, tasks are created per row range
+        - For DOCX, Markdown, PPTX and spreadsheets in the general parsers, tasks are created
+          per section, slide or row range (see `split_ranges`)
         - Task digests are calculated for optimization and reuse
         - Previous task chunks may be reused if available
     """
@@ -364,6 +367,15 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
             task["from_page"] = i
             task["to_page"] = min(i + 3000, rn)
             parse_task_array.append(task)
+
+    elif (doc["parser_id"] == "naive" and re.search(r"\.(docx|md|markdown|csv|xlsx?)$", doc["name"], re.IGNORECASE)) \
+            or (doc["parser_id"] == "presentation" and re.search(r"\.pptx$", doc["name"], re.IGNORECASE)):
+        file_bin = STORAGE_IMPL.get(bucket, name)
+        for s, e in split_ranges(doc, file_bin):
+            task = new_task()
+            task["from_page"] = s
+            task["to_page"] = e
+            parse_task_array.append(task)
     else:
         parse_task_array.append(new_task())
 
@@ -408,6 +420,38 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
         ), "Can't access Redis. Please check the Redis' status."
 
 
+def split_ranges(doc: dict, file_bin: bytes):
+    """Cut a non-PDF document into the ranges its parser can chunk independently.
+
+    The unit of a range depends on the format: paragraphs of a DOCX and lines of a
+    Markdown file (both cut before headings), slides of a PPTX and rows of a
+    spreadsheet. Parsers receive the range as `from_page` and `to_page`.
+
+    Args:
+        doc (dict): Document dictionary containing metadata and configuration.
+        file_bin (bytes): Content of the document.
+
+    Returns:
+        list[tuple[int, int]]: [from_page, to_page) ranges in document order, a single
+        whole-document range if the document can not be split.
+    """
+    whole = [(0, 100000000)]
+    try:
+        if re.search(r"\.docx$", doc["name"], re.IGNORECASE):
+            return DocxParser.section_ranges(doc["name"], file_bin, 1000)
+        if re.search(r"\.(md|markdown)$", doc["name"], re.IGNORECASE):
+            return MarkdownParser.section_ranges(file_bin.decode(find_codec(file_bin), errors="ignore"), 2000)
+        if re.search(r"\.pptx$", doc["name"], re.IGNORECASE):
+            page_size = doc["parser_config"].get("task_page_size") or 12
+            pages = PptParser.total_page_number(doc["name"], file_bin) or 0
+            return [(p, min(p + page_size, pages)) for p in range(0, pages, page_size)] or whole
+        rn = RAGFlowExcelParser.row_number(doc["name"], file_bin) or 0
+        return [(i, min(i + 3000, rn)) for i in range(0, rn, 3000)] or whole
+    except Exception:
+        logging.exception(f"Failed to split {doc['name']}, parse it as a whole.")
+        return whole
+
+
 def reuse_prev_task_chunks(task: dict, prev_tasks: list[dict], chunking_config: dict):
     """Attempt to reuse chunks from previous tasks for optimization.
     
@@ -463,6 +507,11 @@ def cancel_all_task_of(doc_id):
             logging.exception(e)
 
 
+class TaskCanceledException(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+
 def has_canceled(task_id):
     try:
         if REDIS_CONN.get(f"{task_id}-cancel"):
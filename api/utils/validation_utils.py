@@ -337,6 +337,7 @@ class GraphragConfig(Base):
     method: Annotated[Literal["light", "general"], Field(default="light")]
     community: Annotated[bool, Field(default=False)]
     resolution: Annotated[bool, Field(default=False)]
+    pack_token_num: Annotated[int, Field(default=0, ge=0, le=32768)]
 
 
 class ParserConfig(Base):
@@ -137,3 +137,22 @@ class RAGFlowDocxParser:
 
         tbls = [self.__extract_table_content(tb) for tb in self.doc.tables]
         return secs, tbls
+
+    @staticmethod
+    def section_ranges(fnm, binary=None, size=1000):
+        """
+        Split the paragraphs of a document into [start, end) ranges of at least `size` paragraphs,
+        cut right before headings so that no section straddles two ranges.
+        """
+        doc = Document(fnm) if not binary else Document(BytesIO(binary))
+        ranges, start = [], 0
+        paragraphs = doc.paragraphs
+        for i, p in enumerate(paragraphs):
+            if i - start < size:
+                continue
+            style = p.style.name if p.style is not None and hasattr(p.style, "name") else ""
+            if re.match(r"(Heading|Title)", style, re.IGNORECASE):
+                ranges.append((start, i))
+                start = i
+        ranges.append((start, len(paragraphs)))
+        return ranges
@@ -18,11 +18,13 @@ from io import BytesIO
 
 import pandas as pd
 from openpyxl import Workbook, load_workbook
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
 
 from rag.nlp import find_codec
 
 # copied from `/openpyxl/cell/cell.py`
 ILLEGAL_CHARACTERS_RE = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
+MERGE_CELL_RE = re.compile(rb'<(?:\w+:)?mergeCell[\s/>]')
 
 class RAGFlowExcelParser:
 
@@ -64,6 +66,72 @@ class RAGFlowExcelParser:
             except Exception as e_pandas:
                 raise Exception(f"pandas.read_excel error: {e_pandas}, original openpyxl error: {e}")
 
+    @staticmethod
+    def _load_read_only_workbook(file_like_object):
+        """
+        Open an xlsx workbook in openpyxl's read-only mode, which streams rows from the sheet XML on demand
+        instead of building every cell up front. Returns None for csv, xls or files openpyxl cannot read,
+        which go through `_load_excel_to_workbook`. The caller closes the workbook.
+        """
+        if isinstance(file_like_object, bytes):
+            file_like_object = BytesIO(file_like_object)
+        try:
+            if isinstance(file_like_object, str):
+                with open(file_like_object, "rb") as f:
+                    file_head = f.read(4)
+            else:
+                file_like_object.seek(0)
+                file_head = file_like_object.read(4)
+                file_like_object.seek(0)
+            if not file_head.startswith(b'PK\x03\x04'):
+                return None
+            return load_workbook(file_like_object, read_only=True, data_only=True)
+        except Exception as e:
+            logging.info(f"openpyxl read-only load error: {e}, load the whole workbook instead")
+            return None
+
+    @staticmethod
+    def _row_count(ws):
+        """
+        Number of rows of a sheet, as `len(list(ws.rows))`. In read-only mode the rows are counted with one
+        streaming pass, since some writers leave a wrong `<dimension>`, which then becomes the real one.
+        """
+        if not isinstance(ws, ReadOnlyWorksheet):
+            return len(list(ws.rows))
+        ws.reset_dimensions()
+        n, max_col = 0, 0
+        for r in ws.iter_rows(values_only=True):
+            n += 1
+            max_col = max(max_col, len(r))
+        if n:
+            # Rows read afterwards are padded to the real width, as in a fully loaded sheet.
+            ws._max_row, ws._max_column = n, max_col
+        return n
+
+    @staticmethod
+    def _sheet_window(from_page, to_page, rn, n):
+        """
+        Rows [s, e) of a sheet of `n` rows, header excluded, that fall into the window [from_page, to_page).
+        `from_page` and `to_page` count rows over all sheets, as `row_number` does, and `rn` rows come before
+        this sheet. The window is empty (s >= e) for sheets before or after it.
+        """
+        return max(from_page - rn, 1), max(min(to_page - rn, n), 0)
+
+    @staticmethod
+    def _has_merged_cells(ws):
+        """Whether a sheet has merged cells. In read-only mode they follow the rows, so the raw sheet XML is scanned."""
+        if not isinstance(ws, ReadOnlyWorksheet):
+            return bool(ws.merged_cells.ranges)
+        tail = b""
+        with ws._get_source() as src:
+            while True:
+                buf = src.read(1 << 20)
+                if not buf:
+                    return False
+                if MERGE_CELL_RE.search(tail + buf):
+                    return True
+                tail = buf[-32:]
+
     @staticmethod
     def _clean_dataframe(df: pd.DataFrame):
         def clean_string(s):
@@ -89,11 +157,12 @@ class RAGFlowExcelParser:
 
         return wb
 
-    def html(self, fnm, chunk_rows=256):
+    def html(self, fnm, chunk_rows=256, from_page=0, to_page=100000000):
         from html import escape
 
         file_like_object = BytesIO(fnm) if not isinstance(fnm, str) else fnm
-        wb = RAGFlowExcelParser._load_excel_to_workbook(file_like_object)
+        wb = RAGFlowExcelParser._load_read_only_workbook(file_like_object) or \
+            RAGFlowExcelParser._load_excel_to_workbook(file_like_object)
         tb_chunks = []
 
         def _fmt(v):
@@ -101,11 +170,17 @@ class RAGFlowExcelParser:
                 return ""
             return str(v).strip()
 
+        rn = 0
         for sheetname in wb.sheetnames:
             ws = wb[sheetname]
-            rows = list(ws.rows)
-            if not rows:
+            n = RAGFlowExcelParser._row_count(ws)
+            if not n:
                 continue
+            s, e = RAGFlowExcelParser._sheet_window(from_page, to_page, rn, n)
+            rn += n
+            if s >= e:
+                continue
+            rows = list(ws.iter_rows(max_row=1)) + list(ws.iter_rows(min_row=s + 1, max_row=e))
 
             tb_rows_0 = "<tr>"
             for t in list(rows[0]):
@@ -129,20 +204,27 @@ class RAGFlowExcelParser:
                 tb += "</table>\n"
                 tb_chunks.append(tb)
 
+        wb.close()
         return tb_chunks
 
-    def __call__(self, fnm):
+    def __call__(self, fnm, from_page=0, to_page=100000000):
         file_like_object = BytesIO(fnm) if not isinstance(fnm, str) else fnm
-        wb = RAGFlowExcelParser._load_excel_to_workbook(file_like_object)
+        wb = RAGFlowExcelParser._load_read_only_workbook(file_like_object) or \
+            RAGFlowExcelParser._load_excel_to_workbook(file_like_object)
 
         res = []
+        rn = 0
         for sheetname in wb.sheetnames:
             ws = wb[sheetname]
-            rows = list(ws.rows)
-            if not rows:
+            n = RAGFlowExcelParser._row_count(ws)
+            if not n:
+                continue
+            s, e = RAGFlowExcelParser._sheet_window(from_page, to_page, rn, n)
+            rn += n
+            if s >= e:
                 continue
-            ti = list(rows[0])
-            for r in list(rows[1:]):
+            ti = list(next(ws.iter_rows(max_row=1)))
+            for r in ws.iter_rows(min_row=s + 1, max_row=e):
                 fields = []
                 for i, c in enumerate(r):
                     if not c.value:
@@ -154,16 +236,18 @@ class RAGFlowExcelParser:
                 if sheetname.lower().find("sheet") < 0:
                     line += " ——" + sheetname
                 res.append(line)
+        wb.close()
         return res
 
     @staticmethod
     def row_number(fnm, binary):
         if fnm.split(".")[-1].lower().find("xls") >= 0:
-            wb = RAGFlowExcelParser._load_excel_to_workbook(BytesIO(binary))
+            wb = RAGFlowExcelParser._load_read_only_workbook(BytesIO(binary)) or \
+                RAGFlowExcelParser._load_excel_to_workbook(BytesIO(binary))
             total = 0
             for sheetname in wb.sheetnames:
-                ws = wb[sheetname]
-                total += len(list(ws.rows))
+                total += RAGFlowExcelParser._row_count(wb[sheetname])
+            wb.close()
             return total
 
         if fnm.split(".")[-1].lower() in ["csv", "txt"]:
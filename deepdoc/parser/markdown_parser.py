@@ -112,6 +112,23 @@ class RAGFlowMarkdownParser:
 
         return working_text, tables
 
+    @staticmethod
+    def section_ranges(text, size=2000):
+        """
+        Split the lines of a markdown text into [start, end) ranges of at least `size` lines,
+        cut right before headings outside code blocks.
+        """
+        lines = text.split("\n")
+        ranges, start, in_code = [], 0, False
+        for i, line in enumerate(lines):
+            if line.strip().startswith("```"):
+                in_code = not in_code
+            elif not in_code and i - start >= size and re.match(r"^#{1,6}\s+", line):
+                ranges.append((start, i))
+                start = i
+        ranges.append((start, len(lines)))
+        return ranges
+
 
 class MarkdownElementExtractor:
     def __init__(self, markdown_content):
@@ -14,12 +14,17 @@
 #  limitations under the License.
 #
 
+import json
 import logging
+import multiprocessing
 import os
 import random
 import re
 import sys
 import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
 from io import BytesIO
 from timeit import default_timer as timer
@@ -28,22 +33,161 @@ import numpy as np
 import pdfplumber
 import trio
 import xgboost as xgb
+import xxhash
 from huggingface_hub import snapshot_download
 from PIL import Image
 from pypdf import PdfReader as pdf2_read
 
 from api import settings
 from api.utils.file_utils import get_project_base_directory
+from deepdoc.parser.utils import get_page_cache, set_page_cache
 from deepdoc.vision import OCR, LayoutRecognizer, Recognizer, TableStructureRecognizer
 from rag.app.picture import vision_llm_chunk as picture_vision_llm_chunk
 from rag.nlp import rag_tokenizer
 from rag.prompts import vision_llm_describe_prompt
-from rag.settings import PARALLEL_DEVICES
+from rag.settings import OCR_CPU_WORKERS, PARALLEL_DEVICES, PDF_PAGE_IMAGE_CACHE_SIZE, PDF_TEXT_LAYER_FAST_PATH, TABLE_CONSTRUCT_WORKERS
 
 LOCK_KEY_pdfplumber = "global_shared_lock_pdfplumber"
 if LOCK_KEY_pdfplumber not in sys.modules:
     sys.modules[LOCK_KEY_pdfplumber] = threading.Lock()
 
+# Keys of a pdfplumber char that page OCR reads; only these are shipped to OCR worker processes.
+OCR_CHAR_KEYS = ("text", "x0", "x1", "top", "bottom", "width", "height")
+
+_ocr_process_pool = None
+_ocr_process_pool_lock = threading.Lock()
+_process_ocr = None
+
+
+def _init_ocr_process(intra_op_num_threads):
+    global _process_ocr
+    from deepdoc.vision import ocr as ocr_module
+    # Workers split the cores between them instead of each using the in-process defaults.
+    ocr_module.OCR_INTRA_OP_NUM_THREADS = intra_op_num_threads
+    ocr_module.OCR_INTER_OP_NUM_THREADS = 1
+    _process_ocr = OCR()
+
+
+def _ocr_page_in_process(pagenum, img, chars, mean_height, ZM):
+    return RAGFlowPdfParser._ocr_page(_process_ocr, pagenum, img, chars, mean_height, ZM)
+
+
+def get_ocr_process_pool():
+    """
+    Process pool shared by all parsers of this process for CPU-only OCR, created on first use.
+    Workers are spawned rather than forked since the parent already holds onnxruntime sessions and threads.
+    """
+    global _ocr_process_pool
+    with _ocr_process_pool_lock:
+        if _ocr_process_pool is None:
+            intra_op_num_threads = max(1, (os.cpu_count() or 1) // OCR_CPU_WORKERS)
+            _ocr_process_pool = ProcessPoolExecutor(max_workers=OCR_CPU_WORKERS,
+                                                    mp_context=multiprocessing.get_context("spawn"),
+                                                    initializer=_init_ocr_process,
+                                                    initargs=(intra_op_num_threads,))
+            logging.info(f"OCR process pool started with {OCR_CPU_WORKERS} workers, {intra_op_num_threads} threads each")
+        return _ocr_process_pool
+
+
+_table_process_pool = None
+
+
+def get_table_process_pool():
+    """Process pool building table HTML, `construct_table` is pure Python and holds the GIL."""
+    global _table_process_pool
+    with _ocr_process_pool_lock:
+        if _table_process_pool is None:
+            _table_process_pool = ProcessPoolExecutor(max_workers=TABLE_CONSTRUCT_WORKERS,
+                                                      mp_context=multiprocessing.get_context("spawn"))
+        return _table_process_pool
+
+
+class PdfPageImages:
+    """
+    Page images of `fnm[page_from:page_to]`, rendered when accessed instead of all up front.
+    The `cache_size` most recently used images stay in memory, plus the pages passed to `keep()`;
+    any other page is rendered again on the next access.
+    """
+
+    def __init__(self, fnm, zoomin=3, page_from=0, page_to=299, cache_size=PDF_PAGE_IMAGE_CACHE_SIZE):
+        self.zoomin = zoomin
+        self.cache_size = max(1, cache_size)
+        with sys.modules[LOCK_KEY_pdfplumber]:
+            self.pdf = pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm))
+            self.pages = self.pdf.pages[page_from:page_to]
+        self._sizes = [None] * len(self.pages)
+        self._hashes = [None] * len(self.pages)
+        self._cache = OrderedDict()
+        self._kept = {}
+        self._kept_pages = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"page index {i} out of range")
+        with self._lock:
+            if i in self._kept:
+                return self._kept[i]
+            if i in self._cache:
+                self._cache.move_to_end(i)
+                return self._cache[i]
+
+        img = self._render(i)
+        with self._lock:
+            if i in self._kept_pages:
+                self._kept[i] = img
+            else:
+                self._cache[i] = img
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return img
+
+    def _render(self, i):
+        with sys.modules[LOCK_KEY_pdfplumber]:
+            page = self.pages[i]
+            img = page.to_image(resolution=72 * self.zoomin, antialias=True).annotated
+            page.flush_cache()
+        self._sizes[i] = img.size
+        self._hashes[i] = xxhash.xxh128(img.tobytes()).hexdigest() + "{}x{}".format(*img.size)
+        return img
+
+    def size(self, i):
+        if self._sizes[i] is None:
+            self[i]
+        return self._sizes[i]
+
+    def page_hash(self, i):
+        """Digest of the rendered pixels of page `i`."""
+        if self._hashes[i] is None:
+            self[i]
+        return self._hashes[i]
+
+    def keep(self, pages):
+        """Keep the images of `pages` resident from now on, and only those."""
+        with self._lock:
+            self._kept_pages = set(pages)
+            self._kept = {i: img for i, img in self._kept.items() if i in self._kept_pages}
+            for i in self._kept_pages:
+                if i in self._cache:
+                    self._kept[i] = self._cache.pop(i)
+
+    def close(self):
+        with self._lock:
+            self._cache.clear()
+            self._kept.clear()
+        self.pdf.close()
+
 
 class RAGFlowPdfParser:
     def __init__(self, **kwargs):
@@ -68,6 +212,9 @@ class RAGFlowPdfParser:
             self.layouter = LayoutRecognizer("layout." + self.model_speciess)
         else:
             self.layouter = LayoutRecognizer("layout")
+        # Identifies where layouts come from in page cache keys.
+        self.layout_domain = "{}:{}:{}".format(type(self.layouter).__name__, getattr(self, "model_speciess", ""),
+                                               os.environ.get("TENSORRT_DLA_SVR", ""))
         self.tbl_det = TableStructureRecognizer()
 
         self.updown_cnt_mdl = xgb.Booster()
@@ -194,6 +341,55 @@ class RAGFlowPdfParser:
                     arr[j + 1] = tmp
         return arr
 
+    @staticmethod
+    def _text_layer_usable(page, chars):
+        """
+        Whether the text layer of a pdfplumber `page` can stand in for OCR: enough chars, hardly any
+        unmapped or garbled glyphs, mostly letters and digits, and no large images that may hold text.
+        """
+        texts = [c["text"] for c in chars if c["text"].strip()]
+        if len(texts) < 32:
+            return False
+        garbled = sum(1 for t in texts if "(cid:" in t or any(ch == "\ufffd" or unicodedata.category(ch)[0] == "C" for ch in t))
+        if garbled / len(texts) > 0.02:
+            return False
+        # Symbol-font or broken ToUnicode mappings come out as pages of punctuation and symbols.
+        alnum = sum(1 for t in texts if any(unicodedata.category(ch)[0] in "LN" for ch in t))
+        if alnum / len(texts) < 0.5:
+            return False
+        page_area = float(page.width * page.height) or 1.
+        img_area = sum(max(0, min(im["x1"], page.width) - max(im["x0"], 0)) * max(0, min(im["bottom"], page.height) - max(im["top"], 0))
+                       for im in page.images)
+        return img_area / page_area < 0.3
+
+    @staticmethod
+    def _boxes_from_chars(chars, pagenum, mean_height):
+        """Text line boxes built straight from the chars of a page, shaped like the ones `_ocr_page` returns."""
+        chars = [c for c in chars if c["text"]]
+        if not chars:
+            return []
+        mean_height = max(mean_height, 1)
+        order, lines = Recognizer.reading_lines(chars, mean_height / 2)
+        bxs = []
+        for i, ln in zip(order, lines):
+            c = chars[i]
+            b = bxs[-1] if bxs else None
+            # a new line, or a gap wide enough to be a column gutter, starts a box
+            if b is None or b["line"] != ln or c["x0"] - b["x1"] > 2 * mean_height:
+                b = {"x0": c["x0"], "x1": c["x1"], "top": c["top"], "bottom": c["bottom"],
+                     "text": "", "page_number": pagenum, "line": ln}
+                bxs.append(b)
+            if c["text"] == " ":
+                if b["text"] and re.match(r"[0-9a-zA-Zа-яА-Я,.?;:!%%]", b["text"][-1]):
+                    b["text"] += " "
+            else:
+                b["text"] += c["text"]
+            b["x0"], b["x1"] = min(b["x0"], c["x0"]), max(b["x1"], c["x1"])
+            b["top"], b["bottom"] = min(b["top"], c["top"]), max(b["bottom"], c["bottom"])
+        for b in bxs:
+            del b["line"]
+        return [b for b in bxs if b["text"].strip()]
+
     def _has_color(self, o):
         if o.get("ncs", "") == "DeviceGray":
             if o["stroking_color"] and o["stroking_color"][0] == 1 and o["non_stroking_color"] and \
@@ -208,12 +404,16 @@ class RAGFlowPdfParser:
         tbcnt = [0]
         MARGIN = 10
         self.tb_cpns = []
+        page_recos, page_keys = [], []
         assert len(self.page_layout) == len(self.page_images)
         for p, tbls in enumerate(self.page_layout):  # for page
             tbls = [f for f in tbls if f["type"] == "table"]
             tbcnt.append(len(tbls))
+            page_recos.append([])
+            page_keys.append(None)
             if not tbls:
                 continue
+            crops = []
             for tb in tbls:  # for table
                 left, top, right, bott = tb["x0"] - MARGIN, tb["top"] - MARGIN, \
                     tb["x1"] + MARGIN, tb["bottom"] + MARGIN
@@ -222,12 +422,29 @@ class RAGFlowPdfParser:
                 right *= ZM
                 bott *= ZM
                 pos.append((left, top))
-                imgs.append(self.page_images[p].crop((left, top, right, bott)))
+                crops.append((left, top, right, bott))
+            if isinstance(self.page_images, PdfPageImages):
+                page_keys[p] = (self.page_images.page_hash(p), ["%.1f,%.1f,%.1f,%.1f" % c for c in crops])
+                page_recos[p] = get_page_cache("tsr", *page_keys[p])
+                if page_recos[p] is not None:
+                    continue
+            page_recos[p] = None
+            imgs.extend([self.page_images[p].crop(c) for c in crops])
 
         assert len(self.page_images) == len(tbcnt) - 1
-        if not imgs:
+        if not pos:
             return
-        recos = self.tbl_det(imgs)
+        # Pages with cached table structures skip recognition, the rest is recognized in one batch.
+        recos = self.tbl_det(imgs) if imgs else []
+        j = 0
+        for p in range(len(page_recos)):
+            if page_recos[p] is not None:
+                continue
+            page_recos[p] = recos[j: j + tbcnt[p + 1]]
+            j += tbcnt[p + 1]
+            if page_keys[p]:
+                set_page_cache("tsr", page_recos[p], *page_keys[p])
+        recos = [r for rs in page_recos for r in rs]
         tbcnt = np.cumsum(tbcnt)
         for i in range(len(tbcnt) - 1):  # for page
             pg = []
@@ -293,15 +510,56 @@ class RAGFlowPdfParser:
                 b["H_right"] = spans[ii]["x1"]
                 b["SP"] = ii
 
-    def __ocr(self, pagenum, img, chars, ZM=3, device_id: int | None = None):
+    @staticmethod
+    def _ocr_page(ocr, pagenum, img, chars, mean_height, ZM=3, device_id: int | None = None):
+        """
+        OCR one page image. Only touches `ocr` and its arguments so it can run in a worker process.
+        Returns (boxes, chars not covered by any box, page mean height).
+        """
+        return RAGFlowPdfParser._ocr_pages(ocr, [(pagenum, img, chars, mean_height)], ZM, device_id)[0]
+
+    @staticmethod
+    def _chars_digest(chars):
+        return xxhash.xxh64(json.dumps([[c[k] for k in OCR_CHAR_KEYS] for c in chars], default=str)).hexdigest()
+
+    @staticmethod
+    def _ocr_pages(ocr, pages, ZM=3, device_id: int | None = None):
+        """
+        OCR several (pagenum, img, chars, mean_height) pages, recognizing the crops of all of them together
+        so the recognizer gets full batches. Returns one `_ocr_page` result per page.
+        """
+        detected = [RAGFlowPdfParser._ocr_detect(ocr, pagenum, img, chars, mean_height, ZM, device_id)
+                    for pagenum, img, chars, mean_height in pages]
         start = timer()
-        bxs = self.ocr.detect(np.array(img), device_id)
+        boxes_to_reg = [b for _, _, _, bxs_to_reg in detected for b in bxs_to_reg]
+        texts = ocr.recognize_batch([b["box_image"] for b in boxes_to_reg], device_id)
+        for i in range(len(boxes_to_reg)):
+            boxes_to_reg[i]["text"] = texts[i]
+            del boxes_to_reg[i]["box_image"]
+        logging.info(f"__ocr recognize {len(boxes_to_reg)} boxes of {len(pages)} pages cost {timer() - start}s")
+
+        res = []
+        for bxs, lefted_chars, mean_height, _ in detected:
+            bxs = [b for b in bxs if b["text"]]
+            if mean_height == 0:
+                mean_height = np.median([b["bottom"] - b["top"] for b in bxs])
+            res.append((bxs, lefted_chars, mean_height))
+        return res
+
+    @staticmethod
+    def _ocr_detect(ocr, pagenum, img, chars, mean_height, ZM=3, device_id: int | None = None):
+        """
+        Detect text boxes of a page and fill them with the pdf chars they cover.
+        Returns (boxes, lefted chars, mean height, boxes still needing recognition with their `box_image` crop).
+        """
+        lefted_chars = []
+        start = timer()
+        bxs = ocr.detect(np.array(img), device_id)
         logging.info(f"__ocr detecting boxes of a image cost ({timer() - start}s)")
 
         start = timer()
         if not bxs:
-            self.boxes.append([])
-            return
+            return [], lefted_chars, mean_height, []
         bxs = [(line[0], line[1][0]) for line in bxs]
         bxs = Recognizer.sort_Y_firstly(
             [{"x0": b[0][0] / ZM, "x1": b[1][0] / ZM,
@@ -309,19 +567,20 @@ class RAGFlowPdfParser:
               "bottom": b[-1][1] / ZM,
               "chars": [],
               "page_number": pagenum} for b, t in bxs if b[0][0] <= b[1][0] and b[0][1] <= b[-1][1]],
-            self.mean_height[pagenum-1] / 3
+            mean_height / 3
         )
 
         # merge chars in the same rect
-        for c in chars:
-            ii = Recognizer.find_overlapped(c, bxs)
-            if ii is None:
-                self.lefted_chars.append(c)
-                continue
-            ch = c["bottom"] - c["top"]
-            bh = bxs[ii]["bottom"] - bxs[ii]["top"]
-            if abs(ch - bh) / max(ch, bh) >= 0.7 and c["text"] != ' ':
-                self.lefted_chars.append(c)
+        box_ids = Recognizer.find_overlapped_batch(chars, bxs)
+        if chars and bxs:
+            ch = np.array([c["bottom"] - c["top"] for c in chars])
+            bh = np.array([b["bottom"] - b["top"] for b in bxs])[np.maximum(box_ids, 0)]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                height_mismatch = np.abs(ch - bh) / np.maximum(ch, bh) >= 0.7
+            box_ids[height_mismatch & np.array([c["text"] != ' ' for c in chars])] = -1
+        for c, ii in zip(chars, box_ids):
+            if ii < 0:
+                lefted_chars.append(c)
                 continue
             bxs[ii]["chars"].append(c)
 
@@ -330,7 +589,7 @@ class RAGFlowPdfParser:
                 del b["chars"]
                 continue
             m_ht = np.mean([c["height"] for c in b["chars"]])
-            for c in Recognizer.sort_Y_firstly(b["chars"], m_ht):
+            for c in Recognizer.sort_Y_firstly_by_lines(b["chars"], m_ht):
                 if c["text"] == " " and b["text"]:
                     if re.match(r"[0-9a-zA-Zа-яА-Я,.?;:!%%]", b["text"][-1]):
                         b["text"] += " "
@@ -339,31 +598,27 @@ class RAGFlowPdfParser:
             del b["chars"]
 
         logging.info(f"__ocr sorting {len(chars)} chars cost {timer() - start}s")
-        start = timer()
         boxes_to_reg = []
         img_np = np.array(img)
         for b in bxs:
             if not b["text"]:
                 left, right, top, bott = b["x0"] * ZM, b["x1"] * \
                                          ZM, b["top"] * ZM, b["bottom"] * ZM
-                b["box_image"] = self.ocr.get_rotate_crop_image(img_np, np.array([[left, top], [right, top], [right, bott], [left, bott]], dtype=np.float32))
+                b["box_image"] = ocr.get_rotate_crop_image(img_np, np.array([[left, top], [right, top], [right, bott], [left, bott]], dtype=np.float32))
                 boxes_to_reg.append(b)
             del b["txt"]
-        texts = self.ocr.recognize_batch([b["box_image"] for b in boxes_to_reg], device_id)
-        for i in range(len(boxes_to_reg)):
-            boxes_to_reg[i]["text"] = texts[i]
-            del boxes_to_reg[i]["box_image"]
-        logging.info(f"__ocr recognize {len(bxs)} boxes cost {timer() - start}s")
-        bxs = [b for b in bxs if b["text"]]
-        if self.mean_height[pagenum-1] == 0:
-            self.mean_height[pagenum-1] = np.median([b["bottom"] - b["top"]
-                                              for b in bxs])
-        self.boxes.append(bxs)
+        return bxs, lefted_chars, mean_height, boxes_to_reg
 
     def _layouts_rec(self, ZM, drop=True):
         assert len(self.page_images) == len(self.boxes)
+        layouts = self._layout_preds if len(getattr(self, "_layout_preds", [])) == len(self.page_images) else None
         self.boxes, self.page_layout = self.layouter(
-            self.page_images, self.boxes, ZM, drop=drop)
+            self.page_images, self.boxes, ZM, drop=drop, layouts=layouts)
+        self._layout_preds = []
+        # Only pages with tables or figures are cropped from again before chunking.
+        if isinstance(self.page_images, PdfPageImages):
+            self.page_images.keep([pn for pn, lts in enumerate(self.page_layout)
+                                   if any(lt["type"] in ["table", "figure"] for lt in lts)])
         # cumlative Y
         for i in range(len(self.boxes)):
             self.boxes[i]["top"] += \
@@ -373,74 +628,42 @@ class RAGFlowPdfParser:
 
     def _text_merge(self):
         # merge adjusted boxes
-        bxs = self.boxes
-
-        def end_with(b, txt):
-            txt = txt.strip()
-            tt = b.get("text", "").strip()
-            return tt and tt.find(txt) == len(tt) - len(txt)
-
-        def start_with(b, txts):
-            tt = b.get("text", "").strip()
-            return tt and any([tt.find(t.strip()) == 0 for t in txts])
-
-        # horizontally merge adjacent box with the same layout
-        i = 0
-        while i < len(bxs) - 1:
-            b = bxs[i]
-            b_ = bxs[i + 1]
+        # horizontally merge adjacent box with the same layout, into the previous kept box so it's one pass
+        bxs = []
+        for b_ in self.boxes:
+            if not bxs:
+                bxs.append(b_)
+                continue
+            b = bxs[-1]
             if b.get("layoutno", "0") != b_.get("layoutno", "1") or b.get("layout_type", "") in ["table", "figure",
                                                                                                  "equation"]:
-                i += 1
+                bxs.append(b_)
                 continue
             if abs(self._y_dis(b, b_)
-                   ) < self.mean_height[bxs[i]["page_number"] - 1] / 3:
+                   ) < self.mean_height[b["page_number"] - 1] / 3:
                 # merge
-                bxs[i]["x1"] = b_["x1"]
-                bxs[i]["top"] = (b["top"] + b_["top"]) / 2
-                bxs[i]["bottom"] = (b["bottom"] + b_["bottom"]) / 2
-                bxs[i]["text"] += b_["text"]
-                bxs.pop(i + 1)
+                b["x1"] = b_["x1"]
+                b["top"] = (b["top"] + b_["top"]) / 2
+                b["bottom"] = (b["bottom"] + b_["bottom"]) / 2
+                b["text"] += b_["text"]
                 continue
-            i += 1
-            continue
-
-            dis_thr = 1
-            dis = b["x1"] - b_["x0"]
-            if b.get("layout_type", "") != "text" or b_.get(
-                    "layout_type", "") != "text":
-                if end_with(b, "，") or start_with(b_, "（，"):
-                    dis_thr = -8
-                else:
-                    i += 1
-                    continue
-
-            if abs(self._y_dis(b, b_)) < self.mean_height[bxs[i]["page_number"] - 1] / 5 \
-                    and dis >= dis_thr and b["x1"] < b_["x1"]:
-                # merge
-                bxs[i]["x1"] = b_["x1"]
-                bxs[i]["top"] = (b["top"] + b_["top"]) / 2
-                bxs[i]["bottom"] = (b["bottom"] + b_["bottom"]) / 2
-                bxs[i]["text"] += b_["text"]
-                bxs.pop(i + 1)
-                continue
-            i += 1
+            bxs.append(b_)
         self.boxes = bxs
 
     def _naive_vertical_merge(self):
         bxs = Recognizer.sort_Y_firstly(
             self.boxes, np.median(
                 self.mean_height) / 3)
-        i = 0
-        while i + 1 < len(bxs):
-            b = bxs[i]
-            b_ = bxs[i + 1]
+        # b is the box being grown, merged boxes are dropped instead of popped so it's one pass
+        res = []
+        b = bxs[0] if bxs else None
+        for b_ in bxs[1:]:
             if b["page_number"] < b_["page_number"] and re.match(
                     r"[0-9  •一—-]+$", b["text"]):
-                bxs.pop(i)
+                b = b_
                 continue
             if not b["text"].strip():
-                bxs.pop(i)
+                b = b_
                 continue
             concatting_feats = [
                 b["text"].strip()[-1] in ",;:'\"，、‘“；：-",
@@ -468,15 +691,17 @@ class RAGFlowPdfParser:
                     any(feats),
                     any(concatting_feats),
                 ))
-                i += 1
+                res.append(b)
+                b = b_
                 continue
             # merge up and down
             b["bottom"] = b_["bottom"]
             b["text"] += b_["text"]
             b["x0"] = min(b["x0"], b_["x0"])
             b["x1"] = max(b["x1"], b_["x1"])
-            bxs.pop(i + 1)
-        self.boxes = bxs
+        if b is not None:
+            res.append(b)
+        self.boxes = res
 
     def _concat_downward(self, concat_between_pages=True):
         self.boxes = Recognizer.sort_Y_firstly(self.boxes, 0)
@@ -621,8 +846,7 @@ class RAGFlowPdfParser:
             for j in range(i, min(i + 128, len(self.boxes))):
                 if not re.match(prefix, self.boxes[j]["text"]):
                     continue
-                for k in range(i, j):
-                    self.boxes.pop(i)
+                del self.boxes[i:j]
                 break
         if findit:
             return
@@ -853,16 +1077,26 @@ class RAGFlowPdfParser:
                      [txt]))
                 positions.append(poss)
 
+        tbl_bxs = []
         for k, bxs in tables.items():
             if not bxs:
                 continue
-            bxs = Recognizer.sort_Y_firstly(bxs, np.mean(
-                [(b["bottom"] - b["top"]) / 2 for b in bxs]))
+            tbl_bxs.append(Recognizer.sort_Y_firstly(bxs, np.mean(
+                [(b["bottom"] - b["top"]) / 2 for b in bxs])))
+
+        # Many tables: build their HTML in worker processes while the crops are cut here.
+        tbl_futures = None
+        if TABLE_CONSTRUCT_WORKERS > 0 and len(tbl_bxs) >= 2 * TABLE_CONSTRUCT_WORKERS:
+            pool = get_table_process_pool()
+            tbl_futures = [pool.submit(TableStructureRecognizer.construct_table, bxs, html=return_html, is_english=bool(self.is_english))
+                           for bxs in tbl_bxs]
 
+        for i, bxs in enumerate(tbl_bxs):
             poss = []
 
-            res.append((cropout(bxs, "table", poss),
-                        self.tbl_det.construct_table(bxs, html=return_html, is_english=self.is_english)))
+            img = cropout(bxs, "table", poss)
+            res.append((img,
+                        tbl_futures[i].result() if tbl_futures else self.tbl_det.construct_table(bxs, html=return_html, is_english=self.is_english)))
             positions.append(poss)
 
         if separate_tables_figures:
@@ -909,8 +1143,8 @@ class RAGFlowPdfParser:
         page_images_cnt = len(self.page_images)
         if pn[-1] - 1 >= page_images_cnt:
             return ""
-        while bott * ZM > self.page_images[pn[-1] - 1].size[1]:
-            bott -= self.page_images[pn[-1] - 1].size[1] / ZM
+        while bott * ZM > self.page_images.size(pn[-1] - 1)[1]:
+            bott -= self.page_images.size(pn[-1] - 1)[1] / ZM
             pn.append(pn[-1] + 1)
             if pn[-1] - 1 >= page_images_cnt:
                 return ""
@@ -931,7 +1165,7 @@ class RAGFlowPdfParser:
             if b.get("layout_type"):
                 return True
             if width(
-                    b) > self.page_images[b["page_number"] - 1].size[0] / ZM / 3:
+                    b) > self.page_images.size(b["page_number"] - 1)[0] / ZM / 3:
                 return True
             if b["bottom"] - b["top"] > self.mean_height[b["page_number"] - 1]:
                 return True
@@ -941,7 +1175,7 @@ class RAGFlowPdfParser:
         while boxes:
             lines = []
             widths = []
-            pw = self.page_images[boxes[0]["page_number"] - 1].size[0] / ZM
+            pw = self.page_images.size(boxes[0]["page_number"] - 1)[0] / ZM
             mh = self.mean_height[boxes[0]["page_number"] - 1]
             mj = self.proj_match(
                 boxes[0]["text"]) or boxes[0].get(
@@ -1013,21 +1247,28 @@ class RAGFlowPdfParser:
         self.page_cum_height = [0]
         self.page_layout = []
         self.page_from = page_from
+        self._layout_preds = []
         start = timer()
+        if isinstance(getattr(self, "page_images", None), PdfPageImages):
+            self.page_images.close()
         try:
+            self.page_images = PdfPageImages(fnm, zoomin, page_from, page_to)
             with sys.modules[LOCK_KEY_pdfplumber]:
-                with (pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm))) as pdf:
-                    self.pdf = pdf
-                    self.page_images = [p.to_image(resolution=72 * zoomin, antialias=True).annotated for i, p in
-                                        enumerate(self.pdf.pages[page_from:page_to])]
-
-                    try:
-                        self.page_chars = [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in self.pdf.pages[page_from:page_to]]
-                    except Exception as e:
-                        logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
-                        self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
-
-                    self.total_page = len(self.pdf.pages)
+                pdf = self.page_images.pdf
+                try:
+                    self.page_chars = []
+                    self.page_text_layer = []
+                    for page in self.page_images.pages:
+                        chars = [c for c in page.dedupe_chars().chars if self._has_color(c)]
+                        self.page_chars.append(chars)
+                        self.page_text_layer.append(PDF_TEXT_LAYER_FAST_PATH and self._text_layer_usable(page, chars))
+                        page.flush_cache()
+                except Exception as e:
+                    logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
+                    self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
+                    self.page_text_layer = [False for _ in range(page_to - page_from)]
+
+                self.total_page = len(pdf.pages)
 
         except Exception:
             logging.exception("RAGFlowPdfParser __images__")
@@ -1065,7 +1306,12 @@ class RAGFlowPdfParser:
         else:
             self.is_english = False
 
-        async def __img_ocr(i, id, img, chars, limiter):
+        pool = None
+        if not self.parallel_limiter and PARALLEL_DEVICES == 0 and OCR_CPU_WORKERS > 0 and len(self.page_images) > 1:
+            pool = get_ocr_process_pool()
+        ocr_res = [None] * len(self.page_images)
+
+        def __space_chars(chars):
             j = 0
             while j + 1 < len(chars):
                 if chars[j]["text"] and chars[j + 1]["text"] \
@@ -1075,43 +1321,94 @@ class RAGFlowPdfParser:
                     chars[j]["text"] += " "
                 j += 1
 
-            if limiter:
+        def __ocr_preprocess(i):
+            chars = self.page_chars[i] if not self.is_english else []
+            self.mean_height.append(
+                np.median(sorted([c["height"] for c in chars])) if chars else 0
+            )
+            self.mean_width.append(
+                np.median(sorted([c["width"] for c in chars])) if chars else 8
+            )
+            __space_chars(chars)
+            return chars
+
+        async def __img_ocr(i, id, chars, limiter):
+            if pool:
+                chars = [{k: c[k] for k in OCR_CHAR_KEYS} for c in chars]
                 async with limiter:
-                    await trio.to_thread.run_sync(lambda: self.__ocr(i + 1, img, chars, zoomin, id))
+                    img = await trio.to_thread.run_sync(lambda: self.page_images[i])
+                    future = pool.submit(_ocr_page_in_process, i + 1, img, chars, self.mean_height[i], zoomin)
+                    ocr_res[i] = await trio.to_thread.run_sync(future.result)
             else:
-                self.__ocr(i + 1, img, chars, zoomin, id)
-
-            if callback and i % 6 == 5:
-                callback(prog=(i + 1) * 0.6 / len(self.page_images), msg="")
-
-        async def __img_ocr_launcher():
-            def __ocr_preprocess():
-                chars = self.page_chars[i] if not self.is_english else []
-                self.mean_height.append(
-                    np.median(sorted([c["height"] for c in chars])) if chars else 0
-                )
-                self.mean_width.append(
-                    np.median(sorted([c["width"] for c in chars])) if chars else 8
-                )
-                self.page_cum_height.append(img.size[1] / zoomin)
-                return chars
+                async with limiter:
+                    ocr_res[i] = await trio.to_thread.run_sync(
+                        lambda: self._ocr_page(self.ocr, i + 1, self.page_images[i], chars, self.mean_height[i], zoomin, id))
 
+        async def __img_ocr_launcher(pages):
             if self.parallel_limiter:
                 async with trio.open_nursery() as nursery:
-                    for i, img in enumerate(self.page_images):
-                        chars = __ocr_preprocess()
-
-                        nursery.start_soon(__img_ocr, i, i % PARALLEL_DEVICES, img, chars,
+                    for i, chars in pages:
+                        nursery.start_soon(__img_ocr, i, i % PARALLEL_DEVICES, chars,
                                            self.parallel_limiter[i % PARALLEL_DEVICES])
                         await trio.sleep(0.1)
-            else:
-                for i, img in enumerate(self.page_images):
-                    chars = __ocr_preprocess()
-                    await __img_ocr(i, 0, img, chars, None)
+            elif pool:
+                limiter = trio.CapacityLimiter(OCR_CPU_WORKERS)
+                async with trio.open_nursery() as nursery:
+                    for i, chars in pages:
+                        nursery.start_soon(__img_ocr, i, 0, chars, limiter)
+            elif pages:
+                # Detect page by page, then recognize the crops of the whole window at once.
+                ocr_pages = [(i + 1, self.page_images[i], chars, self.mean_height[i]) for i, chars in pages]
+                for (i, _), res in zip(pages, self._ocr_pages(self.ocr, ocr_pages, zoomin)):
+                    ocr_res[i] = res
 
         start = timer()
 
-        trio.run(__img_ocr_launcher)
+        # Pages go through OCR and layout detection one window at a time, so only a window's
+        # worth of rendered images is alive; later phases re-render the pages they crop from.
+        # Results of pages seen before (same pixels, text layer, zoom and models) come from the page cache.
+        window = self.page_images.cache_size
+        for page_start in range(0, len(self.page_images), window):
+            pages = range(page_start, min(page_start + window, len(self.page_images)))
+            to_ocr = []
+            for i in pages:
+                chars = __ocr_preprocess(i)
+                if self.page_text_layer[i]:
+                    # Born-digital page, its text layer is good enough to skip detection and recognition.
+                    if not chars:
+                        chars = self.page_chars[i]
+                        __space_chars(chars)
+                    mean_height = self.mean_height[i] or np.median([c["height"] for c in chars])
+                    ocr_res[i] = (self._boxes_from_chars(chars, i + 1, mean_height), [], mean_height)
+                    continue
+                ocr_key = (self.page_images.page_hash(i), zoomin, self._chars_digest(chars))
+                cached = get_page_cache("ocr", *ocr_key)
+                if cached:
+                    ocr_res[i] = (cached["boxes"], [], cached["mean_height"])
+                else:
+                    to_ocr.append((i, chars, ocr_key))
+            trio.run(__img_ocr_launcher, [(i, chars) for i, chars, _ in to_ocr])
+            for i, _, ocr_key in to_ocr:
+                set_page_cache("ocr", {"boxes": ocr_res[i][0], "mean_height": ocr_res[i][2]}, *ocr_key)
+
+            # Keep page order, layout recognition indexes boxes by page.
+            for i in pages:
+                bxs, lefted_chars, mean_height = ocr_res[i]
+                ocr_res[i] = None
+                self.boxes.append(bxs)
+                self.lefted_chars.extend(lefted_chars)
+                self.mean_height[i] = mean_height
+            if callback:
+                callback(prog=pages.stop * 0.6 / len(self.page_images), msg="")
+
+            layouts = [get_page_cache("layout", self.page_images.page_hash(i), self.layout_domain) for i in pages]
+            missing = [i for i, lts in zip(pages, layouts) if lts is None]
+            if missing:
+                for i, lts in zip(missing, self.layouter.detect([self.page_images[i] for i in missing])):
+                    layouts[i - page_start] = lts
+                    set_page_cache("layout", lts, self.page_images.page_hash(i), self.layout_domain)
+            self._layout_preds.extend(layouts)
+        self.page_cum_height = [0] + [self.page_images.size(i)[1] / zoomin for i in range(len(self.page_images))]
 
         logging.info(f"__images__ {len(self.page_images)} pages cost {timer() - start}s")
 
@@ -1165,38 +1462,38 @@ class RAGFlowPdfParser:
         poss.insert(0, ([pos[0][0]], pos[1], pos[2], max(
             0, pos[3] - 120), max(pos[3] - GAP, 0)))
         pos = poss[-1]
-        poss.append(([pos[0][-1]], pos[1], pos[2], min(self.page_images[pos[0][-1]].size[1] / ZM, pos[4] + GAP),
-                     min(self.page_images[pos[0][-1]].size[1] / ZM, pos[4] + 120)))
+        poss.append(([pos[0][-1]], pos[1], pos[2], min(self.page_images.size(pos[0][-1])[1] / ZM, pos[4] + GAP),
+                     min(self.page_images.size(pos[0][-1])[1] / ZM, pos[4] + 120)))
 
         positions = []
         for ii, (pns, left, right, top, bottom) in enumerate(poss):
             right = left + max_width
             bottom *= ZM
             for pn in pns[1:]:
-                bottom += self.page_images[pn - 1].size[1]
+                bottom += self.page_images.size(pn - 1)[1]
             imgs.append(
                 self.page_images[pns[0]].crop((left * ZM, top * ZM,
                                                right *
                                                ZM, min(
-                                                   bottom, self.page_images[pns[0]].size[1])
+                                                   bottom, self.page_images.size(pns[0])[1])
                                                ))
             )
             if 0 < ii < len(poss) - 1:
                 positions.append((pns[0] + self.page_from, left, right, top, min(
-                    bottom, self.page_images[pns[0]].size[1]) / ZM))
-            bottom -= self.page_images[pns[0]].size[1]
+                    bottom, self.page_images.size(pns[0])[1]) / ZM))
+            bottom -= self.page_images.size(pns[0])[1]
             for pn in pns[1:]:
                 imgs.append(
                     self.page_images[pn].crop((left * ZM, 0,
                                                right * ZM,
                                                min(bottom,
-                                                   self.page_images[pn].size[1])
+                                                   self.page_images.size(pn)[1])
                                                ))
                 )
                 if 0 < ii < len(poss) - 1:
                     positions.append((pn + self.page_from, left, right, 0, min(
-                        bottom, self.page_images[pn].size[1]) / ZM))
-                bottom -= self.page_images[pn].size[1]
+                        bottom, self.page_images.size(pn)[1]) / ZM))
+                bottom -= self.page_images.size(pn)[1]
 
         if not imgs:
             if need_position:
@@ -1230,13 +1527,13 @@ class RAGFlowPdfParser:
         top = bx["top"] - self.page_cum_height[pn - 1]
         bott = bx["bottom"] - self.page_cum_height[pn - 1]
         poss.append((pn, bx["x0"], bx["x1"], top, min(
-            bott, self.page_images[pn - 1].size[1] / ZM)))
-        while bott * ZM > self.page_images[pn - 1].size[1]:
-            bott -= self.page_images[pn - 1].size[1] / ZM
+            bott, self.page_images.size(pn - 1)[1] / ZM)))
+        while bott * ZM > self.page_images.size(pn - 1)[1]:
+            bott -= self.page_images.size(pn - 1)[1] / ZM
             top = 0
             pn += 1
             poss.append((pn, bx["x0"], bx["x1"], top, min(
-                bott, self.page_images[pn - 1].size[1] / ZM)))
+                bott, self.page_images.size(pn - 1)[1] / ZM)))
         return poss
 
 
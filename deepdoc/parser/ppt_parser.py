@@ -97,3 +97,11 @@ class RAGFlowPptParser:
             txts.append("\n".join(texts))
 
         return txts
+
+    @staticmethod
+    def total_page_number(fnm, binary=None):
+        try:
+            ppt = Presentation(fnm) if not binary else Presentation(BytesIO(binary))
+            return len(ppt.slides)
+        except Exception:
+            logging.exception("total_page_number")
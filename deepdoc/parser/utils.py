@@ -14,7 +14,18 @@
 #  limitations under the License.
 #
 
+import glob
+import json
+import logging
+import os
+from functools import lru_cache
+
+import numpy as np
+import xxhash
+
+from api.utils.file_utils import get_project_base_directory
 from rag.nlp import find_codec
+from rag.settings import DEEPDOC_MODEL_VARIANT, DEEPDOC_PAGE_CACHE_BUCKET, DEEPDOC_SESSION_OPTIONS
 
 
 def get_text(fnm: str, binary=None) -> str:
@@ -30,3 +41,59 @@ def get_text(fnm: str, binary=None) -> str:
                     break
                 txt += line
     return txt
+
+
+@lru_cache(maxsize=1)
+def deepdoc_models_version() -> str:
+    """
+    Digest of the deepdoc ONNX models and of the variant each session loads (see deepdoc.vision.ocr.session_config),
+    so cached page results die with a model update or a switch between e.g. the int8, fp16 and default models.
+    """
+    hasher = xxhash.xxh64()
+    variants = {nm: opts["variant"] for nm, opts in DEEPDOC_SESSION_OPTIONS.items() if isinstance(opts, dict) and "variant" in opts}
+    hasher.update(json.dumps([DEEPDOC_MODEL_VARIANT, variants], sort_keys=True).encode("utf-8"))
+    for path in sorted(glob.glob(os.path.join(get_project_base_directory(), "rag/res/deepdoc", "*.onnx"))):
+        hasher.update(os.path.basename(path).encode("utf-8"))
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                hasher.update(block)
+    return hasher.hexdigest()
+
+
+def page_cache_key(kind, *parts) -> str:
+    hasher = xxhash.xxh128()
+    for p in [kind, deepdoc_models_version(), *parts]:
+        hasher.update(str(p).encode("utf-8"))
+    return f"{kind}/{hasher.hexdigest()}"
+
+
+def _to_json(o):
+    if isinstance(o, (np.generic, np.ndarray)):
+        return o.tolist()
+    raise TypeError(f"{type(o)} is not JSON serializable")
+
+
+def get_page_cache(kind, *parts):
+    if not DEEPDOC_PAGE_CACHE_BUCKET:
+        return None
+    from rag.utils.storage_factory import STORAGE_IMPL
+    key = page_cache_key(kind, *parts)
+    try:
+        if not STORAGE_IMPL.obj_exist(DEEPDOC_PAGE_CACHE_BUCKET, key):
+            return None
+        bin = STORAGE_IMPL.get(DEEPDOC_PAGE_CACHE_BUCKET, key)
+        return json.loads(bin) if bin else None
+    except Exception:
+        logging.exception(f"get_page_cache {kind} got exception")
+        return None
+
+
+def set_page_cache(kind, value, *parts):
+    if not DEEPDOC_PAGE_CACHE_BUCKET:
+        return
+    from rag.utils.storage_factory import STORAGE_IMPL
+    try:
+        STORAGE_IMPL.put(DEEPDOC_PAGE_CACHE_BUCKET, page_cache_key(kind, *parts),
+                         json.dumps(value, ensure_ascii=False, default=_to_json).encode("utf-8"))
+    except Exception:
+        logging.exception(f"set_page_cache {kind} got exception")
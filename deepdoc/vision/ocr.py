@@ -18,11 +18,14 @@ import logging
 import copy
 import time
 import os
+import queue
+import threading
 
 from huggingface_hub import snapshot_download
 
 from api.utils.file_utils import get_project_base_directory
-from rag.settings import PARALLEL_DEVICES
+from rag.settings import PARALLEL_DEVICES, OCR_INTRA_OP_NUM_THREADS, OCR_INTER_OP_NUM_THREADS, OCR_REC_MAX_BATCH, OCR_REC_BATCH_WIDTH, \
+    DEEPDOC_SESSION_POOL_SIZE, DEEPDOC_GRAPH_OPTIMIZATION_LEVEL, DEEPDOC_MODEL_VARIANT, DEEPDOC_CPU_MEM_ARENA, DEEPDOC_SESSION_OPTIONS
 from .operators import *  # noqa: F403
 from . import operators
 import math
@@ -67,8 +70,79 @@ def create_operators(op_param_list, global_config=None):
     return ops
 
 
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+def session_config(nm):
+    """Session settings of model `nm`, defaults from rag.settings overridden by DEEPDOC_SESSION_OPTIONS[nm]."""
+    conf = {
+        "pool_size": DEEPDOC_SESSION_POOL_SIZE,
+        "intra_op_num_threads": OCR_INTRA_OP_NUM_THREADS,
+        "inter_op_num_threads": OCR_INTER_OP_NUM_THREADS,
+        "graph_optimization_level": DEEPDOC_GRAPH_OPTIMIZATION_LEVEL,
+        "variant": DEEPDOC_MODEL_VARIANT,
+        "enable_cpu_mem_arena": DEEPDOC_CPU_MEM_ARENA,
+        "providers": [],
+    }
+    conf.update(DEEPDOC_SESSION_OPTIONS.get(nm, {}))
+    return conf
+
+
+class SessionPool:
+    """
+    Up to `size` InferenceSessions of one model, created on demand and lent out for one run at a time.
+    Offers the part of the InferenceSession interface deepdoc uses, so it stands in for a session.
+    """
+
+    def __init__(self, create, size=1):
+        self._create = create
+        self.size = max(1, size)
+        self._lock = threading.Lock()
+        self._sessions = [create()]
+        # LIFO so the most recently used, warm session is picked first.
+        self._idle = queue.LifoQueue()
+        self._idle.put(self._sessions[0])
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._sessions) < self.size:
+                sess = self._create()
+                self._sessions.append(sess)
+                return sess
+        return self._idle.get()
+
+    def run(self, output_names, input_feed, run_options=None):
+        sess = self._acquire()
+        try:
+            return sess.run(output_names, input_feed, run_options)
+        finally:
+            self._idle.put(sess)
+
+    def get_inputs(self):
+        return self._sessions[0].get_inputs()
+
+    def get_outputs(self):
+        return self._sessions[0].get_outputs()
+
+
 def load_model(model_dir, nm, device_id: int | None = None):
+    conf = session_config(nm)
     model_file_path = os.path.join(model_dir, nm + ".onnx")
+    if conf["variant"]:
+        variant_file_path = os.path.join(model_dir, f"{nm}.{conf['variant']}.onnx")
+        if os.path.exists(variant_file_path):
+            model_file_path = variant_file_path
+        else:
+            logging.warning(f"load_model {variant_file_path} not found, uses {model_file_path}")
     model_cached_tag = model_file_path + str(device_id) if device_id is not None else model_file_path
 
     global loaded_models
@@ -91,44 +165,125 @@ def load_model(model_dir, nm, device_id: int | None = None):
         return False
 
     options = ort.SessionOptions()
-    options.enable_cpu_mem_arena = False
+    options.enable_cpu_mem_arena = bool(conf["enable_cpu_mem_arena"])
     options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
-    options.intra_op_num_threads = 2
-    options.inter_op_num_threads = 2
+    options.intra_op_num_threads = int(conf["intra_op_num_threads"])
+    options.inter_op_num_threads = int(conf["inter_op_num_threads"])
+    if conf["graph_optimization_level"]:
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[conf["graph_optimization_level"]]
 
     # https://github.com/microsoft/onnxruntime/issues/9509#issuecomment-951546580
     # Shrink GPU memory after execution
     run_options = ort.RunOptions()
-    if cuda_is_available():
+    if conf["providers"]:
+        def create():
+            return ort.InferenceSession(model_file_path, options=options, providers=conf["providers"])
+        logging.info(f"load_model {model_file_path} uses {conf['providers']}")
+    elif cuda_is_available():
         cuda_provider_options = {
             "device_id": device_id, # Use specific GPU
             "gpu_mem_limit": 512 * 1024 * 1024, # Limit gpu memory
             "arena_extend_strategy": "kNextPowerOfTwo",  # gpu memory allocation strategy
         }
-        sess = ort.InferenceSession(
-            model_file_path,
-            options=options,
-            providers=['CUDAExecutionProvider'],
-            provider_options=[cuda_provider_options]
-            )
+
+        def create():
+            return ort.InferenceSession(
+                model_file_path,
+                options=options,
+                providers=['CUDAExecutionProvider'],
+                provider_options=[cuda_provider_options]
+                )
         run_options.add_run_config_entry("memory.enable_memory_arena_shrinkage", "gpu:" + str(device_id))
         logging.info(f"load_model {model_file_path} uses GPU")
     else:
-        sess = ort.InferenceSession(
-            model_file_path,
-            options=options,
-            providers=['CPUExecutionProvider'])
+        def create():
+            return ort.InferenceSession(
+                model_file_path,
+                options=options,
+                providers=['CPUExecutionProvider'])
         run_options.add_run_config_entry("memory.enable_memory_arena_shrinkage", "cpu")
         logging.info(f"load_model {model_file_path} uses CPU")
-    loaded_model = (sess, run_options)
+    loaded_model = (SessionPool(create, int(conf["pool_size"])), run_options)
     loaded_models[model_cached_tag] = loaded_model
     return loaded_model
 
 
+class RecognitionQueue:
+    """
+    Merges concurrent recognition requests on one ONNX session into shared batches.
+    Up to `max_running` callers (one per pooled session) lead: each runs one batch of everything queued,
+    which includes its own request, then hands its place over to a waiting caller, so no caller keeps
+    working for the others. The others wait for their results.
+    """
+
+    def __init__(self, max_running=1):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._running = 0
+        self.max_running = max(1, max_running)
+
+    def run(self, recognize, img_list):
+        req = {"imgs": img_list, "wake": threading.Event(), "lead": False, "done": False, "res": None, "error": None}
+        with self._lock:
+            self._pending.append(req)
+            if self._running < self.max_running:
+                self._running += 1
+                req["lead"] = True
+
+        if not req["lead"]:
+            # Woken up either with the results or to lead.
+            req["wake"].wait()
+        if req["lead"]:
+            req["wake"].clear()
+            self._lead(recognize, req)
+
+        if req["error"]:
+            raise req["error"]
+        return req["res"]
+
+    def _lead(self, recognize, req):
+        while not req["done"]:
+            with self._lock:
+                reqs, self._pending = self._pending, []
+            if not reqs:
+                # Another leader has taken our request along.
+                req["wake"].wait()
+                continue
+            try:
+                rec_res = recognize([img for r in reqs for img in r["imgs"]])
+                i = 0
+                for r in reqs:
+                    r["res"] = rec_res[i: i + len(r["imgs"])]
+                    i += len(r["imgs"])
+            except Exception as e:
+                for r in reqs:
+                    r["error"] = e
+            for r in reqs:
+                r["done"] = True
+                r["wake"].set()
+
+        with self._lock:
+            nxt = next((r for r in self._pending if not r["lead"]), None)
+            if nxt:
+                nxt["lead"] = True
+            else:
+                self._running -= 1
+        if nxt:
+            nxt["wake"].set()
+
+
+recognition_queues = {}
+recognition_queues_lock = threading.Lock()
+
+
+def get_recognition_queue(key, max_running=1) -> RecognitionQueue:
+    with recognition_queues_lock:
+        return recognition_queues.setdefault(key, RecognitionQueue(max_running))
+
+
 class TextRecognizer:
     def __init__(self, model_dir, device_id: int | None = None):
         self.rec_image_shape = [int(v) for v in "3, 48, 320".split(",")]
-        self.rec_batch_num = 16
         postprocess_params = {
             'name': 'CTCLabelDecode',
             "character_dict_path": os.path.join(model_dir, "ocr.res"),
@@ -137,6 +292,8 @@ class TextRecognizer:
         self.postprocess_op = build_post_process(postprocess_params)
         self.predictor, self.run_options = load_model(model_dir, 'rec', device_id)
         self.input_tensor = self.predictor.get_inputs()[0]
+        # Sessions are shared through `loaded_models`, so are their queues.
+        self.queue = get_recognition_queue(id(self.predictor), self.predictor.size)
 
     def resize_norm_img(self, img, max_wh_ratio):
         imgC, imgH, imgW = self.rec_image_shape
@@ -349,6 +506,29 @@ class TextRecognizer:
         return img
 
     def __call__(self, img_list):
+        st = time.time()
+        if not img_list:
+            return [], time.time() - st
+        return self.queue.run(self._recognize, img_list), time.time() - st
+
+    def _batches(self, width_list):
+        """
+        Split crops sorted by aspect ratio into batches. Every crop of a batch is padded to the widest one,
+        so narrow crops go in large batches and wide ones in small batches.
+        """
+        imgC, imgH, imgW = self.rec_image_shape[:3]
+        beg = 0
+        while beg < len(width_list):
+            end = beg + 1
+            while end < len(width_list) and end - beg < OCR_REC_MAX_BATCH:
+                padded_w = max(imgW, imgH * width_list[end])
+                if (end + 1 - beg) * padded_w > OCR_REC_BATCH_WIDTH:
+                    break
+                end += 1
+            yield beg, end
+            beg = end
+
+    def _recognize(self, img_list):
         img_num = len(img_list)
         # Calculate the aspect ratio of all text bars
         width_list = []
@@ -356,20 +536,13 @@ class TextRecognizer:
             width_list.append(img.shape[1] / float(img.shape[0]))
         # Sorting can speed up the recognition process
         indices = np.argsort(np.array(width_list))
+        sorted_width_list = [width_list[i] for i in indices]
         rec_res = [['', 0.0]] * img_num
-        batch_num = self.rec_batch_num
-        st = time.time()
 
-        for beg_img_no in range(0, img_num, batch_num):
-            end_img_no = min(img_num, beg_img_no + batch_num)
+        for beg_img_no, end_img_no in self._batches(sorted_width_list):
             norm_img_batch = []
             imgC, imgH, imgW = self.rec_image_shape[:3]
-            max_wh_ratio = imgW / imgH
-            # max_wh_ratio = 0
-            for ino in range(beg_img_no, end_img_no):
-                h, w = img_list[indices[ino]].shape[0:2]
-                wh_ratio = w * 1.0 / h
-                max_wh_ratio = max(max_wh_ratio, wh_ratio)
+            max_wh_ratio = max(imgW / imgH, sorted_width_list[end_img_no - 1])
             for ino in range(beg_img_no, end_img_no):
                 norm_img = self.resize_norm_img(img_list[indices[ino]],
                                                 max_wh_ratio)
@@ -393,7 +566,7 @@ class TextRecognizer:
             for rno in range(len(rec_result)):
                 rec_res[indices[beg_img_no + rno]] = rec_result[rno]
 
-        return rec_res, time.time() - st
+        return rec_res
 
 
 class TextDetector:
@@ -50,6 +50,9 @@ class Recognizer:
         self.output_names = [node.name for node in self.ort_sess.get_outputs()]
         self.input_shape = self.ort_sess.get_inputs()[0].shape[2:4]
         self.label_list = label_list
+        # Images are resized to one input shape, so a dynamic batch axis lets a whole batch go in one run.
+        batch_dim = self.ort_sess.get_inputs()[0].shape[0]
+        self.batch_inference = "scale_factor" not in self.input_names and (not isinstance(batch_dim, int) or batch_dim < 0)
 
     @staticmethod
     def sort_Y_firstly(arr, threshold):
@@ -61,6 +64,28 @@ class Recognizer:
         arr = sorted(arr, key=cmp_to_key(cmp))
         return arr
 
+    @staticmethod
+    def sort_Y_firstly_by_lines(arr, threshold):
+        """
+        Reading order like `sort_Y_firstly`, computed with arrays instead of a comparator:
+        items sorted by top start a new line when their top is `threshold` or more below the previous one,
+        and are ordered by x0 within a line.
+        """
+        if len(arr) < 2:
+            return list(arr)
+        order, _ = Recognizer.reading_lines(arr, threshold)
+        return [arr[i] for i in order]
+
+    @staticmethod
+    def reading_lines(arr, threshold):
+        """Reading order of `arr` as in `sort_Y_firstly_by_lines`, with the line number of every item in that order."""
+        tops = np.array([a["top"] for a in arr], dtype=np.float64)
+        x0s = np.array([a["x0"] for a in arr], dtype=np.float64)
+        order = np.argsort(tops, kind="stable")
+        lines = np.concatenate([[0], np.cumsum(np.diff(tops[order]) >= threshold)]).astype(np.int64)
+        pos = np.lexsort((x0s[order], lines))
+        return order[pos], lines[pos]
+
     @staticmethod
     def sort_X_firstly(arr, threshold):
         def cmp(c1, c2):
@@ -71,44 +96,50 @@ class Recognizer:
         arr = sorted(arr, key=cmp_to_key(cmp))
         return arr
 
+    @staticmethod
+    def sort_runs_by(arr, fld, key):
+        """
+        Stable-sort every run of consecutive items having `fld` by `key`, items without `fld` keep their place.
+        Same result as bubbling adjacent `fld` items into `key` order, in O(n log n).
+        """
+        res, run = [], []
+        for a in arr:
+            if fld in a:
+                run.append(a)
+                continue
+            res.extend(sorted(run, key=key))
+            res.append(a)
+            run = []
+        res.extend(sorted(run, key=key))
+        return res
+
     @staticmethod
     def sort_C_firstly(arr, thr=0):
         # sort using y1 first and then x1
         # sorted(arr, key=lambda r: (r["x0"], r["top"]))
         arr = Recognizer.sort_X_firstly(arr, thr)
-        for i in range(len(arr) - 1):
-            for j in range(i, -1, -1):
-                # restore the order using th
-                if "C" not in arr[j] or "C" not in arr[j + 1]:
-                    continue
-                if arr[j + 1]["C"] < arr[j]["C"] \
-                        or (
-                        arr[j + 1]["C"] == arr[j]["C"]
-                        and arr[j + 1]["top"] < arr[j]["top"]
-                ):
-                    tmp = arr[j]
-                    arr[j] = arr[j + 1]
-                    arr[j + 1] = tmp
-        return arr
+        # restore the order using th
+        return Recognizer.sort_runs_by(arr, "C", lambda r: (r["C"], r["top"]))
 
     @staticmethod
     def sort_R_firstly(arr, thr=0):
         # sort using y1 first and then x1
         # sorted(arr, key=lambda r: (r["top"], r["x0"]))
         arr = Recognizer.sort_Y_firstly(arr, thr)
-        for i in range(len(arr) - 1):
-            for j in range(i, -1, -1):
-                if "R" not in arr[j] or "R" not in arr[j + 1]:
-                    continue
-                if arr[j + 1]["R"] < arr[j]["R"] \
-                        or (
-                        arr[j + 1]["R"] == arr[j]["R"]
-                        and arr[j + 1]["x0"] < arr[j]["x0"]
-                ):
-                    tmp = arr[j]
-                    arr[j] = arr[j + 1]
-                    arr[j + 1] = tmp
-        return arr
+        return Recognizer.sort_runs_by(arr, "R", lambda r: (r["R"], r["x0"]))
+
+    @staticmethod
+    def box_columns(boxes):
+        """x0, x1, top and bottom of `boxes` as float arrays."""
+        return tuple(np.array([b[k] for b in boxes], dtype=np.float64) for k in ["x0", "x1", "top", "bottom"])
+
+    @staticmethod
+    def overlapped_areas(columns, box):
+        """`overlapped_area(b, box, False)` for every box b of `columns` at once."""
+        x0, x1, top, bottom = columns
+        w = np.minimum(x1, box["x1"]) - np.maximum(x0, box["x0"])
+        h = np.minimum(bottom, box["bottom"]) - np.maximum(top, box["top"])
+        return np.where((w >= 0) & (h >= 0) & (x1 != x0) & (bottom != top), w * h, 0)
 
     @staticmethod
     def overlapped_area(a, b, ratio=True):
@@ -139,6 +170,7 @@ class Recognizer:
                         a["bottom"] < b["top"],
                         a["top"] > b["bottom"]])
 
+        box_columns = None
         i = 0
         while i + 1 < len(layouts):
             j = i + 1
@@ -161,12 +193,10 @@ class Recognizer:
                     layouts.pop(i)
                 continue
 
-            area_i, area_i_1 = 0, 0
-            for b in boxes:
-                if not not_overlapped(b, layouts[i]):
-                    area_i += Recognizer.overlapped_area(b, layouts[i], False)
-                if not not_overlapped(b, layouts[j]):
-                    area_i_1 += Recognizer.overlapped_area(b, layouts[j], False)
+            if box_columns is None:
+                box_columns = Recognizer.box_columns(boxes)
+            area_i = Recognizer.overlapped_areas(box_columns, layouts[i]).sum()
+            area_i_1 = Recognizer.overlapped_areas(box_columns, layouts[j]).sum()
 
             if area_i > area_i_1:
                 layouts.pop(j)
@@ -249,6 +279,37 @@ class Recognizer:
 
         return max_overlapped_i
 
+    @staticmethod
+    def find_overlapped_batch(items, boxes, chunk_size=512):
+        """
+        `find_overlapped` for many small items (e.g. pdf chars) at once.
+        Box coordinates are held in arrays; items are matched in chunks sorted by top, each against only the boxes
+        spanning the chunk's vertical range. Returns, per item, the index of the box whose area it covers
+        the largest share of, or -1.
+        """
+        res = np.full(len(items), -1, dtype=np.int64)
+        if not items or not boxes:
+            return res
+        bx0, bx1, btop, bbtm = Recognizer.box_columns(boxes)
+        barea = (bx1 - bx0) * (bbtm - btop)
+        ix0, ix1, itop, ibtm = Recognizer.box_columns(items)
+
+        order = np.argsort(itop, kind="stable")
+        for st in range(0, len(order), chunk_size):
+            ii = order[st: st + chunk_size]
+            cand = np.nonzero((bbtm >= itop[ii].min()) & (btop <= ibtm[ii].max()))[0]
+            if not len(cand):
+                continue
+            w = np.minimum(ix1[ii, None], bx1[None, cand]) - np.maximum(ix0[ii, None], bx0[None, cand])
+            h = np.minimum(ibtm[ii, None], bbtm[None, cand]) - np.maximum(itop[ii, None], btop[None, cand])
+            ov = np.where((w >= 0) & (h >= 0) & (barea[None, cand] != 0), w * h, 0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ov = np.where(ov > 0, ov / barea[None, cand], 0)
+            best = np.argmax(ov, axis=1)
+            found = ov[np.arange(len(ii)), best] > 0
+            res[ii[found]] = cand[best[found]]
+        return res
+
     @staticmethod
     def find_horizontally_tightest_fit(box, boxes):
         if not boxes:
@@ -408,20 +469,20 @@ class Recognizer:
 
     def __call__(self, image_list, thr=0.7, batch_size=16):
         res = []
-        images = []
-        for i in range(len(image_list)):
-            if not isinstance(image_list[i], np.ndarray):
-                images.append(np.array(image_list[i]))
-            else:
-                images.append(image_list[i])
-
-        batch_loop_cnt = math.ceil(float(len(images)) / batch_size)
+        # Convert one batch at a time, pages may be rendered lazily and should not all be resident.
+        batch_loop_cnt = math.ceil(float(len(image_list)) / batch_size)
         for i in range(batch_loop_cnt):
             start_index = i * batch_size
-            end_index = min((i + 1) * batch_size, len(images))
-            batch_image_list = images[start_index:end_index]
+            end_index = min((i + 1) * batch_size, len(image_list))
+            batch_image_list = [img if isinstance(img, np.ndarray) else np.array(img)
+                                for img in image_list[start_index:end_index]]
             inputs = self.preprocess(batch_image_list)
             logging.debug("preprocess")
+            if self.batch_inference and len(inputs) > 1:
+                outputs = self.ort_sess.run(None, {k: np.concatenate([ins[k] for ins in inputs]) for k in self.input_names}, self.run_options)[0]
+                for j, ins in enumerate(inputs):
+                    res.append(self.postprocess(outputs[j: j + 1], ins, thr))
+                continue
             for ins in inputs:
                 bb = self.postprocess(self.ort_sess.run(None, {k:v for k,v in ins.items() if k in self.input_names}, self.run_options)[0], ins, thr)
                 res.append(bb)
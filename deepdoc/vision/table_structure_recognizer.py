@@ -23,6 +23,7 @@ from huggingface_hub import snapshot_download
 
 from api.utils.file_utils import get_project_base_directory
 from rag.nlp import rag_tokenizer
+from .ocr import get_recognition_queue
 from .recognizer import Recognizer
 
 
@@ -47,7 +48,8 @@ class TableStructureRecognizer(Recognizer):
                                               local_dir_use_symlinks=False))
 
     def __call__(self, images, thr=0.2):
-        tbls = super().__call__(images, thr)
+        # Table crops of concurrent tasks on the shared session are recognized in common batches.
+        tbls = get_recognition_queue((id(self.ort_sess), thr), self.ort_sess.size).run(lambda imgs: super(TableStructureRecognizer, self).__call__(imgs, thr), images)
         res = []
         # align left&right for rows, align top&bottom for columns
         for tbl in tbls:
@@ -56,7 +58,9 @@ class TableStructureRecognizer(Recognizer):
                     "x0": b["bbox"][0], "x1": b["bbox"][2],
                     "top": b["bbox"][1], "bottom": b["bbox"][-1]
                     } for b in tbl]
+            # Keep one entry per image, callers map results back to their tables by position.
             if not lts:
+                res.append([])
                 continue
 
             left = [b["x0"] for b in lts if b["label"].find(
@@ -64,6 +68,7 @@ class TableStructureRecognizer(Recognizer):
             right = [b["x1"] for b in lts if b["label"].find(
                 "row") > 0 or b["label"].find("header") > 0]
             if not left:
+                res.append([])
                 continue
             left = np.mean(left) if len(left) > 4 else np.min(left)
             right = np.mean(right) if len(right) > 4 else np.max(right)
@@ -9,10 +9,12 @@ import logging
 import json
 import os
 import re
+from copy import deepcopy
 from typing import Callable
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import networkx as nx
 import pandas as pd
+import xxhash
 
 from api.utils.api_utils import timeout
 from graphrag.general import leiden
@@ -31,6 +33,7 @@ class CommunityReportsResult:
 
     output: list[str]
     structured_output: list[dict]
+    partition: dict[str, int] = field(default_factory=dict)
 
 
 class CommunityReportsExtractor(Extractor):
@@ -51,19 +54,27 @@ class CommunityReportsExtractor(Extractor):
         self._extraction_prompt = COMMUNITY_REPORT_PROMPT
         self._max_report_length = max_report_length or 1500
 
-    async def __call__(self, graph: nx.Graph, callback: Callable | None = None):
+    async def __call__(self, graph: nx.Graph, callback: Callable | None = None, previous_reports: dict[str, dict] | None = None,
+                       starting_communities: dict[str, int] | None = None):
+        """
+        `previous_reports` maps community content hashes to reports generated before. Communities whose members and
+        member descriptions didn't change reuse them instead of being summarized again.
+        `starting_communities` is the level-0 partition of the previous run, used to warm-start Leiden.
+        """
         enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
+        previous_reports = previous_reports or {}
         for node_degree in graph.degree:
             graph.nodes[str(node_degree[0])]["rank"] = int(node_degree[1])
 
-        communities: dict[str, dict[str, list]] = leiden.run(graph, {})
+        communities: dict[str, dict[str, list]] = leiden.run(graph, {"starting_communities": starting_communities})
+        partition = {n: int(cm_id) for cm_id, cm in communities.get(0, {}).items() for n in cm["nodes"]}
         total = sum([len(comm.items()) for _, comm in communities.items()])
         res_str = []
         res_dict = []
-        over, token_count = 0, 0
+        over, reused, token_count = 0, 0, 0
         @timeout(120)
         async def extract_community_report(community):
-            nonlocal res_str, res_dict, over, token_count
+            nonlocal res_str, res_dict, over, reused, token_count
             cm_id, cm = community
             weight = cm["weight"]
             ents = cm["nodes"]
@@ -87,6 +98,18 @@ class CommunityReportsExtractor(Extractor):
                     k += 1
             rela_df = pd.DataFrame(rela_list)
 
+            cm_hash = self._community_hash(graph, ent_list, rela_list)
+            if cm_hash in previous_reports:
+                response = deepcopy(previous_reports[cm_hash])
+                response["weight"] = weight
+                response["entities"] = ents
+                add_community_info2graph(graph, ents, response["title"])
+                res_str.append(self._get_text_output(response))
+                res_dict.append(response)
+                over += 1
+                reused += 1
+                return
+
             prompt_variables = {
                 "entity_df": ent_df.to_csv(index_label="id"),
                 "relation_df": rela_df.to_csv(index_label="id")
@@ -124,6 +147,7 @@ class CommunityReportsExtractor(Extractor):
                 return
             response["weight"] = weight
             response["entities"] = ents
+            response["community_hash"] = cm_hash
             add_community_info2graph(graph, ents, response["title"])
             res_str.append(self._get_text_output(response))
             res_dict.append(response)
@@ -138,13 +162,25 @@ class CommunityReportsExtractor(Extractor):
                 for community in comm.items():
                     nursery.start_soon(extract_community_report, community)
         if callback:
-            callback(msg=f"Community reports done in {trio.current_time() - st:.2f}s, used tokens: {token_count}")
+            callback(msg=f"Community reports done in {trio.current_time() - st:.2f}s, {reused} reused, used tokens: {token_count}")
 
         return CommunityReportsResult(
             structured_output=res_dict,
             output=res_str,
+            partition=partition,
         )
 
+    @staticmethod
+    def _community_hash(graph: nx.Graph, ent_list: list[dict], rela_list: list[dict]) -> str:
+        """Hash of what a community report is generated from: its members, their descriptions and sources, and their relations."""
+        hasher = xxhash.xxh64()
+        for ent in sorted(ent_list, key=lambda e: e["entity"]):
+            hasher.update(json.dumps([ent["entity"], ent["description"], sorted(graph.nodes[ent["entity"]].get("source_id", []))],
+                                     ensure_ascii=False).encode("utf-8"))
+        for rela in sorted(rela_list, key=lambda r: (r["source"], r["target"])):
+            hasher.update(json.dumps([rela["source"], rela["target"], rela["description"]], ensure_ascii=False).encode("utf-8"))
+        return hasher.hexdigest()
+
     def _get_text_output(self, parsed_output: dict) -> str:
         title = parsed_output.get("title", "Report")
         summary = parsed_output.get("summary", "")
@@ -13,8 +13,10 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import json
 import logging
 import re
+from abc import ABC, abstractmethod
 from collections import defaultdict, Counter
 from copy import deepcopy
 from typing import Callable
@@ -24,14 +26,47 @@ import networkx as nx
 from api.utils.api_utils import timeout
 from graphrag.general.graph_prompt import SUMMARIZE_DESCRIPTIONS_PROMPT
 from graphrag.utils import get_llm_cache, set_llm_cache, handle_single_entity_extraction, \
-    handle_single_relationship_extraction, split_string_by_multi_markers, flat_uniq_list, chat_limiter, get_from_to, GraphChange
+    handle_single_relationship_extraction, split_string_by_multi_markers, flat_uniq_list, chat_limiter, get_from_to, GraphChange, clean_str
 from rag.llm.chat_model import Base as CompletionLLM
 from rag.prompts import message_fit_in
-from rag.utils import truncate
+from rag.utils import truncate, num_tokens_from_string
 
 GRAPH_FIELD_SEP = "<SEP>"
 DEFAULT_ENTITY_TYPES = ["organization", "person", "geo", "event", "category"]
 ENTITY_EXTRACTION_MAX_GLEANINGS = 2
+CHUNK_PACK_DELIMITER = "-----Chunk {}-----"
+
+
+class ChunkRecordsMixin(ABC):
+    """
+    Entity and relation extraction from document chunks, used by the graph extractors with `Extractor.__call__`.
+    Subclasses run their extraction prompt in `_extract_records`, one chunk or a pack of chunks at a time.
+    """
+
+    @abstractmethod
+    async def _extract_records(self, content: str) -> tuple[list[str], int]:
+        """Run the extraction prompt (with gleanings) over `content`, returning raw records and the token count."""
+
+    async def _process_single_content(self, chunk_key_dp: tuple[str, str], chunk_seq: int, num_chunks: int, out_results):
+        chunk_key, content = chunk_key_dp
+        records, token_count = await self._extract_records(content)
+        maybe_nodes, maybe_edges = self._entities_and_relations(chunk_key, records, self._tuple_delimiter)
+        out_results.append((maybe_nodes, maybe_edges, token_count))
+        if self.callback:
+            self.callback(0.5+0.1*len(out_results)/num_chunks, msg = f"Entities extraction of chunk {chunk_seq} {len(out_results)}/{num_chunks} done, {len(maybe_nodes)} nodes, {len(maybe_edges)} edges, {token_count} tokens.")
+
+    async def _process_packed_content(self, chunk_key: str, contents: list[str], num_chunks: int, out_results):
+        content = "\n\n".join(CHUNK_PACK_DELIMITER.format(i + 1) + "\n" + ck for i, ck in enumerate(contents))
+        records, token_count = await self._extract_records(content)
+        nodes_cnt, edges_cnt = 0, 0
+        for i, (ck, ck_records) in enumerate(zip(contents, self._attribute_records(records, contents))):
+            self._set_packed_records_cache(ck, ck_records)
+            maybe_nodes, maybe_edges = self._entities_and_relations(chunk_key, ck_records, self._tuple_delimiter)
+            nodes_cnt += len(maybe_nodes)
+            edges_cnt += len(maybe_edges)
+            out_results.append((maybe_nodes, maybe_edges, token_count if i == 0 else 0))
+        if self.callback:
+            self.callback(0.5+0.1*len(out_results)/num_chunks, msg = f"Entities extraction of a pack of {len(contents)} chunks {len(out_results)}/{num_chunks} done, {nodes_cnt} nodes, {edges_cnt} edges, {token_count} tokens.")
 
 
 class Extractor:
@@ -42,10 +77,14 @@ class Extractor:
         llm_invoker: CompletionLLM,
         language: str | None = "English",
         entity_types: list[str] | None = None,
+        pack_token_num: int = 0,
     ):
         self._llm = llm_invoker
         self._language = language
         self._entity_types = entity_types or DEFAULT_ENTITY_TYPES
+        # When positive, consecutive chunks are packed into one extraction request up to this many tokens.
+        self._pack_token_num = pack_token_num or 0
+        self._tuple_delimiter = "<|>"
 
     @timeout(60*20)
     def _chat(self, system, history, gen_conf={}):
@@ -94,6 +133,67 @@ class Extractor:
                 )
         return dict(maybe_nodes), dict(maybe_edges)
 
+    def _pack_budget(self) -> int:
+        return min(self._pack_token_num, int(self._llm.max_length * 0.8))
+
+    def _pack_chunks(self, chunks: list[str], indexes: list[int]) -> list[list[int]]:
+        """
+        Group consecutive chunks into packs whose total size stays within the pack token budget.
+        A chunk larger than the budget is packed alone.
+        """
+        budget = self._pack_budget()
+        packs = []
+        pack, pack_tokens = [], 0
+        for i in indexes:
+            n = num_tokens_from_string(chunks[i]) + num_tokens_from_string(CHUNK_PACK_DELIMITER.format(len(pack) + 1))
+            if pack and (pack_tokens + n > budget or pack[-1] != i - 1):
+                packs.append(pack)
+                pack, pack_tokens = [], 0
+            pack.append(i)
+            pack_tokens += n
+        if pack:
+            packs.append(pack)
+        return packs
+
+    def _packed_records_cache_key(self, content: str) -> str:
+        return f"{self.__class__.__module__}\n{self._language}\n{','.join(self._entity_types)}\n{content}"
+
+    def _get_packed_records_cache(self, content: str) -> list[str] | None:
+        bin = get_llm_cache(self._llm.llm_name, self._packed_records_cache_key(content), [], {"packed": True})
+        if not bin:
+            return None
+        try:
+            return json.loads(bin)
+        except Exception as e:
+            logging.exception(e)
+        return None
+
+    def _set_packed_records_cache(self, content: str, records: list[str]):
+        set_llm_cache(self._llm.llm_name, self._packed_records_cache_key(content), json.dumps(records, ensure_ascii=False), [], {"packed": True})
+
+    def _attribute_records(self, records: list[str], contents: list[str]) -> list[list[str]]:
+        """
+        Attribute every record extracted from a pack back to one of its chunks:
+        the first chunk mentioning all the names of the record, then any of them, then the first chunk.
+        """
+        lowered = [c.lower() for c in contents]
+        per_chunk = [[] for _ in contents]
+        for record in records:
+            record_attributes = split_string_by_multi_markers(record, [self._tuple_delimiter])
+            names = []
+            if len(record_attributes) >= 2 and record_attributes[0] == '"entity"':
+                names = record_attributes[1:2]
+            elif len(record_attributes) >= 3 and record_attributes[0] == '"relationship"':
+                names = record_attributes[1:3]
+            names = [n for n in [clean_str(n).lower() for n in names] if n]
+            idx = 0
+            if names:
+                all_hits = [i for i, c in enumerate(lowered) if all(n in c for n in names)]
+                any_hits = [i for i, c in enumerate(lowered) if any(n in c for n in names)]
+                idx = (all_hits or any_hits or [0])[0]
+            per_chunk[idx].append(record)
+        return per_chunk
+
     async def __call__(
         self, doc_id: str, chunks: list[str],
             callback: Callable | None = None
@@ -103,9 +203,25 @@ class Extractor:
         start_ts = trio.current_time()
         out_results = []
         async with trio.open_nursery() as nursery:
-            for i, ck in enumerate(chunks):
-                ck = truncate(ck, int(self._llm.max_length*0.8))
-                nursery.start_soon(self._process_single_content, (doc_id, ck), i, len(chunks), out_results)
+            if self._pack_token_num > 0:
+                # Truncated as without packing, a chunk over the pack budget makes a pack of its own.
+                chunks = [truncate(ck, int(self._llm.max_length*0.8)) for ck in chunks]
+                pending = []
+                for i, ck in enumerate(chunks):
+                    records = self._get_packed_records_cache(ck)
+                    if records is None:
+                        pending.append(i)
+                        continue
+                    maybe_nodes, maybe_edges = self._entities_and_relations(doc_id, records, self._tuple_delimiter)
+                    out_results.append((maybe_nodes, maybe_edges, 0))
+                if callback and len(pending) < len(chunks):
+                    callback(msg=f"Entities extraction of {len(chunks) - len(pending)}/{len(chunks)} chunks hit the cache.")
+                for pack in self._pack_chunks(chunks, pending):
+                    nursery.start_soon(self._process_packed_content, doc_id, [chunks[i] for i in pack], len(chunks), out_results)
+            else:
+                for i, ck in enumerate(chunks):
+                    ck = truncate(ck, int(self._llm.max_length*0.8))
+                    nursery.start_soon(self._process_single_content, (doc_id, ck), i, len(chunks), out_results)
 
         maybe_nodes = defaultdict(list)
         maybe_edges = defaultdict(list)
@@ -11,7 +11,7 @@ from dataclasses import dataclass
 import tiktoken
 import trio
 
-from graphrag.general.extractor import Extractor, ENTITY_EXTRACTION_MAX_GLEANINGS
+from graphrag.general.extractor import ChunkRecordsMixin, Extractor, ENTITY_EXTRACTION_MAX_GLEANINGS
 from graphrag.general.graph_prompt import GRAPH_EXTRACTION_PROMPT, CONTINUE_PROMPT, LOOP_PROMPT
 from graphrag.utils import ErrorHandlerFn, perform_variable_replacements, chat_limiter, split_string_by_multi_markers
 from rag.llm.chat_model import Base as CompletionLLM
@@ -31,7 +31,7 @@ class GraphExtractionResult:
     source_docs: dict[Any, Any]
 
 
-class GraphExtractor(Extractor):
+class GraphExtractor(ChunkRecordsMixin, Extractor):
     """Unipartite graph extractor class definition."""
 
     _join_descriptions: bool
@@ -61,8 +61,9 @@ class GraphExtractor(Extractor):
         join_descriptions=True,
         max_gleanings: int | None = None,
         on_error: ErrorHandlerFn | None = None,
+        pack_token_num: int = 0,
     ):
-        super().__init__(llm_invoker, language, entity_types)
+        super().__init__(llm_invoker, language, entity_types, pack_token_num)
         """Init method definition."""
         # TODO: streamline construction
         self._llm = llm_invoker
@@ -96,11 +97,10 @@ class GraphExtractor(Extractor):
             self._completion_delimiter_key: DEFAULT_COMPLETION_DELIMITER,
             self._entity_types_key: ",".join(entity_types),
         }
+        self._tuple_delimiter = DEFAULT_TUPLE_DELIMITER
 
-    async def _process_single_content(self, chunk_key_dp: tuple[str, str], chunk_seq: int, num_chunks: int, out_results):
+    async def _extract_records(self, content: str) -> tuple[list[str], int]:
         token_count = 0
-        chunk_key = chunk_key_dp[0]
-        content = chunk_key_dp[1]
         variables = {
             **self._prompt_variables,
             self._input_text_key: content,
@@ -143,8 +143,4 @@ class GraphExtractor(Extractor):
             if record is None:
                 continue
             rcds.append(record.group(1))
-        records = rcds
-        maybe_nodes, maybe_edges = self._entities_and_relations(chunk_key, records, self._prompt_variables[self._tuple_delimiter_key])
-        out_results.append((maybe_nodes, maybe_edges, token_count))
-        if self.callback:
-            self.callback(0.5+0.1*len(out_results)/num_chunks, msg = f"Entities extraction of chunk {chunk_seq} {len(out_results)}/{num_chunks} done, {len(maybe_nodes)} nodes, {len(maybe_edges)} edges, {token_count} tokens.")
+        return rcds, token_count
@@ -21,7 +21,7 @@ import networkx as nx
 import trio
 
 from api import settings
-from api.utils import get_uuid
+from api.db.services.task_service import TaskCanceledException
 from api.utils.api_utils import timeout
 from graphrag.light.graph_extractor import GraphExtractor as LightKGExt
 from graphrag.general.graph_extractor import GraphExtractor as GeneralKGExt
@@ -36,10 +36,18 @@ from graphrag.utils import (
     does_graph_contains,
     tidy_graph,
     GraphChange,
+    set_graph_version,
+    get_community_state,
+    set_community_state,
+    community_report_id,
 )
 from rag.nlp import rag_tokenizer, search
-from rag.utils.redis_conn import RedisDistributedLock
+from rag.utils.redis_conn import RedisDistributedLock, REDIS_CONN
 
+GRAPHRAG_MERGE_BATCH_SIZE = int(os.environ.get("GRAPHRAG_MERGE_BATCH_SIZE", 32))
+GRAPHRAG_MERGE_POLL_INTERVAL = 2
+# Seconds a document waits for its subgraph to be merged, including merges of other documents queued before it.
+GRAPHRAG_MERGE_TIMEOUT = int(os.environ.get("GRAPHRAG_MERGE_TIMEOUT", 3*3600))
 
 
 async def run_graphrag(
@@ -74,60 +82,189 @@ async def run_graphrag(
             chat_model,
             embedding_model,
             callback,
+            pack_token_num=row["kb_parser_config"]["graphrag"].get("pack_token_num", 0),
         )
 
     if not subgraph:
         return
 
+    # Hand the subgraph over to the KB's merge queue. Whoever holds the KB's lock folds every queued
+    # subgraph into the global graph batch by batch, so documents don't go through the merge one by one.
+    REDIS_CONN.delete(graphrag_merged_key(kb_id, doc_id))
+    message = {
+        "doc_id": doc_id,
+        "subgraph": nx.node_link_data(subgraph, edges="edges"),
+        "with_resolution": with_resolution,
+        "with_community": with_community,
+    }
+    if not REDIS_CONN.queue_product(graphrag_merge_queue(kb_id), message):
+        raise Exception(f"Failed to queue the subgraph of {doc_id} for merging.")
+    callback(msg=f"run_graphrag {doc_id} subgraph queued for merging")
+
     graphrag_task_lock = RedisDistributedLock(f"graphrag_task_{kb_id}", lock_value=doc_id, timeout=1200)
-    await graphrag_task_lock.spin_acquire()
-    callback(msg=f"run_graphrag {doc_id} graphrag_task_lock acquired")
+    deadline = trio.current_time() + GRAPHRAG_MERGE_TIMEOUT
+    while True:
+        merged = REDIS_CONN.get(graphrag_merged_key(kb_id, doc_id))
+        if merged is not None:
+            break
+        if trio.current_time() > deadline:
+            raise Exception(f"Merging the subgraph of {doc_id} timed out after {GRAPHRAG_MERGE_TIMEOUT} seconds.")
+        if not graphrag_task_lock.acquire():
+            await trio.sleep(GRAPHRAG_MERGE_POLL_INTERVAL)
+            continue
+        callback(msg=f"run_graphrag {doc_id} graphrag_task_lock acquired")
+        try:
+            async with trio.open_nursery() as nursery:
+                # A queue of big batches outlasts the lock's timeout, keep it until the queue is drained.
+                nursery.start_soon(keep_lock, graphrag_task_lock)
+                await merge_queued_subgraphs(tenant_id, kb_id, graphrag_task_lock, chat_model, embedding_model, callback)
+                nursery.cancel_scope.cancel()
+        finally:
+            graphrag_task_lock.release()
+        merged = REDIS_CONN.get(graphrag_merged_key(kb_id, doc_id))
+        if merged is None:
+            # Drained the queue itself, yet has no result: the queue or the result couldn't be read.
+            raise Exception(f"Merging the subgraph of {doc_id} left no result.")
+        break
+    if merged != "ok":
+        raise Exception(f"Merging the subgraph of {doc_id} failed: {merged}")
+    now = trio.current_time()
+    callback(msg=f"GraphRAG for doc {doc_id} done in {now - start:.2f} seconds.")
+    return
+
+
+def graphrag_merge_queue(kb_id):
+    return f"graphrag_merge_{kb_id}"
+
+
+def graphrag_merged_key(kb_id, doc_id):
+    return f"graphrag_merged_{kb_id}_{doc_id}"
+
+
+async def merge_queued_subgraphs(
+    tenant_id: str,
+    kb_id: str,
+    graphrag_task_lock: RedisDistributedLock,
+    chat_model,
+    embedding_model,
+    callback,
+):
+    """
+    Drain the merge queue of the KB. Must be called with the KB's graphrag_task_lock held.
+    Each batch costs one graph load, one PageRank and one persistence write, plus one resolution
+    and one community pass if any document of the batch asked for them.
+    """
+    queue = graphrag_merge_queue(kb_id)
+    while True:
+        messages = REDIS_CONN.queue_range(queue, GRAPHRAG_MERGE_BATCH_SIZE)
+        if not messages:
+            return
+        try:
+            await merge_batch(tenant_id, kb_id, [msg for _, msg in messages], graphrag_task_lock, chat_model, embedding_model, callback)
+            results = ["ok"] * len(messages)
+        except TaskCanceledException:
+            # Only the task of this worker is canceled, the queued subgraphs are left to the workers of their documents.
+            raise
+        except Exception as e:
+            logging.exception(e)
+            if len(messages) == 1:
+                results = [str(e) or repr(e)]
+            else:
+                # Don't fail every document of the batch for one of them, merge them one by one instead.
+                callback(msg=f"run_graphrag merging a batch of {len(messages)} subgraphs failed, merging them one by one")
+                results = []
+                for _, msg in messages:
+                    try:
+                        await merge_batch(tenant_id, kb_id, [msg], graphrag_task_lock, chat_model, embedding_model, callback)
+                        results.append("ok")
+                    except TaskCanceledException:
+                        raise
+                    except Exception as e:
+                        logging.exception(e)
+                        results.append(str(e) or repr(e))
+        set_merged(kb_id, messages, results)
+        await graphrag_task_lock.spin_acquire()
+
+
+def set_merged(kb_id, messages, results):
+    """
+    Report the merge results to the documents of the queued `messages` and drop them from the queue.
+    Messages whose result couldn't be written stay queued and an exception is raised.
+    """
+    written, failed = [], []
+    for (msg_id, msg), result in zip(messages, results):
+        if REDIS_CONN.set(graphrag_merged_key(kb_id, msg["doc_id"]), result, 24*3600):
+            written.append(msg_id)
+        else:
+            failed.append(msg["doc_id"])
+    REDIS_CONN.queue_delete(graphrag_merge_queue(kb_id), written)
+    if failed:
+        raise Exception(f"Failed to record the merge results of {failed}.")
+
 
-    try:
-        subgraph_nodes = set(subgraph.nodes())
-        new_graph = await merge_subgraph(
+async def keep_lock(lock: RedisDistributedLock):
+    """Keep `lock` from expiring while a long merge holds it, until cancelled."""
+    while True:
+        await trio.sleep(lock.timeout / 3)
+        lock.refresh()
+
+
+async def merge_batch(
+    tenant_id: str,
+    kb_id: str,
+    messages: list[dict],
+    graphrag_task_lock: RedisDistributedLock,
+    chat_model,
+    embedding_model,
+    callback,
+):
+    subgraphs = {}
+    with_resolution, with_community = False, False
+    for msg in messages:
+        subgraphs[msg["doc_id"]] = nx.node_link_graph(msg["subgraph"], edges="edges")
+        with_resolution |= msg.get("with_resolution", False)
+        with_community |= msg.get("with_community", False)
+    doc_ids = list(subgraphs.keys())
+    callback(msg=f"run_graphrag merging a batch of {len(doc_ids)} subgraphs")
+
+    subgraph_nodes = set([n for g in subgraphs.values() for n in g.nodes()])
+    with trio.fail_after(len(subgraphs)*60*3 if os.environ.get("ENABLE_TIMEOUT_ASSERTION") else 10000000000):
+        new_graph = await merge_subgraphs(
             tenant_id,
             kb_id,
-            doc_id,
-            subgraph,
+            list(subgraphs.values()),
             embedding_model,
             callback,
         )
-        assert new_graph is not None
-
-        if not with_resolution and not with_community:
-            return
+    if new_graph is None:
+        callback(msg=f"run_graphrag {doc_ids} nothing to merge")
+        return
 
-        if with_resolution:
-            await graphrag_task_lock.spin_acquire()
-            callback(msg=f"run_graphrag {doc_id} graphrag_task_lock acquired")
-            await resolve_entities(
-                new_graph,
-                subgraph_nodes,
-                tenant_id,
-                kb_id,
-                doc_id,
-                chat_model,
-                embedding_model,
-                callback,
-            )
-        if with_community:
-            await graphrag_task_lock.spin_acquire()
-            callback(msg=f"run_graphrag {doc_id} graphrag_task_lock acquired")
-            await extract_community(
-                new_graph,
-                tenant_id,
-                kb_id,
-                doc_id,
-                chat_model,
-                embedding_model,
-                callback,
-            )
-    finally:
-        graphrag_task_lock.release()
-    now = trio.current_time()
-    callback(msg=f"GraphRAG for doc {doc_id} done in {now - start:.2f} seconds.")
-    return
+    if with_resolution:
+        await graphrag_task_lock.spin_acquire()
+        callback(msg=f"run_graphrag {doc_ids} graphrag_task_lock acquired")
+        await resolve_entities(
+            new_graph,
+            subgraph_nodes,
+            tenant_id,
+            kb_id,
+            doc_ids,
+            chat_model,
+            embedding_model,
+            callback,
+        )
+    if with_community:
+        await graphrag_task_lock.spin_acquire()
+        callback(msg=f"run_graphrag {doc_ids} graphrag_task_lock acquired")
+        await extract_community(
+            new_graph,
+            tenant_id,
+            kb_id,
+            doc_ids,
+            chat_model,
+            embedding_model,
+            callback,
+        )
 
 
 async def generate_subgraph(
@@ -141,6 +278,7 @@ async def generate_subgraph(
     llm_bdl,
     embed_bdl,
     callback,
+    pack_token_num: int = 0,
 ):
     contains = await does_graph_contains(tenant_id, kb_id, doc_id)
     if contains:
@@ -151,6 +289,7 @@ async def generate_subgraph(
         llm_bdl,
         language=language,
         entity_types=entity_types,
+        pack_token_num=pack_token_num,
     )
     ents, rels = await ext(doc_id, chunks, callback)
     subgraph = nx.Graph()
@@ -202,26 +341,31 @@ async def generate_subgraph(
     return subgraph
 
 
-@timeout(60*3)
-async def merge_subgraph(
+async def merge_subgraphs(
     tenant_id: str,
     kb_id: str,
-    doc_id: str,
-    subgraph: nx.Graph,
+    subgraphs: list[nx.Graph],
     embedding_model,
     callback,
 ):
     start = trio.current_time()
     change = GraphChange()
-    old_graph = await get_graph(tenant_id, kb_id, subgraph.graph["source_id"])
+    doc_ids = [doc_id for subgraph in subgraphs for doc_id in subgraph.graph["source_id"]]
+    old_graph = await get_graph(tenant_id, kb_id, doc_ids)
     if old_graph is not None:
         logging.info("Merge with an exiting graph...................")
         tidy_graph(old_graph, callback)
-        new_graph = graph_merge(old_graph, subgraph, change)
+        new_graph = old_graph
     else:
-        new_graph = subgraph
-        change.added_updated_nodes = set(new_graph.nodes())
-        change.added_updated_edges = set(new_graph.edges())
+        new_graph = nx.Graph()
+        new_graph.graph["source_id"] = []
+    for subgraph in subgraphs:
+        if set(subgraph.graph["source_id"]) & set(new_graph.graph.get("source_id", [])):
+            # Queued again after it was merged, e.g. by a retried task.
+            continue
+        new_graph = graph_merge(new_graph, subgraph, change)
+    if not change.added_updated_nodes:
+        return old_graph
     pr = nx.pagerank(new_graph)
     for node_name, pagerank in pr.items():
         new_graph.nodes[node_name]["pagerank"] = pagerank
@@ -229,7 +373,7 @@ async def merge_subgraph(
     await set_graph(tenant_id, kb_id, embedding_model, new_graph, change, callback)
     now = trio.current_time()
     callback(
-        msg=f"merging subgraph for doc {doc_id} into the global graph done in {now - start:.2f} seconds."
+        msg=f"merging subgraphs of {len(subgraphs)} docs into the global graph done in {now - start:.2f} seconds."
     )
     return new_graph
 
@@ -240,7 +384,7 @@ async def resolve_entities(
     subgraph_nodes: set[str],
     tenant_id: str,
     kb_id: str,
-    doc_id: str,
+    doc_ids: list[str],
     llm_bdl,
     embed_bdl,
     callback,
@@ -265,19 +409,20 @@ async def extract_community(
     graph,
     tenant_id: str,
     kb_id: str,
-    doc_id: str,
+    doc_ids: list[str],
     llm_bdl,
     embed_bdl,
     callback,
 ):
     start = trio.current_time()
+    state = await get_community_state(tenant_id, kb_id)
+    prev_reports = state.get("reports", {})
     ext = CommunityReportsExtractor(
         llm_bdl,
     )
-    cr = await ext(graph, callback=callback)
+    cr = await ext(graph, callback=callback, previous_reports=prev_reports, starting_communities=state.get("partition"))
     community_structure = cr.structured_output
     community_reports = cr.output
-    doc_ids = graph.graph["source_id"]
 
     now = trio.current_time()
     callback(
@@ -285,13 +430,19 @@ async def extract_community(
     )
     start = now
     chunks = []
+    reports = {}
     for stru, rep in zip(community_structure, community_reports):
+        cm_hash = stru["community_hash"]
+        reports[cm_hash] = stru
+        if cm_hash in prev_reports and prev_reports[cm_hash]["weight"] == stru["weight"]:
+            # Already indexed as is.
+            continue
         obj = {
             "report": rep,
             "evidences": "\n".join([f.get("explanation", "") for f in stru["findings"]]),
         }
         chunk = {
-            "id": get_uuid(),
+            "id": community_report_id(kb_id, cm_hash),
             "docnm_kwd": stru["title"],
             "title_tks": rag_tokenizer.tokenize(stru["title"]),
             "content_with_weight": json.dumps(obj, ensure_ascii=False),
@@ -303,7 +454,7 @@ async def extract_community(
             "entities_kwd": stru["entities"],
             "important_kwd": stru["entities"],
             "kb_id": kb_id,
-            "source_id": list(doc_ids),
+            "source_id": sorted(set([s for n in stru["entities"] for s in graph.nodes[n].get("source_id", [])])),
             "available_int": 0,
         }
         chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(
@@ -311,22 +462,36 @@ async def extract_community(
         )
         chunks.append(chunk)
 
-    await trio.to_thread.run_sync(
-        lambda: settings.docStoreConn.delete(
-            {"knowledge_graph_kwd": "community_report", "kb_id": kb_id},
-            search.index_name(tenant_id),
-            kb_id,
+    if not state:
+        # Reports indexed before community state was kept can't be matched, start over.
+        await trio.to_thread.run_sync(
+            lambda: settings.docStoreConn.delete(
+                {"knowledge_graph_kwd": "community_report", "kb_id": kb_id},
+                search.index_name(tenant_id),
+                kb_id,
+            )
         )
-    )
+    else:
+        stale_ids = [community_report_id(kb_id, h) for h in prev_reports if h not in reports]
+        if stale_ids:
+            await trio.to_thread.run_sync(
+                lambda: settings.docStoreConn.delete(
+                    {"knowledge_graph_kwd": "community_report", "id": stale_ids},
+                    search.index_name(tenant_id),
+                    kb_id,
+                )
+            )
     es_bulk_size = 4
     for b in range(0, len(chunks), es_bulk_size):
         doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks[b:b + es_bulk_size], search.index_name(tenant_id), kb_id))
         if doc_store_result:
             error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
             raise Exception(error_message)
+    await set_community_state(tenant_id, kb_id, cr.partition, reports)
+    set_graph_version(kb_id)
 
     now = trio.current_time()
     callback(
-        msg=f"Graph indexed {len(cr.structured_output)} communities in {now - start:.2f}s."
+        msg=f"Graph indexed {len(chunks)} of {len(cr.structured_output)} communities in {now - start:.2f}s."
     )
     return community_structure, community_reports
@@ -74,6 +74,7 @@ def _compute_leiden_communities(
         max_cluster_size: int,
         use_lcc: bool,
         seed=0xDEADBEEF,
+        starting_communities: dict[str, int] | None = None,
 ) -> dict[int, dict[str, int]]:
     """Return Leiden root communities."""
     results: dict[int, dict[str, int]] = {}
@@ -82,8 +83,17 @@ def _compute_leiden_communities(
     if use_lcc:
         graph = stable_largest_connected_component(graph)
 
+    if starting_communities:
+        # Warm start from a previous partition. Nodes unseen before start in their own community.
+        starting_communities = {n: int(c) for n, c in starting_communities.items() if graph.has_node(n)}
+        next_community = max(starting_communities.values(), default=-1) + 1
+        for n in graph.nodes():
+            if n not in starting_communities:
+                starting_communities[n] = next_community
+                next_community += 1
+
     community_mapping = hierarchical_leiden(
-        graph, max_cluster_size=max_cluster_size, random_seed=seed
+        graph, max_cluster_size=max_cluster_size, random_seed=seed, starting_communities=starting_communities or None
     )
     for partition in community_mapping:
         results[partition.level] = results.get(partition.level, {})
@@ -109,6 +119,7 @@ def run(graph: nx.Graph, args: dict[str, Any]) -> dict[int, dict[str, dict]]:
         max_cluster_size=max_cluster_size,
         use_lcc=use_lcc,
         seed=args.get("seed", 0xDEADBEEF),
+        starting_communities=args.get("starting_communities"),
     )
     levels = args.get("levels")
 
@@ -7,7 +7,7 @@ Reference:
 import re
 from typing import Any
 from dataclasses import dataclass
-from graphrag.general.extractor import Extractor, ENTITY_EXTRACTION_MAX_GLEANINGS
+from graphrag.general.extractor import ChunkRecordsMixin, Extractor, ENTITY_EXTRACTION_MAX_GLEANINGS
 from graphrag.light.graph_prompt import PROMPTS
 from graphrag.utils import pack_user_ass_to_openai_messages, split_string_by_multi_markers, chat_limiter
 from rag.llm.chat_model import Base as CompletionLLM
@@ -24,7 +24,7 @@ class GraphExtractionResult:
     source_docs: dict[Any, Any]
 
 
-class GraphExtractor(Extractor):
+class GraphExtractor(ChunkRecordsMixin, Extractor):
 
     _max_gleanings: int
 
@@ -35,8 +35,9 @@ class GraphExtractor(Extractor):
         entity_types: list[str] | None = None,
         example_number: int = 2,
         max_gleanings: int | None = None,
+        pack_token_num: int = 0,
     ):
-        super().__init__(llm_invoker, language, entity_types)
+        super().__init__(llm_invoker, language, entity_types, pack_token_num)
         """Init method definition."""
         self._max_gleanings = (
             max_gleanings
@@ -68,6 +69,7 @@ class GraphExtractor(Extractor):
             language=self._language,
         )
 
+        self._tuple_delimiter = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
         self._continue_prompt = PROMPTS["entiti_continue_extraction"]
         self._if_loop_prompt = PROMPTS["entiti_if_loop_extraction"]
 
@@ -78,10 +80,8 @@ class GraphExtractor(Extractor):
         )
         self._left_token_count = max(llm_invoker.max_length * 0.6, self._left_token_count)
 
-    async def _process_single_content(self, chunk_key_dp: tuple[str, str], chunk_seq: int, num_chunks: int, out_results):
+    async def _extract_records(self, content: str) -> tuple[list[str], int]:
         token_count = 0
-        chunk_key = chunk_key_dp[0]
-        content = chunk_key_dp[1]
         hint_prompt = self._entity_extract_prompt.format(
             **self._context_base, input_text="{input_text}"
         ).format(**self._context_base, input_text=content)
@@ -117,8 +117,4 @@ class GraphExtractor(Extractor):
             if record is None:
                 continue
             rcds.append(record.group(1))
-        records = rcds
-        maybe_nodes, maybe_edges = self._entities_and_relations(chunk_key, records, self._context_base["tuple_delimiter"])
-        out_results.append((maybe_nodes, maybe_edges, token_count))
-        if self.callback:
-            self.callback(0.5+0.1*len(out_results)/num_chunks, msg = f"Entities extraction of chunk {chunk_seq} {len(out_results)}/{num_chunks} done, {len(maybe_nodes)} nodes, {len(maybe_edges)} edges, {token_count} tokens.")
+        return rcds, token_count
@@ -16,6 +16,7 @@
 import json
 import logging
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 import json_repair
 import pandas as pd
@@ -23,12 +24,16 @@ import trio
 
 from api.utils import get_uuid
 from graphrag.query_analyze_prompt import PROMPTS
-from graphrag.utils import get_entity_type2sampels, get_llm_cache, set_llm_cache, get_relation
+from graphrag.utils import get_entity_type2sampels, get_llm_cache, set_llm_cache, get_graph_versions, \
+    get_query_rewrite_cache, set_query_rewrite_cache
 from rag.utils import num_tokens_from_string, get_float
-from rag.utils.doc_store_conn import OrderByExpr
+from rag.utils.doc_store_conn import OrderByExpr, MatchDenseExpr
 
 from rag.nlp.search import Dealer, index_name
 
+# Runs the query rewrite and the question-only searches of KGSearch.retrieval side by side.
+kg_search_executor = ThreadPoolExecutor(max_workers=16)
+
 
 class KGSearch(Dealer):
     def _chat(self, llm_bdl, system, history, gen_conf):
@@ -42,6 +47,16 @@ class KGSearch(Dealer):
         return response
 
     def query_rewrite(self, llm, question, idxnms, kb_ids):
+        versions = get_graph_versions(kb_ids)
+        cached = get_query_rewrite_cache(llm.llm_name, question, kb_ids, versions)
+        if cached:
+            return cached["answer_type_keywords"], cached["entities_from_query"]
+        type_keywords, entities_from_query = self._query_rewrite(llm, question, idxnms, kb_ids)
+        set_query_rewrite_cache(llm.llm_name, question, kb_ids, versions,
+                                {"answer_type_keywords": type_keywords, "entities_from_query": entities_from_query})
+        return type_keywords, entities_from_query
+
+    def _query_rewrite(self, llm, question, idxnms, kb_ids):
         ty2ents = trio.run(lambda: get_entity_type2sampels(idxnms, kb_ids))
         hint_prompt = PROMPTS["minirag_query2kwd"].format(query=question,
                                                           TYPE_POOL=json.dumps(ty2ents, ensure_ascii=False, indent=2))
@@ -103,40 +118,82 @@ class KGSearch(Dealer):
             }
         return res
 
+    def _ents_by_keywords_req(self, matchDense, filters, idxnms, kb_ids, N=56):
+        filters = deepcopy(filters)
+        filters["knowledge_graph_kwd"] = "entity"
+        return dict(selectFields=["content_with_weight", "entity_kwd", "rank_flt"], highlightFields=[], condition=filters,
+                    matchExprs=[matchDense], orderBy=OrderByExpr(), offset=0, limit=N, indexNames=idxnms, knowledgebaseIds=kb_ids)
+
+    def _relations_by_txt_req(self, matchDense, filters, idxnms, kb_ids, N=56):
+        filters = deepcopy(filters)
+        filters["knowledge_graph_kwd"] = "relation"
+        return dict(selectFields=["content_with_weight", "_score", "from_entity_kwd", "to_entity_kwd", "weight_int"], highlightFields=[],
+                    condition=filters, matchExprs=[matchDense], orderBy=OrderByExpr(), offset=0, limit=N, indexNames=idxnms, knowledgebaseIds=kb_ids)
+
+    def _ents_by_types_req(self, types, filters, idxnms, kb_ids, N=56):
+        filters = deepcopy(filters)
+        filters["knowledge_graph_kwd"] = "entity"
+        filters["entity_type_kwd"] = types
+        ordr = OrderByExpr()
+        ordr.desc("rank_flt")
+        return dict(selectFields=["entity_kwd", "rank_flt"], highlightFields=[], condition=filters,
+                    matchExprs=[], orderBy=ordr, offset=0, limit=N, indexNames=idxnms, knowledgebaseIds=kb_ids)
+
     def get_relevant_ents_by_keywords(self, keywords, filters, idxnms, kb_ids, emb_mdl, sim_thr=0.3, N=56):
         if not keywords:
             return {}
-        filters = deepcopy(filters)
-        filters["knowledge_graph_kwd"] = "entity"
         matchDense = self.get_vector(", ".join(keywords), emb_mdl, 1024, sim_thr)
-        es_res = self.dataStore.search(["content_with_weight", "entity_kwd", "rank_flt"], [], filters, [matchDense],
-                                       OrderByExpr(), 0, N,
-                                       idxnms, kb_ids)
+        es_res = self.dataStore.search(**self._ents_by_keywords_req(matchDense, filters, idxnms, kb_ids, N))
         return self._ent_info_from_(es_res, sim_thr)
 
     def get_relevant_relations_by_txt(self, txt, filters, idxnms, kb_ids, emb_mdl, sim_thr=0.3, N=56):
         if not txt:
             return {}
-        filters = deepcopy(filters)
-        filters["knowledge_graph_kwd"] = "relation"
         matchDense = self.get_vector(txt, emb_mdl, 1024, sim_thr)
-        es_res = self.dataStore.search(
-            ["content_with_weight", "_score", "from_entity_kwd", "to_entity_kwd", "weight_int"],
-            [], filters, [matchDense], OrderByExpr(), 0, N, idxnms, kb_ids)
+        es_res = self.dataStore.search(**self._relations_by_txt_req(matchDense, filters, idxnms, kb_ids, N))
         return self._relation_info_from_(es_res, sim_thr)
 
     def get_relevant_ents_by_types(self, types, filters, idxnms, kb_ids, N=56):
         if not types:
             return {}
-        filters = deepcopy(filters)
-        filters["knowledge_graph_kwd"] = "entity"
-        filters["entity_type_kwd"] = types
-        ordr = OrderByExpr()
-        ordr.desc("rank_flt")
-        es_res = self.dataStore.search(["entity_kwd", "rank_flt"], [], filters, [], ordr, 0, N,
-                                       idxnms, kb_ids)
+        es_res = self.dataStore.search(**self._ents_by_types_req(types, filters, idxnms, kb_ids, N))
         return self._ent_info_from_(es_res, 0)
 
+    def _relations_by_question_(self, qst, filters, idxnms, kb_ids, emb_mdl, sim_thr=0.3, N=56):
+        matchDense = self.get_vector(qst, emb_mdl, 1024, sim_thr)
+        es_res = self.dataStore.search(**self._relations_by_txt_req(matchDense, filters, idxnms, kb_ids, N))
+        return matchDense, self._relation_info_from_(es_res, sim_thr)
+
+    def _relation_descriptions_(self, pairs, filters, idxnms, kb_ids):
+        """
+        Fetch the descriptions of all the given (from, to) entity pairs in one lookup, keyed by the sorted pair.
+        """
+        pairs = set([tuple(sorted(p)) for p in pairs])
+        if not pairs:
+            return {}
+        ents = sorted(set([n for p in pairs for n in p]))
+        filters = deepcopy(filters)
+        filters["knowledge_graph_kwd"] = ["relation"]
+        filters["from_entity_kwd"] = ents
+        filters["to_entity_kwd"] = ents
+        es_res = self.dataStore.search(["content_with_weight", "from_entity_kwd", "to_entity_kwd"], [], filters, [],
+                                       OrderByExpr(), 0, max(len(ents) * len(ents), 64), idxnms, kb_ids)
+        res = {}
+        for _, rel in self.dataStore.getFields(es_res, ["content_with_weight", "from_entity_kwd", "to_entity_kwd"]).items():
+            f, t = rel.get("from_entity_kwd"), rel.get("to_entity_kwd")
+            if isinstance(f, list):
+                f = f[0]
+            if isinstance(t, list):
+                t = t[0]
+            pair = tuple(sorted([f, t]))
+            if pair not in pairs or pair in res:
+                continue
+            try:
+                res[pair] = json.loads(rel["content_with_weight"])["description"]
+            except Exception:
+                continue
+        return res
+
     def retrieval(self, question: str,
                tenant_ids: str | list[str],
                kb_ids: list[str],
@@ -155,18 +212,32 @@ class KGSearch(Dealer):
         if isinstance(tenant_ids, str):
             tenant_ids = tenant_ids.split(",")
         idxnms = [index_name(tid) for tid in tenant_ids]
+        # Relations are searched by the question itself, so they don't have to wait for the LLM rewrite.
+        rewrite_future = kg_search_executor.submit(self.query_rewrite, llm, qst, idxnms, kb_ids)
+        rels_future = kg_search_executor.submit(self._relations_by_question_, qst, filters, idxnms, kb_ids, emb_mdl, rel_sim_threshold)
         ty_kwds = []
         try:
-            ty_kwds, ents = self.query_rewrite(llm, qst, [index_name(tid) for tid in tenant_ids], kb_ids)
+            ty_kwds, ents = rewrite_future.result()
             logging.info(f"Q: {qst}, Types: {ty_kwds}, Entities: {ents}")
         except Exception as e:
             logging.exception(e)
             ents = [qst]
             pass
 
-        ents_from_query = self.get_relevant_ents_by_keywords(ents, filters, idxnms, kb_ids, emb_mdl, ent_sim_threshold)
-        ents_from_types = self.get_relevant_ents_by_types(ty_kwds, filters, idxnms, kb_ids, 10000)
-        rels_from_txt = self.get_relevant_relations_by_txt(qst, filters, idxnms, kb_ids, emb_mdl, rel_sim_threshold)
+        searches = {}
+        if ents:
+            if ", ".join(ents) == qst:
+                qst_vec, _ = rels_future.result()
+                matchDense = MatchDenseExpr(qst_vec.vector_column_name, qst_vec.embedding_data, 'float', 'cosine', 1024, {"similarity": ent_sim_threshold})
+            else:
+                matchDense = self.get_vector(", ".join(ents), emb_mdl, 1024, ent_sim_threshold)
+            searches["ents"] = self._ents_by_keywords_req(matchDense, filters, idxnms, kb_ids)
+        if ty_kwds:
+            searches["types"] = self._ents_by_types_req(ty_kwds, filters, idxnms, kb_ids, 10000)
+        es_res = dict(zip(searches.keys(), self.dataStore.multiSearch(list(searches.values()))))
+        ents_from_query = self._ent_info_from_(es_res["ents"], ent_sim_threshold) if "ents" in es_res else {}
+        ents_from_types = self._ent_info_from_(es_res["types"], 0) if "types" in es_res else {}
+        _, rels_from_txt = rels_future.result()
         nhop_pathes = defaultdict(dict)
         for _, ent in ents_from_query.items():
             nhops = ent.get("n_hop_ents", [])
@@ -237,15 +308,13 @@ class KGSearch(Dealer):
                 ents = ents[:-1]
                 break
 
+        rel_descs = self._relation_descriptions_([(f, t) for (f, t), rel in rels_from_txt if not rel.get("description")],
+                                                 filters, idxnms, kb_ids)
         for (f, t), rel in rels_from_txt:
             if not rel.get("description"):
-                for tid in tenant_ids:
-                    rela = get_relation(tid, kb_ids, f, t)
-                    if rela:
-                        break
-                else:
+                if tuple(sorted([f, t])) not in rel_descs:
                     continue
-                rel["description"] = rela["description"]
+                rel["description"] = rel_descs[tuple(sorted([f, t]))]
             desc = rel["description"]
             try:
                 desc = json.loads(desc).get("description", "")
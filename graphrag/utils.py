@@ -158,6 +158,79 @@ def set_tags_to_cache(kb_ids, tags):
     REDIS_CONN.set(k, json.dumps(tags).encode("utf-8"), 600)
 
 
+def get_graph_version(kb_id):
+    """
+    An opaque token that changes whenever the knowledge graph of the KB is rewritten.
+    Caches derived from the graph (type pool, query rewrites) put it into their keys.
+    """
+    k = f"graphrag_version_{kb_id}"
+    v = REDIS_CONN.get(k)
+    if not v:
+        v = get_uuid()
+        REDIS_CONN.set(k, v, 30*24*3600)
+    return v
+
+
+def set_graph_version(kb_id):
+    REDIS_CONN.set(f"graphrag_version_{kb_id}", get_uuid(), 30*24*3600)
+
+
+def get_graph_versions(kb_ids):
+    if isinstance(kb_ids, str):
+        kb_ids = [kb_ids]
+    return [get_graph_version(kb_id) for kb_id in sorted(kb_ids)]
+
+
+def get_type2sampels_from_cache(kb_ids, versions):
+    hasher = xxhash.xxh64()
+    hasher.update(("ty2ents" + str(sorted(kb_ids)) + str(versions)).encode("utf-8"))
+
+    k = hasher.hexdigest()
+    bin = REDIS_CONN.get(k)
+    if not bin:
+        return
+    return json.loads(bin)
+
+
+def set_type2sampels_to_cache(kb_ids, versions, ty2ents):
+    hasher = xxhash.xxh64()
+    hasher.update(("ty2ents" + str(sorted(kb_ids)) + str(versions)).encode("utf-8"))
+
+    k = hasher.hexdigest()
+    REDIS_CONN.set(k, json.dumps(ty2ents, ensure_ascii=False).encode("utf-8"), 24*3600)
+
+
+def normalize_question(question):
+    """
+    Fold case, whitespace and trailing sentence punctuation so that near-duplicate questions share cache entries.
+    Other punctuation is kept, "C++" and "C#" are different questions than "C".
+    """
+    return re.sub(r"[\s?!.,;。？！，；]+$", "", re.sub(r"\s+", " ", str(question).lower()).strip())
+
+
+def get_query_rewrite_cache(llmnm, question, kb_ids, versions):
+    hasher = xxhash.xxh64()
+    hasher.update(str(llmnm).encode("utf-8"))
+    hasher.update(normalize_question(question).encode("utf-8"))
+    hasher.update((str(sorted(kb_ids)) + str(versions)).encode("utf-8"))
+
+    k = hasher.hexdigest()
+    bin = REDIS_CONN.get(k)
+    if not bin:
+        return
+    return json.loads(bin)
+
+
+def set_query_rewrite_cache(llmnm, question, kb_ids, versions, rewrite):
+    hasher = xxhash.xxh64()
+    hasher.update(str(llmnm).encode("utf-8"))
+    hasher.update(normalize_question(question).encode("utf-8"))
+    hasher.update((str(sorted(kb_ids)) + str(versions)).encode("utf-8"))
+
+    k = hasher.hexdigest()
+    REDIS_CONN.set(k, json.dumps(rewrite, ensure_ascii=False).encode("utf-8"), 24*3600)
+
+
 def tidy_graph(graph: nx.Graph, callback, check_attribute: bool = True):
     """
     Ensure all nodes and edges in the graph have some essential attribute.
@@ -526,6 +599,7 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
         if doc_store_result:
             error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
             raise Exception(error_message)
+    set_graph_version(kb_id)
     now = trio.current_time()
     if callback:
         callback(msg=f"set_graph added/updated {len(change.added_updated_nodes)} nodes and {len(change.added_updated_edges)} edges from index in {now - start:.2f}s.")
@@ -574,6 +648,11 @@ def merge_tuples(list1, list2):
 
 
 async def get_entity_type2sampels(idxnms, kb_ids: list):
+    versions = get_graph_versions(kb_ids)
+    res = get_type2sampels_from_cache(kb_ids, versions)
+    if res is not None:
+        return res
+
     es_res = await trio.to_thread.run_sync(lambda: settings.retrievaler.search({"knowledge_graph_kwd": "ty2ents", "kb_id": kb_ids,
                                        "size": 10000,
                                        "fields": ["content_with_weight"]},
@@ -591,9 +670,48 @@ async def get_entity_type2sampels(idxnms, kb_ids: list):
 
         for ty, ents in smp.items():
             res[ty].extend(ents)
+    set_type2sampels_to_cache(kb_ids, versions, res)
     return res
 
 
+async def get_community_state(tenant_id, kb_id) -> dict:
+    """
+    Load what the last community extraction of the KB left: its level-0 Leiden partition and
+    the generated reports keyed by community content hash.
+    """
+    conds = {
+        "fields": ["content_with_weight"],
+        "size": 1,
+        "knowledge_graph_kwd": ["community_state"]
+    }
+    res = await trio.to_thread.run_sync(lambda: settings.retrievaler.search(conds, search.index_name(tenant_id), [kb_id]))
+    for id in res.ids:
+        try:
+            return json.loads(res.field[id]["content_with_weight"])
+        except Exception as e:
+            logging.exception(e)
+    return {}
+
+
+async def set_community_state(tenant_id, kb_id, partition: dict[str, int], reports: dict[str, dict]):
+    chunk = {
+        "content_with_weight": json.dumps({"partition": partition, "reports": reports}, ensure_ascii=False),
+        "knowledge_graph_kwd": "community_state",
+        "kb_id": kb_id,
+        "available_int": 0,
+        "removed_kwd": "N",
+    }
+    chunk["id"] = chunk_id(chunk)
+    await trio.to_thread.run_sync(
+        lambda: settings.docStoreConn.delete({"knowledge_graph_kwd": "community_state"}, search.index_name(tenant_id), kb_id)
+    )
+    await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert([chunk], search.index_name(tenant_id), kb_id))
+
+
+def community_report_id(kb_id, community_hash):
+    return xxhash.xxh64((kb_id + "community_report" + community_hash).encode("utf-8")).hexdigest()
+
+
 def flat_uniq_list(arr, key):
     res = []
     for a in arr:
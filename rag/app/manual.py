@@ -15,7 +15,6 @@
 #
 
 import logging
-import copy
 import re
 
 from api.db import ParserType
@@ -263,7 +262,7 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
                                     from_page=0, to_page=10000, callback=callback)
         res = tokenize_table(tbls, doc, eng)
         for text, image in ti_list:
-            d = copy.deepcopy(doc)
+            d = dict(doc)
             if image:
                 d['image'] = image
                 d["doc_type_kwd"] = "image"
@@ -182,48 +182,42 @@ class Docx(DocxParser):
 
         return ""
 
-    def __call__(self, filename, binary=None, from_page=0, to_page=100000):
+    def __call__(self, filename, binary=None, from_page=0, to_page=100000000):
+        """
+        `from_page` and `to_page` delimit a range of paragraphs, as cut by `DocxParser.section_ranges`.
+        Tables go with the first range.
+        """
         self.doc = Document(
             filename) if not binary else Document(BytesIO(binary))
-        pn = 0
         lines = []
         last_image = None
-        for p in self.doc.paragraphs:
-            if pn > to_page:
-                break
-            if from_page <= pn < to_page:
-                if p.text.strip():
-                    if p.style and p.style.name == 'Caption':
-                        former_image = None
-                        if lines and lines[-1][1] and lines[-1][2] != 'Caption':
-                            former_image = lines[-1][1].pop()
-                        elif last_image:
-                            former_image = last_image
-                            last_image = None
-                        lines.append((self.__clean(p.text), [former_image], p.style.name))
-                    else:
-                        current_image = self.get_picture(self.doc, p)
-                        image_list = [current_image]
-                        if last_image:
-                            image_list.insert(0, last_image)
-                            last_image = None
-                        lines.append((self.__clean(p.text), image_list, p.style.name if p.style else ""))
+        for p in self.doc.paragraphs[from_page:to_page]:
+            if p.text.strip():
+                if p.style and p.style.name == 'Caption':
+                    former_image = None
+                    if lines and lines[-1][1] and lines[-1][2] != 'Caption':
+                        former_image = lines[-1][1].pop()
+                    elif last_image:
+                        former_image = last_image
+                        last_image = None
+                    lines.append((self.__clean(p.text), [former_image], p.style.name))
                 else:
-                    if current_image := self.get_picture(self.doc, p):
-                        if lines:
-                            lines[-1][1].append(current_image)
-                        else:
-                            last_image = current_image
-            for run in p.runs:
-                if 'lastRenderedPageBreak' in run._element.xml:
-                    pn += 1
-                    continue
-                if 'w:br' in run._element.xml and 'type="page"' in run._element.xml:
-                    pn += 1
+                    current_image = self.get_picture(self.doc, p)
+                    image_list = [current_image]
+                    if last_image:
+                        image_list.insert(0, last_image)
+                        last_image = None
+                    lines.append((self.__clean(p.text), image_list, p.style.name if p.style else ""))
+            else:
+                if current_image := self.get_picture(self.doc, p):
+                    if lines:
+                        lines[-1][1].append(current_image)
+                    else:
+                        last_image = current_image
         new_line = [(line[0], reduce(concat_img, line[1]) if line[1] else None) for line in lines]
 
         tbls = []
-        for i, tb in enumerate(self.doc.tables):
+        for i, tb in enumerate(self.doc.tables if from_page == 0 else []):
             title = self.__get_nearest_title(i, filename)
             html = "<table>"
             if title:
@@ -343,13 +337,15 @@ class Markdown(MarkdownParser):
 
         return images if images else None
 
-    def __call__(self, filename, binary=None, separate_tables=True):
+    def __call__(self, filename, binary=None, separate_tables=True, from_page=0, to_page=100000000):
         if binary:
             encoding = find_codec(binary)
             txt = binary.decode(encoding, errors="ignore")
         else:
             with open(filename, "r") as f:
                 txt = f.read()
+        # a range of lines, as cut by `MarkdownParser.section_ranges`
+        txt = "\n".join(txt.split("\n")[from_page:to_page])
 
         remainder, tables = self.extract_tables_and_remainder(f'{txt}\n', separate_tables=separate_tables)
 
@@ -377,7 +373,7 @@ def load_from_xml_v2(baseURI, rels_item_xml):
             srels._srels.append(_SerializedRelationship(baseURI, rel_elm))
     return srels
 
-def chunk(filename, binary=None, from_page=0, to_page=100000,
+def chunk(filename, binary=None, from_page=0, to_page=100000000,
           lang="Chinese", callback=None, **kwargs):
     """
         Supported file formats are docx, pdf, excel, txt.
@@ -409,7 +405,7 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
 
         # fix "There is no item named 'word/NULL' in the archive", referring to https://github.com/python-openxml/python-docx/issues/1105#issuecomment-1298075246
         _SerializedRelationships.load_from_xml = load_from_xml_v2
-        sections, tables = Docx()(filename, binary)
+        sections, tables = Docx()(filename, binary, from_page, to_page)
 
         if vision_model:
             figures_data = vision_figure_parser_figure_data_wrapper(sections)
@@ -433,7 +429,7 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
         if kwargs.get("section_only", False):
             return chunks
 
-        res.extend(tokenize_chunks_with_images(chunks, doc, is_english, images))
+        res.extend(tokenize_chunks_with_images(chunks, doc, is_english, images, from_page))
         logging.info("naive_merge({}): {}".format(filename, timer() - st))
         return res
 
@@ -484,9 +480,9 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
         callback(0.1, "Start to parse.")
         excel_parser = ExcelParser()
         if parser_config.get("html4excel"):
-            sections = [(_, "") for _ in excel_parser.html(binary, 12) if _]
+            sections = [(_, "") for _ in excel_parser.html(binary, 12, from_page, to_page) if _]
         else:
-            sections = [(_, "") for _ in excel_parser(binary) if _]
+            sections = [(_, "") for _ in excel_parser(binary, from_page, to_page) if _]
         parser_config["chunk_token_num"] = 12800
 
     elif re.search(r"\.(txt|py|js|java|c|cpp|h|php|go|ts|sh|cs|kt|sql)$", filename, re.IGNORECASE):
@@ -499,7 +495,7 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
     elif re.search(r"\.(md|markdown)$", filename, re.IGNORECASE):
         callback(0.1, "Start to parse.")
         markdown_parser = Markdown(int(parser_config.get("chunk_token_num", 128)))
-        sections, tables = markdown_parser(filename, binary, separate_tables=False)
+        sections, tables = markdown_parser(filename, binary, separate_tables=False, from_page=from_page, to_page=to_page)
 
         # Process images for each section
         section_images = []
@@ -560,7 +556,7 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
         if kwargs.get("section_only", False):
             return chunks
 
-        res.extend(tokenize_chunks_with_images(chunks, doc, is_english, images))
+        res.extend(tokenize_chunks_with_images(chunks, doc, is_english, images, from_page))
     else:
         chunks = naive_merge(
             sections, int(parser_config.get(
@@ -569,7 +565,7 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
         if kwargs.get("section_only", False):
             return chunks
 
-        res.extend(tokenize_chunks(chunks, doc, is_english, pdf_parser))
+        res.extend(tokenize_chunks(chunks, doc, is_english, pdf_parser, from_page))
 
     logging.info("naive_merge({}): {}".format(filename, timer() - st))
     return res
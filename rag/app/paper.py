@@ -15,7 +15,6 @@
 #
 
 import logging
-import copy
 import re
 
 from api.db import ParserType
@@ -61,9 +60,9 @@ class Pdf(PdfParser):
         callback(0.75, "Text merged ({:.2f}s)".format(timer() - start))
 
         # clean mess
-        if column_width < self.page_images[0].size[0] / zoomin / 2:
+        if column_width < self.page_images.size(0)[0] / zoomin / 2:
             logging.debug("two_column................... {} {}".format(column_width,
-                  self.page_images[0].size[0] / zoomin / 2))
+                  self.page_images.size(0)[0] / zoomin / 2))
             self.boxes = self.sort_X_by_page(self.boxes, column_width / 2)
         for b in self.boxes:
             b["text"] = re.sub(r"([\t 　]|\u3000){2,}", " ", b["text"].strip())
@@ -174,7 +173,7 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
     res = tokenize_table(paper["tables"], doc, eng)
 
     if paper["abstract"]:
-        d = copy.deepcopy(doc)
+        d = dict(doc)
         txt = pdf_parser.remove_tag(paper["abstract"])
         d["important_kwd"] = ["abstract", "总结", "概括", "summary", "summarize"]
         d["important_tks"] = " ".join(d["important_kwd"])
@@ -239,7 +238,7 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
             r = re.search(r"(.*?) ([。？；！]|$)", txt)
             txt = r.group(1)[::-1] if r else txt[::-1]
         for p in proj:
-            d = copy.deepcopy(doc)
+            d = dict(doc)
             txt += "\n" + pdf_parser.remove_tag(p)
             d["image"], poss = pdf_parser.crop(p, need_position=True)
             add_positions(d, poss)
@@ -251,7 +250,7 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
     tk_cnt = 0
     def add_chunk():
         nonlocal chunk, res, doc, pdf_parser, tk_cnt
-        d = copy.deepcopy(doc)
+        d = dict(doc)
         ck = "\n".join(chunk)
         tokenize(d, pdf_parser.remove_tag(ck), pdf_parser.is_english)
         d["image"], poss = pdf_parser.crop(ck, need_position=True)
@@ -14,7 +14,6 @@
 #  limitations under the License.
 #
 
-import copy
 import re
 from io import BytesIO
 
@@ -117,8 +116,8 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
     if re.search(r"\.pptx?$", filename, re.IGNORECASE):
         ppt_parser = Ppt()
         for pn, (txt, img) in enumerate(ppt_parser(
-                filename if not binary else binary, from_page, 1000000, callback)):
-            d = copy.deepcopy(doc)
+                filename if not binary else binary, from_page, to_page, callback)):
+            d = dict(doc)
             pn += from_page
             d["image"] = img
             d["doc_type_kwd"] = "image"
@@ -145,7 +144,7 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
 
         callback(0.8, "Finish parsing.")
         for pn, (txt, img) in enumerate(sections):
-            d = copy.deepcopy(doc)
+            d = dict(doc)
             pn += from_page
             if img:
                 d["image"] = img
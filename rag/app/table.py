@@ -14,7 +14,6 @@
 #  limitations under the License.
 #
 
-import copy
 import re
 from io import BytesIO
 from xpinyin import Pinyin
@@ -27,19 +26,22 @@ from dateutil.parser import parse as datetime_parse
 
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from deepdoc.parser.utils import get_text
-from rag.nlp import rag_tokenizer, tokenize
+from rag.nlp import rag_tokenizer, tokenize_batch
 from deepdoc.parser import ExcelParser
 
 
 class Excel(ExcelParser):
     def __call__(self, fnm, binary=None, from_page=0, to_page=10000000000, callback=None):
+        wb = Excel._load_read_only_workbook(BytesIO(binary) if binary else fnm)
+        if wb is not None:
+            res = self._read_window(wb, from_page, to_page, callback)
+            wb.close()
+            if res is not None:
+                return res
         if not binary:
             wb = Excel._load_excel_to_workbook(fnm)
         else:
             wb = Excel._load_excel_to_workbook(BytesIO(binary))
-        total = 0
-        for sheetname in wb.sheetnames:
-            total += len(list(wb[sheetname].rows))
         res, fails, done = [], [], 0
         rn = 0
         for sheetname in wb.sheetnames:
@@ -72,6 +74,39 @@ class Excel(ExcelParser):
         callback(0.3, ("Extract records: {}~{}".format(from_page + 1, min(to_page, from_page + rn)) + (f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
         return res
 
+    def _read_window(self, wb, from_page, to_page, callback):
+        """
+        Records `from_page`..`to_page` of a read-only workbook, streaming only the rows up to the window.
+        Sheets before it are skipped by their row count. Returns None if a sheet on the way has merged
+        cells: their headers and inherited values need the whole sheet loaded.
+        """
+        res, rn = [], 0
+        for sheetname in wb.sheetnames:
+            if rn >= to_page:
+                break
+            ws = wb[sheetname]
+            if self._has_merged_cells(ws):
+                return None
+            n = self._row_count(ws)
+            if not n:
+                continue
+            # Without merged cells the first row is the header, as in `_parse_headers`.
+            headers, header_rows = self._parse_simple_headers(list(ws.iter_rows(max_row=1)))
+            if not headers:
+                continue
+            s, e = max(from_page - rn, 0), min(to_page - rn, n - header_rows)
+            rn += n - header_rows
+            data = []
+            if s < e:
+                for r in ws.iter_rows(min_row=header_rows + 1 + s, max_row=header_rows + e, max_col=len(headers), values_only=True):
+                    row_data = list(r) + [None] * (len(headers) - len(r))
+                    if not self._is_empty_row(row_data):
+                        data.append(row_data)
+            if data:
+                res.append(pd.DataFrame(data, columns=headers))
+        callback(0.3, "Extract records: {}~{}".format(from_page + 1, min(to_page, from_page + rn)))
+        return res
+
     def _parse_headers(self, ws, rows):
         if len(rows) == 0:
             return [], 0
@@ -265,38 +300,39 @@ def column_data_type(arr):
     counts = {"int": 0, "float": 0, "text": 0, "datetime": 0, "bool": 0}
     trans = {t: f for f, t in [(int, "int"), (float, "float"), (trans_datatime, "datetime"), (trans_bool, "bool"), (str, "text")]}
     float_flag = False
-    for a in arr:
-        if a is None:
-            continue
-        if re.match(r"[+-]?[0-9]+$", str(a).replace("%%", "")) and not str(a).replace("%%", "").startswith("0"):
-            counts["int"] += 1
-            if int(str(a)) > 2**63 - 1:
+    # Cells only matter through their text, so each distinct text is classified and converted once.
+    strs = [None if a is None else str(a) for a in arr]
+    for a, n in Counter(s for s in strs if s is not None).items():
+        if re.match(r"[+-]?[0-9]+$", a.replace("%%", "")) and not a.replace("%%", "").startswith("0"):
+            counts["int"] += n
+            if int(a) > 2**63 - 1:
                 float_flag = True
                 break
-        elif re.match(r"[+-]?[0-9.]{,19}$", str(a).replace("%%", "")) and not str(a).replace("%%", "").startswith("0"):
-            counts["float"] += 1
-        elif re.match(r"(true|yes|是|\*|✓|✔|☑|✅|√|false|no|否|⍻|×)$", str(a), flags=re.IGNORECASE):
-            counts["bool"] += 1
-        elif trans_datatime(str(a)):
-            counts["datetime"] += 1
+        elif re.match(r"[+-]?[0-9.]{,19}$", a.replace("%%", "")) and not a.replace("%%", "").startswith("0"):
+            counts["float"] += n
+        elif re.match(r"(true|yes|是|\*|✓|✔|☑|✅|√|false|no|否|⍻|×)$", a, flags=re.IGNORECASE):
+            counts["bool"] += n
+        elif trans_datatime(a):
+            counts["datetime"] += n
         else:
-            counts["text"] += 1
+            counts["text"] += n
     if float_flag:
         ty = "float"
     else:
         counts = sorted(counts.items(), key=lambda x: x[1] * -1)
         ty = counts[0][0]
-    for i in range(len(arr)):
-        if arr[i] is None:
+    conv = {}
+    for a in set(strs):
+        if a is None:
             continue
         try:
-            arr[i] = trans[ty](str(arr[i]))
+            conv[a] = trans[ty](a)
         except Exception:
-            arr[i] = None
+            conv[a] = None
     # if ty == "text":
     #    if len(arr) > 128 and uni / len(arr) < 0.1:
     #        ty = "keyword"
-    return arr, ty
+    return [None if a is None else conv[a] for a in strs], ty
 
 
 def chunk(filename, binary=None, from_page=0, to_page=10000000000, lang="Chinese", callback=None, **kwargs):
@@ -357,35 +393,43 @@ def chunk(filename, binary=None, from_page=0, to_page=10000000000, lang="Chinese
             if duplicates:
                 raise ValueError(f"Duplicate column names detected: {duplicates}\nFrom: {clmns}")
 
-        txts = list(copy.deepcopy(clmns))
         py_clmns = [PY.get_pinyins(re.sub(r"(/.*|（[^（）]+?）|\([^()]+?\))", "", str(n)), "_")[0] for n in clmns]
         clmn_tys = []
         for j in range(len(clmns)):
             cln, ty = column_data_type(df[clmns[j]])
             clmn_tys.append(ty)
             df[clmns[j]] = cln
-            if ty == "text":
-                txts.extend([str(c) for c in cln if c])
         clmns_map = [(py_clmns[i].lower() + fieds_map[clmn_tys[i]], str(clmns[i]).replace("_", " ")) for i in range(len(clmns))]
 
+        # Rows are assembled column by column: empty cells are masked per column and text cells
+        # are tokenized in one batch, where repeated values cost a single tokenization.
         eng = lang.lower() == "english"  # is_english(txts)
-        for ii, row in df.iterrows():
-            d = {"docnm_kwd": filename, "title_tks": rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))}
-            row_txt = []
-            for j in range(len(clmns)):
-                if row[clmns[j]] is None:
-                    continue
-                if not str(row[clmns[j]]):
-                    continue
-                if not isinstance(row[clmns[j]], pd.Series) and pd.isna(row[clmns[j]]):
-                    continue
-                fld = clmns_map[j][0]
-                d[fld] = row[clmns[j]] if clmn_tys[j] != "text" else rag_tokenizer.tokenize(row[clmns[j]])
-                row_txt.append("{}:{}".format(clmns[j], row[clmns[j]]))
+        values = df.values
+        fields, row_txts = [[] for _ in range(len(df))], [[] for _ in range(len(df))]
+        for j in range(len(clmns)):
+            vals = values[:, j]
+            keep = ~pd.isna(vals)
+            if vals.dtype == object:
+                keep &= vals != ""
+            idx = np.flatnonzero(keep)
+            kept = list(vals[idx])
+            fld = clmns_map[j][0]
+            fld_vals = rag_tokenizer.tokenize_batch(kept) if clmn_tys[j] == "text" else kept
+            for i, v, fv in zip(idx.tolist(), kept, fld_vals):
+                fields[i].append((fld, fv))
+                row_txts[i].append("{}:{}".format(clmns[j], v))
+
+        title_tks = rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))
+        ds, ts = [], []
+        for flds, row_txt in zip(fields, row_txts):
             if not row_txt:
                 continue
-            tokenize(d, "; ".join(row_txt), eng)
-            res.append(d)
+            d = {"docnm_kwd": filename, "title_tks": title_tks}
+            d.update(flds)
+            ds.append(d)
+            ts.append("; ".join(row_txt))
+        tokenize_batch(ds, ts, eng)
+        res.extend(ds)
 
         KnowledgebaseService.update_parser_config(kwargs["kb_id"], {"field_map": {k: v for k, v in clmns_map}})
     callback(0.35, "")
@@ -16,7 +16,6 @@
 import json
 import re
 import csv
-from copy import deepcopy
 
 from deepdoc.parser.utils import get_text
 from rag.app.qa import Excel
@@ -55,7 +54,7 @@ def chunk(filename, binary=None, lang="Chinese", callback=None, **kwargs):
         callback(0.1, "Start to parse.")
         excel_parser = Excel()
         for ii, (q, a) in enumerate(excel_parser(filename, binary, callback)):
-            res.append(beAdoc(deepcopy(doc), q, a, eng, ii))
+            res.append(beAdoc(dict(doc), q, a, eng, ii))
         return res
 
     elif re.search(r"\.(txt)$", filename, re.IGNORECASE):
@@ -79,7 +78,7 @@ def chunk(filename, binary=None, lang="Chinese", callback=None, **kwargs):
                 content += "\n" + lines[i]
             elif len(arr) == 2:
                 content += "\n" + arr[0]
-                res.append(beAdoc(deepcopy(doc), content, arr[1], eng, i))
+                res.append(beAdoc(dict(doc), content, arr[1], eng, i))
                 content = ""
             i += 1
             if len(res) % 999 == 0:
@@ -107,7 +106,7 @@ def chunk(filename, binary=None, lang="Chinese", callback=None, **kwargs):
                 content += "\n" + lines[i]
             elif len(row) == 2:
                 content += "\n" + row[0]
-                res.append(beAdoc(deepcopy(doc), content, row[1], eng, i))
+                res.append(beAdoc(dict(doc), content, row[1], eng, i))
                 content = ""
             if len(res) % 999 == 0:
                 callback(len(res) * 0.6 / len(lines), ("Extract Tags: {}".format(len(res)) + (
@@ -18,10 +18,9 @@ import logging
 import random
 from collections import Counter
 
-from rag.utils import num_tokens_from_string
+from rag.utils import num_tokens_from_string, num_tokens_from_strings
 from . import rag_tokenizer
 import re
-import copy
 import roman_numbers as r
 from word2number import w2n
 from cn2an import cn2an
@@ -264,14 +263,26 @@ def tokenize(d, t, eng):
     d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
 
 
-def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
-    res = []
+def tokenize_batch(ds, ts, eng):
+    """`tokenize` every text of `ts` into the document at the same index of `ds`, in one tokenizer batch."""
+    for d, t in zip(ds, ts):
+        d["content_with_weight"] = t
+    ts = [re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", t) for t in ts]
+    for d, (tks, sm_tks) in zip(ds, rag_tokenizer.tokenize_batch(ts, fine_grained=True)):
+        d["content_ltks"] = tks
+        d["content_sm_ltks"] = sm_tks
+
+
+def tokenize_chunks(chunks, doc, eng, pdf_parser=None, start=0):
+    """`start` offsets the ordinal positions of chunks without a PDF, e.g. the `from_page` of a split document."""
+    res, texts = [], []
     # wrap up as es documents
     for ii, ck in enumerate(chunks):
         if len(ck.strip()) == 0:
             continue
         logging.debug("-- {}".format(ck))
-        d = copy.deepcopy(doc)
+        # Template fields are strings shared by all the chunks of a document, a shallow copy is enough.
+        d = dict(doc)
         if pdf_parser:
             try:
                 d["image"], poss = pdf_parser.crop(ck, need_position=True)
@@ -280,35 +291,36 @@ def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
             except NotImplementedError:
                 pass
         else:
-            add_positions(d, [[ii]*5])
-        tokenize(d, ck, eng)
+            add_positions(d, [[start + ii]*5])
+        texts.append(ck)
         res.append(d)
+    tokenize_batch(res, texts, eng)
     return res
 
-def tokenize_chunks_with_images(chunks, doc, eng, images):
-    res = []
+def tokenize_chunks_with_images(chunks, doc, eng, images, start=0):
+    res, texts = [], []
     # wrap up as es documents
     for ii, (ck, image) in enumerate(zip(chunks, images)):
         if len(ck.strip()) == 0:
             continue
         logging.debug("-- {}".format(ck))
-        d = copy.deepcopy(doc)
+        d = dict(doc)
         d["image"] = image
-        add_positions(d, [[ii]*5])
-        tokenize(d, ck, eng)
+        add_positions(d, [[start + ii]*5])
+        texts.append(ck)
         res.append(d)
+    tokenize_batch(res, texts, eng)
     return res
 
 def tokenize_table(tbls, doc, eng, batch_size=10):
-    res = []
+    res, texts = [], []
     # add tables
     for (img, rows), poss in tbls:
         if not rows:
             continue
         if isinstance(rows, str):
-            d = copy.deepcopy(doc)
-            tokenize(d, rows, eng)
-            d["content_with_weight"] = rows
+            d = dict(doc)
+            texts.append(rows)
             if img:
                 d["image"] = img
                 d["doc_type_kwd"] = "image"
@@ -318,14 +330,14 @@ def tokenize_table(tbls, doc, eng, batch_size=10):
             continue
         de = "; " if eng else "； "
         for i in range(0, len(rows), batch_size):
-            d = copy.deepcopy(doc)
-            r = de.join(rows[i:i + batch_size])
-            tokenize(d, r, eng)
+            d = dict(doc)
+            texts.append(de.join(rows[i:i + batch_size]))
             if img:
                 d["image"] = img
                 d["doc_type_kwd"] = "image"
             add_positions(d, poss)
             res.append(d)
+    tokenize_batch(res, texts, eng)
     return res
 
 
@@ -519,48 +531,62 @@ def hierarchical_merge(bull, sections, depth):
 
 
 def naive_merge(sections, chunk_token_num=128, delimiter="\n。；！？", overlapped_percent=0):
-    from deepdoc.parser.pdf_parser import RAGFlowPdfParser
     if not sections:
         return []
+    return [""] + list(naive_merge_iter(sections, chunk_token_num, delimiter, overlapped_percent))
+
+
+def naive_merge_iter(sections, chunk_token_num=128, delimiter="\n。；！？", overlapped_percent=0):
+    """
+    Yield the chunks of `naive_merge` one by one as they are closed, without its leading empty chunk.
+    A chunk is built from a list of pieces and the set of position tags it already carries, so merging
+    stays linear in the text length whatever the size of the sections.
+    """
+    from deepdoc.parser.pdf_parser import RAGFlowPdfParser
+    if not sections:
+        return
     if isinstance(sections[0], type("")):
         sections = [(s, "") for s in sections]
-    cks = [""]
-    tk_nums = [0]
+    dels = get_delimiters(delimiter)
+    # Count all sections in one batch, the pieces below then find their counts in the cache.
+    num_tokens_from_strings([sec for sec, _ in sections])
+
+    def pieces():
+        for sec, pos in sections:
+            tnum = num_tokens_from_string(sec)
+            if tnum < chunk_token_num:
+                yield sec, tnum, pos
+                continue
+            splited_sec = re.split(r"(%s)" % dels, sec, flags=re.DOTALL)
+            for sub_sec in splited_sec:
+                if re.match(f"^{dels}$", sub_sec):
+                    continue
+                yield sub_sec, num_tokens_from_string(sub_sec), pos
 
-    def add_chunk(t, pos):
-        nonlocal cks, tk_nums, delimiter
-        tnum = num_tokens_from_string(t)
-        if not pos:
-            pos = ""
-        if tnum < 8:
+    parts, tags, size, tk_num = None, set(), 0, 0
+    for t, tnum, pos in pieces():
+        if not pos or tnum < 8:
             pos = ""
-        # Ensure that the length of the merged chunk does not exceed chunk_token_num  
-        if cks[-1] == "" or tk_nums[-1] > chunk_token_num * (100 - overlapped_percent)/100.:
-            if cks:
-                overlapped = RAGFlowPdfParser.remove_tag(cks[-1])
-                t = overlapped[int(len(overlapped)*(100-overlapped_percent)/100.):] + t
-            if t.find(pos) < 0:
+        # Ensure that the length of the merged chunk does not exceed chunk_token_num
+        if size == 0 or tk_num > chunk_token_num * (100 - overlapped_percent) / 100.:
+            if parts is not None:
+                ck = "".join(parts)
+                yield ck
+                if overlapped_percent:
+                    overlapped = RAGFlowPdfParser.remove_tag(ck)
+                    t = overlapped[int(len(overlapped) * (100 - overlapped_percent) / 100.):] + t
+            if pos and t.find(pos) < 0:
                 t += pos
-            cks.append(t)
-            tk_nums.append(tnum)
+            parts, tags, size, tk_num = [t], {pos}, len(t), tnum
         else:
-            if cks[-1].find(pos) < 0:
+            if pos and pos not in tags:
                 t += pos
-            cks[-1] += t
-            tk_nums[-1] += tnum
-
-    dels = get_delimiters(delimiter)
-    for sec, pos in sections:
-        if num_tokens_from_string(sec) < chunk_token_num:
-            add_chunk(sec, pos)
-            continue
-        splited_sec = re.split(r"(%s)" % dels, sec, flags=re.DOTALL)
-        for sub_sec in splited_sec:
-            if re.match(f"^{dels}$", sub_sec):
-                continue
-            add_chunk(sub_sec, pos)
-
-    return cks
+                tags.add(pos)
+            parts.append(t)
+            size += len(t)
+            tk_num += tnum
+    if parts is not None:
+        yield "".join(parts)
 
 
 def naive_merge_with_images(texts, images, chunk_token_num=128, delimiter="\n。；！？"):
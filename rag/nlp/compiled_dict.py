@@ -0,0 +1,275 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Compiled, read-only dictionaries shared by all processes of a host.
+
+A dictionary is a double-array trie over UTF-8 bytes plus int32 payload arrays, written to one file
+and memory-mapped on load, so every process reading it shares the same physical pages.
+The file holds a JSON header followed by the int32 arrays:
+
+    b"RFDICT01" | uint32 header length | header | padding to 8 bytes | base | check | value | payload arrays...
+
+Run this file to compile the dictionaries under rag/res (huqie, ner.json, term.freq) ahead of time:
+
+    python rag/nlp/compiled_dict.py [res_dir]
+
+It only needs the standard library (and datrie to read a huqie.txt.trie), so it also runs at image build time.
+"""
+
+import codecs
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b"RFDICT01"
+# Prefix of reversed words in the tokenizer dictionary, never the first byte of UTF-8 text.
+REVERSED = b"\xff"
+
+
+class CompiledDict:
+    """Read-only double-array trie memory-mapped from a file written by `build`. Keys map to entry indexes."""
+
+    def __init__(self, fnm):
+        with open(fnm, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{fnm} is not a compiled dictionary")
+        n, = struct.unpack_from("<I", self._mm, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(self._mm[start:start + n].decode("utf-8"))
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{fnm} was compiled on a {header['byteorder']} endian host")
+        self.meta = header.get("meta", {})
+        self.strings = header.get("strings", [])
+        self.entries = header["entries"]
+        offset = (start + n + 7) // 8 * 8
+        view = memoryview(self._mm)
+        self._arrays = {}
+        for name, length in header["arrays"]:
+            self._arrays[name] = view[offset:offset + length * 4].cast("i")
+            offset += length * 4
+        self.base, self.check, self.value = self._arrays["base"], self._arrays["check"], self._arrays["value"]
+        self.size = len(self.base)
+
+    def array(self, name):
+        return self._arrays[name]
+
+    def walk(self, node, data):
+        """Node reached from `node` along the bytes of `data`, -1 if there is none."""
+        if node < 0:
+            return -1
+        base, check, size = self.base, self.check, self.size
+        for c in data:
+            t = base[node] + c + 1
+            if t >= size or check[t] != node:
+                return -1
+            node = t
+        return node
+
+    def index(self, key):
+        """Entry index of `key`, -1 if it is not in the dictionary."""
+        node = self.walk(0, key.encode("utf-8") if isinstance(key, str) else key)
+        return self.value[node] if node >= 0 else -1
+
+    def has_keys_with_prefix(self, key):
+        return self.walk(0, key.encode("utf-8") if isinstance(key, str) else key) >= 0
+
+    def __contains__(self, key):
+        return self.index(key) >= 0
+
+    def __len__(self):
+        return self.entries
+
+
+class CompiledMap(CompiledDict):
+    """Read-only str -> int or str mapping, e.g. ner.json or term.freq built by `build_map`."""
+
+    def __init__(self, fnm):
+        super().__init__(fnm)
+        self._values = self.array("values")
+        self._str = self.meta.get("type") == "str"
+
+    def get(self, key, default=None):
+        i = self.index(key)
+        if i < 0:
+            return default
+        return self.strings[self._values[i]] if self._str else self._values[i]
+
+    def __getitem__(self, key):
+        i = self.index(key)
+        if i < 0:
+            raise KeyError(key)
+        return self.strings[self._values[i]] if self._str else self._values[i]
+
+
+def _double_array(items):
+    """Double-array trie of `items`, sorted unique (key bytes, entry index) pairs, as (base, check, value) arrays."""
+    base, check, value, used = array("i", [0]), array("i", [-1]), array("i", [-1]), bytearray(1)
+    used[0] = 1
+
+    def ensure(n):
+        if n > len(base):
+            grow = max(n - len(base), len(base) // 2)
+            base.extend([0] * grow)
+            check.extend([-1] * grow)
+            value.extend([-1] * grow)
+            used.extend(bytes(grow))
+
+    def next_free(i):
+        i = used.find(0, i)
+        return i if i >= 0 else len(used)
+
+    free = 1
+    stack = [(0, 0, len(items), 0)]
+    while stack:
+        node, lo, hi, depth = stack.pop()
+        if lo < hi and len(items[lo][0]) == depth:
+            value[node] = items[lo][1]
+            lo += 1
+        if lo >= hi:
+            continue
+        codes, groups = [], []
+        i = lo
+        while i < hi:
+            c = items[i][0][depth]
+            j = i + 1
+            while j < hi and items[j][0][depth] == c:
+                j += 1
+            codes.append(c + 1)
+            groups.append((i, j))
+            i = j
+
+        # First fit from the first free slot, jumping over used slots with bytearray.find. Like darts,
+        # the search start moves past regions that are almost full so they are not scanned over and over.
+        pos = first = next_free(max(free, codes[0] + 1))
+        while True:
+            b = pos - codes[0]
+            ensure(b + codes[-1] + 2)
+            if not any(used[b + c] for c in codes):
+                break
+            pos = next_free(pos + 1)
+        if free < first or (pos - first > 32 and used.count(1, first, pos) >= 0.95 * (pos - first)):
+            free = first if free < first else pos
+        base[node] = b
+        for c, (i, j) in zip(codes, groups):
+            used[b + c] = 1
+            check[b + c] = node
+            stack.append((b + c, i, j, depth + 1))
+
+    n = len(used.rstrip(b"\x00"))
+    return base[:n], check[:n], value[:n]
+
+
+def build(fnm, entries, arrays=None, strings=None, meta=None):
+    """
+    Write a compiled dictionary of `entries` (key bytes -> entry index) with int32 payload `arrays`
+    (name -> values by entry index), a string table and metadata. The file is replaced atomically.
+    """
+    items = sorted(entries.items())
+    base, check, value = _double_array(items)
+    named = [("base", base), ("check", check), ("value", value)] + \
+            [(nm, array("i", vals)) for nm, vals in (arrays or {}).items()]
+    header = json.dumps({"byteorder": sys.byteorder, "entries": len(set(entries.values())),
+                         "arrays": [(nm, len(arr)) for nm, arr in named],
+                         "strings": strings or [], "meta": meta or {}}, ensure_ascii=False).encode("utf-8")
+    tmp = f"{fnm}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header)) + header)
+        f.write(bytes(-f.tell() % 8))
+        for _, arr in named:
+            f.write(arr.tobytes())
+    os.replace(tmp, fnm)
+    logging.info(f"Compiled {len(entries)} keys, {len(base)} trie nodes into {fnm}")
+
+
+def build_map(mapping, fnm):
+    """Compile a str -> int or str mapping into `fnm`, read back with `CompiledMap`."""
+    keys = list(mapping.keys())
+    if all(isinstance(v, int) for v in mapping.values()):
+        return build(fnm, {k.encode("utf-8"): i for i, k in enumerate(keys)},
+                     {"values": [mapping[k] for k in keys]}, meta={"type": "int"})
+    strings = sorted(set(str(v) for v in mapping.values()))
+    ids = {s: i for i, s in enumerate(strings)}
+    build(fnm, {k.encode("utf-8"): i for i, k in enumerate(keys)},
+          {"values": [ids[str(mapping[k])] for k in keys]}, strings, meta={"type": "str"})
+
+
+def _huqie_words(src):
+    """(word, log frequency, tag) of the tokenizer dictionary in huqie.txt or its datrie cache huqie.txt.trie."""
+    words = {}
+    if src.endswith(".trie"):
+        import datrie
+        for k, v in datrie.Trie.load(src).items():
+            if isinstance(v, tuple):
+                # keys are str(word.encode("utf-8"))[2:-1], see RagTokenizer.key_
+                words[codecs.escape_decode(k.encode("ascii"))[0].decode("utf-8")] = v
+        return words
+    with open(src, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\r\n").replace("\t", " ").split(" ")
+            if len(line) < 3:
+                continue
+            w, F = line[0].lower(), int(math.log(float(line[1]) / 1000000) + .5)
+            if w not in words or words[w][0] < F:
+                words[w] = (F, line[2])
+    return words
+
+
+def build_tokenizer_dict(src, fnm):
+    """Compile the tokenizer dictionary `src` (huqie.txt or huqie.txt.trie) into `fnm`, see `rag_tokenizer.CompiledTrieDict`."""
+    words = _huqie_words(src)
+    tags = sorted(set(t for _, t in words.values()))
+    ids = {t: i for i, t in enumerate(tags)}
+    entries, freq, tag = {}, [], []
+    for i, (w, (F, t)) in enumerate(words.items()):
+        entries[w.encode("utf-8")] = i
+        entries[REVERSED + w[::-1].encode("utf-8")] = i
+        freq.append(F)
+        tag.append(ids[t])
+    build(fnm, entries, {"freq": freq, "tag": tag}, tags, meta={"type": "tokenizer"})
+
+
+def _term_freq(src):
+    res = {}
+    with open(src, "r") as f:
+        for line in f:
+            arr = line.replace("\n", "").split("\t")
+            res[arr[0]] = int(arr[1]) if len(arr) > 1 else 0
+    return res
+
+
+def build_all(res_dir):
+    """Compile every dictionary found in `res_dir`."""
+    huqie = os.path.join(res_dir, "huqie.txt")
+    for src in [huqie, huqie + ".trie"]:
+        if os.path.exists(src):
+            build_tokenizer_dict(src, os.path.join(res_dir, "huqie.dat"))
+            break
+    if os.path.exists(os.path.join(res_dir, "ner.json")):
+        with open(os.path.join(res_dir, "ner.json"), "r") as f:
+            build_map(json.load(f), os.path.join(res_dir, "ner.dat"))
+    if os.path.exists(os.path.join(res_dir, "term.freq")):
+        build_map(_term_freq(os.path.join(res_dir, "term.freq")), os.path.join(res_dir, "term.freq.dat"))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    build_all(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "res"))
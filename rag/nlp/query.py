@@ -18,15 +18,39 @@ import logging
 import json
 import re
 from collections import defaultdict
+from functools import lru_cache
 
+from rag.settings import QUERY_PLAN_CACHE_SIZE
 from rag.utils.doc_store_conn import MatchTextExpr
+from rag.utils.redis_conn import REDIS_CONN
 from rag.nlp import rag_tokenizer, term_weight, synonym
 
 
+class QueryPlan:
+    """
+    Full-text query of a question: query string, keywords and the token weights of the keywords that
+    `FulltextQueryer.token_similarity` scores chunks against, built once by `FulltextQueryer.plan`.
+    Plans are memoized and shared, so they are read-only and `match_expr` builds a new expression for each search.
+    """
+
+    def __init__(self, query, keywords, weights, use_min_match=True):
+        self.query = query
+        self.keywords = tuple(keywords)
+        self.weights = dict(weights)
+        self.use_min_match = use_min_match
+
+    def match_expr(self, fields, min_match):
+        if self.query is None:
+            return None
+        return MatchTextExpr(fields, self.query, 100, {"minimum_should_match": min_match} if self.use_min_match else {})
+
+
 class FulltextQueryer:
     def __init__(self):
         self.tw = term_weight.Dealer()
-        self.syn = synonym.Dealer()
+        self.syn = synonym.Dealer(REDIS_CONN)
+        self.plan_ = lru_cache(maxsize=QUERY_PLAN_CACHE_SIZE)(self.build_plan)
+        self.plan_synonyms_ = self.syn.dictionary
         self.query_fields = [
             "title_tks^10",
             "title_sm_tks^5",
@@ -83,6 +107,18 @@ class FulltextQueryer:
         return txt
 
     def question(self, txt, tbl="qa", min_match: float = 0.6):
+        plan = self.plan(txt, tbl)
+        return plan.match_expr(self.query_fields, min_match), list(plan.keywords)
+
+    def plan(self, txt, tbl="qa"):
+        """Memoized `QueryPlan` of `txt`, shared by the search and reranks of a request and by repeated questions."""
+        if self.syn.dictionary is not self.plan_synonyms_:
+            # Synonyms were reloaded, plans built with the old ones are stale.
+            self.plan_.cache_clear()
+            self.plan_synonyms_ = self.syn.dictionary
+        return self.plan_(txt, tbl)
+
+    def build_plan(self, txt, tbl="qa"):
         txt = FulltextQueryer.add_space_between_eng_zh(txt)
         txt = re.sub(
             r"[ :|\r\n\t,，。？?/`!！&^%%()\[\]{}<>]+",
@@ -102,8 +138,7 @@ class FulltextQueryer:
             tks_w = [(re.sub(r"^[\+-]", "", tk), w) for tk, w in tks_w if tk]
             tks_w = [(tk.strip(), w) for tk, w in tks_w if tk.strip()]
             syns = []
-            for tk, w in tks_w[:256]:
-                syn = self.syn.lookup(tk)
+            for (tk, w), syn in zip(tks_w[:256], self.syn.lookup_many([tk for tk, _ in tks_w[:256]])):
                 syn = rag_tokenizer.tokenize(" ".join(syn)).split()
                 keywords.extend(syn)
                 syn = ["\"{}\"^{:.4f}".format(s, w / 4.) for s in syn if s.strip()]
@@ -126,9 +161,7 @@ class FulltextQueryer:
             if not q:
                 q.append(txt)
             query = " ".join(q)
-            return MatchTextExpr(
-                self.query_fields, query, 100
-            ), keywords
+            return QueryPlan(query, keywords, self.token_weights(keywords), use_min_match=False)
 
         def need_fine_grained_tokenize(tk):
             if len(tk) < 3:
@@ -211,10 +244,8 @@ class FulltextQueryer:
             query = " OR ".join([f"({t})" for t in qs if t])
             if not query:
                 query = otxt
-            return MatchTextExpr(
-                self.query_fields, query, 100, {"minimum_should_match": min_match}
-            ), keywords
-        return None, keywords
+            return QueryPlan(query, keywords, self.token_weights(keywords))
+        return QueryPlan(None, keywords, self.token_weights(keywords))
 
     def hybrid_similarity(self, avec, bvecs, atks, btkss, tkweight=0.3, vtweight=0.7):
         from sklearn.metrics.pairwise import cosine_similarity as CosineSimilarity
@@ -226,18 +257,20 @@ class FulltextQueryer:
             return np.array(tksim), tksim, sims[0]
         return np.array(sims[0]) * vtweight + np.array(tksim) * tkweight, tksim, sims[0]
 
+    def token_weights(self, tks):
+        if isinstance(tks, str):
+            tks = tks.split()
+        d = defaultdict(int)
+        wts = self.tw.weights(tks, preprocess=False)
+        for i, (t, c) in enumerate(wts):
+            d[t] += c
+        return d
+
     def token_similarity(self, atks, btkss):
-        def toDict(tks):
-            if isinstance(tks, str):
-                tks = tks.split()
-            d = defaultdict(int)
-            wts = self.tw.weights(tks, preprocess=False)
-            for i, (t, c) in enumerate(wts):
-                d[t] += c
-            return d
-
-        atks = toDict(atks)
-        btkss = [toDict(tks) for tks in btkss]
+        """`atks` is a list of tokens or, like `QueryPlan.weights`, their weights from `token_weights`."""
+        if not isinstance(atks, dict):
+            atks = self.token_weights(atks)
+        btkss = [self.token_weights(tks) for tks in btkss]
         return [self.similarity(atks, btks) for btks in btkss]
 
     def similarity(self, qtwt, dtwt):
@@ -15,24 +15,110 @@
 #
 
 import logging
-import copy
 import datrie
 import math
+import multiprocessing
 import os
 import re
 import string
 import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from hanziconv import HanziConv
 from nltk import word_tokenize
 from nltk.stem import PorterStemmer, WordNetLemmatizer
 from api.utils.file_utils import get_project_base_directory
+from rag.nlp.compiled_dict import REVERSED, CompiledDict
+from rag.settings import TOKENIZER_BATCH_MIN, TOKENIZER_CACHE_SIZE, TOKENIZER_WORKERS
+
+_tokenize_process_pool = None
+_tokenize_process_pool_lock = threading.Lock()
+
+
+def _tokenize_batch_in_process(texts, fine_grained):
+    return tokenizer.tokenize_batch(texts, fine_grained)
+
+
+def get_tokenize_process_pool():
+    """Process pool for large `tokenize_batch` calls, created on first use. Every worker loads the default dictionary."""
+    global _tokenize_process_pool
+    with _tokenize_process_pool_lock:
+        if _tokenize_process_pool is None:
+            _tokenize_process_pool = ProcessPoolExecutor(max_workers=TOKENIZER_WORKERS,
+                                                         mp_context=multiprocessing.get_context("spawn"))
+            logging.info(f"[HUQIE]:Tokenizer process pool started with {TOKENIZER_WORKERS} workers")
+        return _tokenize_process_pool
+
+
+class TrieDict:
+    """
+    Tokenizer dictionary in a mutable datrie, words under `RagTokenizer.key_` and reversed words under `RagTokenizer.rkey_`.
+    `root`/`walk`/`data` walk the trie char by char, `walk` returns None once no word continues.
+    """
+
+    def __init__(self, trie):
+        self.trie = trie
+
+    def get(self, word):
+        k = RagTokenizer.key_(word)
+        return self.trie[k] if k in self.trie else None
+
+    def has_keys_with_prefix(self, word):
+        return self.trie.has_keys_with_prefix(RagTokenizer.key_(word))
+
+    def root(self, reverse=False):
+        state = datrie.State(self.trie)
+        if reverse:
+            state.walk("DD")
+        return state
+
+    def walk(self, state, ch):
+        return state if state.walk(RagTokenizer.key_(ch)) else None
+
+    def data(self, state):
+        return state.data() if state.is_terminal() else None
+
+
+class CompiledTrieDict:
+    """
+    Tokenizer dictionary compiled by rag/nlp/compiled_dict.py, memory-mapped so all processes share it.
+    Same interface as `TrieDict`, read-only.
+    """
+
+    def __init__(self, fnm):
+        self.dict = CompiledDict(fnm)
+        self.freq, self.tag = self.dict.array("freq"), self.dict.array("tag")
+
+    def entry_(self, i):
+        return self.freq[i], self.dict.strings[self.tag[i]]
+
+    def get(self, word):
+        i = self.dict.index(word.lower())
+        return self.entry_(i) if i >= 0 else None
+
+    def has_keys_with_prefix(self, word):
+        return self.dict.has_keys_with_prefix(word.lower())
+
+    def root(self, reverse=False):
+        return self.dict.walk(0, REVERSED) if reverse else 0
+
+    def walk(self, node, ch):
+        node = self.dict.walk(node, ch.lower().encode("utf-8"))
+        return node if node >= 0 else None
+
+    def data(self, node):
+        i = self.dict.value[node]
+        return self.entry_(i) if i >= 0 else None
 
 
 class RagTokenizer:
-    def key_(self, line):
+    @staticmethod
+    def key_(line):
         return str(line.lower().encode("utf-8"))[2:-1]
 
-    def rkey_(self, line):
+    @staticmethod
+    def rkey_(line):
         return str(("DD" + (line[::-1].lower())).encode("utf-8"))[2:-1]
 
     def loadDict_(self, fnm):
@@ -57,23 +143,46 @@ class RagTokenizer:
             of.close()
         except Exception:
             logging.exception(f"[HUQIE]:Build trie {fnm} failed")
+        self.dict_ = TrieDict(self.trie_)
+        self.resetCache_()
+
+    def resetCache_(self):
+        # Segmentations depend on the dictionary, they are memoized per dictionary.
+        self.zh_tks_ = lru_cache(maxsize=TOKENIZER_CACHE_SIZE)(self._tokenize_zh)
+        self.en_tks_ = lru_cache(maxsize=TOKENIZER_CACHE_SIZE)(self._tokenize_en)
+        self.stem_ = lru_cache(maxsize=TOKENIZER_CACHE_SIZE)(self._stem)
 
     def __init__(self, debug=False):
         self.DEBUG = debug
         self.DENOMINATOR = 1000000
         self.DIR_ = os.path.join(get_project_base_directory(), "rag/res", "huqie")
+        self.custom_dict_ = False
 
         self.stemmer = PorterStemmer()
         self.lemmatizer = WordNetLemmatizer()
+        self.resetCache_()
 
         self.SPLIT_CHAR = r"([ ,\.<>/?;:'\[\]\\`!@#$%^&*\(\)\{\}\|_+=《》，。？、；‘’：“”【】~！￥%……（）——-]+|[a-zA-Z0-9,\.-]+)"
 
+        # the compiled dictionary, if built ahead of time, is shared with the other processes of the host
+        compiled_file_name = self.DIR_ + ".dat"
+        if os.path.exists(compiled_file_name):
+            try:
+                self.dict_ = CompiledTrieDict(compiled_file_name)
+                return
+            except Exception:
+                logging.exception(f"[HUQIE]:Fail to load compiled dictionary {compiled_file_name}")
+        self.loadTrie_()
+
+    def loadTrie_(self):
         trie_file_name = self.DIR_ + ".txt.trie"
         # check if trie file existence
         if os.path.exists(trie_file_name):
             try:
                 # load trie from file
                 self.trie_ = datrie.Trie.load(trie_file_name)
+                self.dict_ = TrieDict(self.trie_)
+                self.resetCache_()
                 return
             except Exception:
                 # fail to load trie from file, build default trie
@@ -88,14 +197,21 @@ class RagTokenizer:
         self.loadDict_(self.DIR_ + ".txt")
 
     def loadUserDict(self, fnm):
+        self.custom_dict_ = True
         try:
             self.trie_ = datrie.Trie.load(fnm + ".trie")
+            self.dict_ = TrieDict(self.trie_)
+            self.resetCache_()
             return
         except Exception:
             self.trie_ = datrie.Trie(string.printable)
         self.loadDict_(fnm)
 
     def addUserDict(self, fnm):
+        self.custom_dict_ = True
+        if not isinstance(self.dict_, TrieDict):
+            # the compiled dictionary is read-only, add to a trie of it
+            self.loadTrie_()
         self.loadDict_(fnm)
 
     def _strQ2B(self, ustring):
@@ -122,10 +238,8 @@ class RagTokenizer:
         MAX_DEPTH = 10
         if _depth > MAX_DEPTH:
             if s < len(chars):
-                copy_pretks = copy.deepcopy(preTks)
                 remaining = "".join(chars[s:])
-                copy_pretks.append((remaining, (-12, '')))
-                tkslist.append(copy_pretks)
+                tkslist.append(preTks + [(remaining, (-12, ''))])
             return s
     
         state_key = (s, tuple(tk[0] for tk in preTks)) if preTks else (s, None)
@@ -150,12 +264,8 @@ class RagTokenizer:
                     end += 1
                 mid = s + min(10, end - s)
                 t = "".join(chars[s:mid])
-                k = self.key_(t)
-                copy_pretks = copy.deepcopy(preTks)
-                if k in self.trie_:
-                    copy_pretks.append((t, self.trie_[k]))
-                else:
-                    copy_pretks.append((t, (-12, '')))
+                # token tuples are immutable, extending a copy of the list is enough
+                copy_pretks = preTks + [(t, self.dict_.get(t) or (-12, ''))]
                 next_res = self.dfs_(chars, mid, copy_pretks, tkslist, _depth + 1, _memo)
                 res = max(res, next_res)
                 _memo[state_key] = res
@@ -165,49 +275,50 @@ class RagTokenizer:
         if s + 2 <= len(chars):
             t1 = "".join(chars[s:s + 1])
             t2 = "".join(chars[s:s + 2])
-            if self.trie_.has_keys_with_prefix(self.key_(t1)) and not self.trie_.has_keys_with_prefix(self.key_(t2)):
+            if self.dict_.has_keys_with_prefix(t1) and not self.dict_.has_keys_with_prefix(t2):
                 S = s + 2
         if len(preTks) > 2 and len(preTks[-1][0]) == 1 and len(preTks[-2][0]) == 1 and len(preTks[-3][0]) == 1:
             t1 = preTks[-1][0] + "".join(chars[s:s + 1])
-            if self.trie_.has_keys_with_prefix(self.key_(t1)):
+            if self.dict_.has_keys_with_prefix(t1):
                 S = s + 2
     
-        for e in range(S, len(chars) + 1):
-            t = "".join(chars[s:e])
-            k = self.key_(t)
-            if e > s + 1 and not self.trie_.has_keys_with_prefix(k):
-                break
-            if k in self.trie_:
-                pretks = copy.deepcopy(preTks)
-                pretks.append((t, self.trie_[k]))
-                res = max(res, self.dfs_(chars, e, pretks, tkslist, _depth + 1, _memo))
+        # Walk the trie one char at a time instead of probing every prefix from the root.
+        state = self.dict_.root()
+        for e in range(s + 1, len(chars) + 1):
+            if state is not None:
+                state = self.dict_.walk(state, chars[e - 1])
+            if e < S:
+                continue
+            if state is None:
+                if e > s + 1:
+                    break
+                continue
+            data = self.dict_.data(state)
+            if data is not None:
+                t = "".join(chars[s:e])
+                res = max(res, self.dfs_(chars, e, preTks + [(t, data)], tkslist, _depth + 1, _memo))
         
         if res > s:
             _memo[state_key] = res
             return res
     
         t = "".join(chars[s:s + 1])
-        k = self.key_(t)
-        copy_pretks = copy.deepcopy(preTks)
-        if k in self.trie_:
-            copy_pretks.append((t, self.trie_[k]))
-        else:
-            copy_pretks.append((t, (-12, '')))
+        copy_pretks = preTks + [(t, self.dict_.get(t) or (-12, ''))]
         result = self.dfs_(chars, s + 1, copy_pretks, tkslist, _depth + 1, _memo)
         _memo[state_key] = result
         return result
 
     def freq(self, tk):
-        k = self.key_(tk)
-        if k not in self.trie_:
+        v = self.dict_.get(tk)
+        if v is None:
             return 0
-        return int(math.exp(self.trie_[k][0]) * self.DENOMINATOR + 0.5)
+        return int(math.exp(v[0]) * self.DENOMINATOR + 0.5)
 
     def tag(self, tk):
-        k = self.key_(tk)
-        if k not in self.trie_:
+        v = self.dict_.get(tk)
+        if v is None:
             return ""
-        return self.trie_[k][1]
+        return v[1]
 
     def score_(self, tfts):
         B = 30
@@ -250,51 +361,46 @@ class RagTokenizer:
         res = []
         s = 0
         while s < len(line):
-            e = s + 1
-            t = line[s:e]
-            while e < len(line) and self.trie_.has_keys_with_prefix(
-                    self.key_(t)):
+            # the longest word starting at s, walking the trie as long as line[s:e] prefixes a word
+            state = self.dict_.root()
+            e, word = s, None
+            while e < len(line) and (state := self.dict_.walk(state, line[e])) is not None:
                 e += 1
-                t = line[s:e]
-
-            while e - 1 > s and self.key_(t) not in self.trie_:
-                e -= 1
-                t = line[s:e]
-
-            if self.key_(t) in self.trie_:
-                res.append((t, self.trie_[self.key_(t)]))
-            else:
-                res.append((t, (0, '')))
-
+                data = self.dict_.data(state)
+                if data is not None:
+                    word = (e, data)
+            e, data = word if word else (s + 1, (0, ''))
+            res.append((line[s:e], data))
             s = e
 
         return self.score_(res)
 
     def maxBackward_(self, line):
         res = []
-        s = len(line) - 1
-        while s >= 0:
-            e = s + 1
-            t = line[s:e]
-            while s > 0 and self.trie_.has_keys_with_prefix(self.rkey_(t)):
+        e = len(line)
+        while e > 0:
+            # the longest word ending at e, walking the reversed words backwards from e
+            state = self.dict_.root(reverse=True)
+            s, start = e - 1, None
+            while s >= 0 and state is not None and (state := self.dict_.walk(state, line[s])) is not None:
+                if self.dict_.data(state) is not None:
+                    start = s
                 s -= 1
-                t = line[s:e]
-
-            while s + 1 < e and self.key_(t) not in self.trie_:
-                s += 1
-                t = line[s:e]
-
-            if self.key_(t) in self.trie_:
-                res.append((t, self.trie_[self.key_(t)]))
-            else:
-                res.append((t, (0, '')))
-
-            s -= 1
+            if start is None:
+                res.append((line[e - 1:e], (0, '')))
+                e -= 1
+                continue
+            t = line[start:e]
+            res.append((t, self.dict_.get(t)))
+            e = start
 
         return self.score_(res[::-1])
 
+    def _stem(self, t):
+        return self.stemmer.stem(self.lemmatizer.lemmatize(t))
+
     def english_normalize_(self, tks):
-        return [self.stemmer.stem(self.lemmatizer.lemmatize(t)) if re.match(r"[a-zA-Z_-]+$", t) else t for t in tks]
+        return [self.stem_(t) if re.match(r"[a-zA-Z_-]+$", t) else t for t in tks]
 
     def _split_by_lang(self, line):
         txt_lang_pairs = []
@@ -319,6 +425,65 @@ class RagTokenizer:
             txt_lang_pairs.append((a[s: e], zh))
         return txt_lang_pairs
 
+    def _tokenize_en(self, L):
+        return tuple(self.stem_(t) for t in word_tokenize(L))
+
+    def _tokenize_zh(self, L):
+        res = []
+        # use maxforward for the first time
+        tks, s = self.maxForward_(L)
+        tks1, s1 = self.maxBackward_(L)
+        if self.DEBUG:
+            logging.debug("[FW] {} {}".format(tks, s))
+            logging.debug("[BW] {} {}".format(tks1, s1))
+
+        i, j, _i, _j = 0, 0, 0, 0
+        same = 0
+        while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
+            same += 1
+        if same > 0:
+            res.append(" ".join(tks[j: j + same]))
+        _i = i + same
+        _j = j + same
+        j = _j + 1
+        i = _i + 1
+
+        while i < len(tks1) and j < len(tks):
+            tk1, tk = "".join(tks1[_i:i]), "".join(tks[_j:j])
+            if tk1 != tk:
+                if len(tk1) > len(tk):
+                    j += 1
+                else:
+                    i += 1
+                continue
+
+            if tks1[i] != tks[j]:
+                i += 1
+                j += 1
+                continue
+            # backward tokens from_i to i are different from forward tokens from _j to j.
+            tkslist = []
+            self.dfs_("".join(tks[_j:j]), 0, [], tkslist)
+            res.append(" ".join(self.sortTks_(tkslist)[0][0]))
+
+            same = 1
+            while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
+                same += 1
+            res.append(" ".join(tks[j: j + same]))
+            _i = i + same
+            _j = j + same
+            j = _j + 1
+            i = _i + 1
+
+        if _i < len(tks1):
+            assert _j < len(tks)
+            assert "".join(tks1[_i:]) == "".join(tks[_j:])
+            tkslist = []
+            self.dfs_("".join(tks[_j:]), 0, [], tkslist)
+            res.append(" ".join(self.sortTks_(tkslist)[0][0]))
+
+        return " ".join(res)
+
     def tokenize(self, line):
         line = re.sub(r"\W+", " ", line)
         line = self._strQ2B(line).lower()
@@ -328,68 +493,38 @@ class RagTokenizer:
         res = []
         for L,lang in arr:
             if not lang:
-                res.extend([self.stemmer.stem(self.lemmatizer.lemmatize(t)) for t in word_tokenize(L)])
+                res.extend(self.en_tks_(L))
                 continue
             if len(L) < 2 or re.match(
                     r"[a-z\.-]+$", L) or re.match(r"[0-9\.-]+$", L):
                 res.append(L)
                 continue
-
-            # use maxforward for the first time
-            tks, s = self.maxForward_(L)
-            tks1, s1 = self.maxBackward_(L)
-            if self.DEBUG:
-                logging.debug("[FW] {} {}".format(tks, s))
-                logging.debug("[BW] {} {}".format(tks1, s1))
-
-            i, j, _i, _j = 0, 0, 0, 0
-            same = 0
-            while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
-                same += 1
-            if same > 0:
-                res.append(" ".join(tks[j: j + same]))
-            _i = i + same
-            _j = j + same
-            j = _j + 1
-            i = _i + 1
-
-            while i < len(tks1) and j < len(tks):
-                tk1, tk = "".join(tks1[_i:i]), "".join(tks[_j:j])
-                if tk1 != tk:
-                    if len(tk1) > len(tk):
-                        j += 1
-                    else:
-                        i += 1
-                    continue
-
-                if tks1[i] != tks[j]:
-                    i += 1
-                    j += 1
-                    continue
-                # backward tokens from_i to i are different from forward tokens from _j to j.
-                tkslist = []
-                self.dfs_("".join(tks[_j:j]), 0, [], tkslist)
-                res.append(" ".join(self.sortTks_(tkslist)[0][0]))
-
-                same = 1
-                while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
-                    same += 1
-                res.append(" ".join(tks[j: j + same]))
-                _i = i + same
-                _j = j + same
-                j = _j + 1
-                i = _i + 1
-
-            if _i < len(tks1):
-                assert _j < len(tks)
-                assert "".join(tks1[_i:]) == "".join(tks[_j:])
-                tkslist = []
-                self.dfs_("".join(tks[_j:]), 0, [], tkslist)
-                res.append(" ".join(self.sortTks_(tkslist)[0][0]))
-
-        res = " ".join(res)
-        logging.debug("[TKS] {}".format(self.merge_(res)))
-        return self.merge_(res)
+            res.append(self.zh_tks_(L))
+
+        res = self.merge_(" ".join(res))
+        logging.debug("[TKS] {}".format(res))
+        return res
+
+    def tokenize_batch(self, texts, fine_grained=False):
+        """
+        `tokenize` every text, or (tokens, fine grained tokens) pairs when `fine_grained`.
+        Duplicates are tokenized once; batches of at least TOKENIZER_BATCH_MIN texts are spread over
+        TOKENIZER_WORKERS processes unless a user dictionary is loaded.
+        """
+        texts = list(texts)
+        uniq = list(dict.fromkeys(texts))
+        if TOKENIZER_WORKERS > 0 and len(uniq) >= TOKENIZER_BATCH_MIN and self is tokenizer and not self.custom_dict_:
+            pool = get_tokenize_process_pool()
+            size = -(-len(uniq) // (TOKENIZER_WORKERS * 4))
+            futures = [pool.submit(_tokenize_batch_in_process, uniq[i:i + size], fine_grained) for i in range(0, len(uniq), size)]
+            done = [r for f in futures for r in f.result()]
+        else:
+            done = []
+            for t in uniq:
+                tks = self.tokenize(t)
+                done.append((tks, self.fine_grained_tokenize(tks)) if fine_grained else tks)
+        done = dict(zip(uniq, done))
+        return [done[t] for t in texts]
 
     def fine_grained_tokenize(self, tks):
         tks = tks.split()
@@ -466,6 +601,7 @@ def naiveQie(txt):
 
 tokenizer = RagTokenizer()
 tokenize = tokenizer.tokenize
+tokenize_batch = tokenizer.tokenize_batch
 fine_grained_tokenize = tokenizer.fine_grained_tokenize
 tag = tokenizer.tag
 freq = tokenizer.freq
@@ -84,7 +84,7 @@ class Dealer:
                       ["docnm_kwd", "content_ltks", "kb_id", "img_id", "title_tks", "important_kwd", "position_int",
                        "doc_id", "page_num_int", "top_int", "create_timestamp_flt", "knowledge_graph_kwd",
                        "question_kwd", "question_tks", "doc_type_kwd",
-                       "available_int", "content_with_weight", PAGERANK_FLD, TAG_FLD])
+                       "available_int", "content_with_weight", "token_num_int", PAGERANK_FLD, TAG_FLD])
         kwds = set([])
 
         qst = req.get("question", "")
@@ -280,7 +280,7 @@ class Dealer:
                vtweight=0.7, cfield="content_ltks",
                rank_feature: dict | None = None
                ):
-        _, keywords = self.qryr.question(query)
+        plan = self.qryr.plan(query)
         vector_size = len(sres.query_vector)
         vector_column = f"q_{vector_size}_vec"
         zero_vector = [0.0] * vector_size
@@ -310,7 +310,7 @@ class Dealer:
 
         sim, tksim, vtsim = self.qryr.hybrid_similarity(sres.query_vector,
                                                         ins_embd,
-                                                        keywords,
+                                                        plan.weights,
                                                         ins_tw, tkweight, vtweight)
 
         return sim + rank_fea, tksim, vtsim
@@ -318,7 +318,7 @@ class Dealer:
     def rerank_by_model(self, rerank_mdl, sres, query, tkweight=0.3,
                         vtweight=0.7, cfield="content_ltks",
                         rank_feature: dict | None = None):
-        _, keywords = self.qryr.question(query)
+        plan = self.qryr.plan(query)
 
         for i in sres.ids:
             if isinstance(sres.field[i].get("important_kwd", []), str):
@@ -331,7 +331,7 @@ class Dealer:
             tks = content_ltks + title_tks + important_kwd
             ins_tw.append(tks)
 
-        tksim = self.qryr.token_similarity(keywords, ins_tw)
+        tksim = self.qryr.token_similarity(plan.weights, ins_tw)
         vtsim, _ = rerank_mdl.similarity(query, [rmSpace(" ".join(tks)) for tks in ins_tw])
         ## For rank feature(tag_fea) scores.
         rank_fea = self._rank_feature_scores(rank_feature, sres)
@@ -407,6 +407,7 @@ class Dealer:
                 "chunk_id": id,
                 "content_ltks": chunk["content_ltks"],
                 "content_with_weight": chunk["content_with_weight"],
+                "token_num_int": chunk.get("token_num_int", 0),
                 "doc_id": did,
                 "docnm_kwd": dnm,
                 "kb_id": chunk["kb_id"],
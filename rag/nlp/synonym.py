@@ -17,24 +17,36 @@
 import logging
 import json
 import os
+import threading
 import time
 import re
+from functools import lru_cache
 from nltk.corpus import wordnet
 from api.utils.file_utils import get_project_base_directory
+from rag.settings import SYNONYM_REFRESH_INTERVAL
+
+ENGLISH_WORD = re.compile(r"[a-z]+$")
+SPACES = re.compile(r"[ \t]+")
+
+
+def normalize(tk):
+    return SPACES.sub(" ", tk.lower())
+
+
+@lru_cache(maxsize=10000)
+def wordnet_synonyms(tk):
+    res = list(set([re.sub("_", " ", syn.name().split(".")[0]) for syn in wordnet.synsets(tk)]) - set([tk]))
+    return tuple(t for t in res if t)
 
 
 class Dealer:
     def __init__(self, redis=None):
-
-        self.lookup_num = 100000000
-        self.load_tm = time.time() - 1000000
-        self.dictionary = None
+        self.dictionary = {}
         path = os.path.join(get_project_base_directory(), "rag/res", "synonym.json")
         try:
-            self.dictionary = json.load(open(path, 'r'))
+            self.dictionary = self.compile(json.load(open(path, 'r')))
         except Exception:
             logging.warning("Missing synonym.json")
-            self.dictionary = {}
 
         if not redis:
             logging.warning(
@@ -44,39 +56,45 @@ class Dealer:
 
         self.redis = redis
         self.load()
+        if self.redis:
+            threading.Thread(target=self.refresh, name="synonym-refresh", daemon=True).start()
+
+    @staticmethod
+    def compile(d):
+        """Lookup map of a synonym dictionary: normalized keys, values as lists."""
+        return {normalize(k): [v] if isinstance(v, str) else v for k, v in d.items()}
 
     def load(self):
         if not self.redis:
             return
-
-        if self.lookup_num < 100:
-            return
-        tm = time.time()
-        if tm - self.load_tm < 3600:
-            return
-
-        self.load_tm = time.time()
-        self.lookup_num = 0
         d = self.redis.get("kevin_synonyms")
         if not d:
             return
         try:
-            d = json.loads(d)
-            self.dictionary = d
+            # Lookups read self.dictionary without a lock, the new map replaces it in one assignment.
+            self.dictionary = self.compile(json.loads(d))
         except Exception as e:
             logging.error("Fail to load synonym!" + str(e))
 
+    def refresh(self):
+        """Reload the realtime synonyms every SYNONYM_REFRESH_INTERVAL seconds, off the query path."""
+        while True:
+            time.sleep(SYNONYM_REFRESH_INTERVAL)
+            try:
+                self.load()
+            except Exception:
+                logging.exception("Refresh synonym FAIL!")
+
     def lookup(self, tk, topn=8):
-        if re.match(r"[a-z]+$", tk):
-            res = list(set([re.sub("_", " ", syn.name().split(".")[0]) for syn in wordnet.synsets(tk)]) - set([tk]))
-            return [t for t in res if t]
+        if ENGLISH_WORD.match(tk):
+            return list(wordnet_synonyms(tk))
+        return self.dictionary.get(normalize(tk), [])[:topn]
 
-        self.lookup_num += 1
-        self.load()
-        res = self.dictionary.get(re.sub(r"[ \t]+", " ", tk.lower()), [])
-        if isinstance(res, str):
-            res = [res]
-        return res[:topn]
+    def lookup_many(self, tks, topn=8):
+        """`lookup` of every token, against one version of the dictionary."""
+        dictionary = self.dictionary
+        return [list(wordnet_synonyms(tk)) if ENGLISH_WORD.match(tk) else dictionary.get(normalize(tk), [])[:topn]
+                for tk in tks]
 
 
 if __name__ == '__main__':
@@ -19,8 +19,11 @@ import math
 import json
 import re
 import os
+from functools import lru_cache
 import numpy as np
 from rag.nlp import rag_tokenizer
+from rag.settings import TERM_WEIGHT_CACHE_SIZE
+from rag.nlp.compiled_dict import CompiledMap
 from api.utils.file_utils import get_project_base_directory
 
 
@@ -78,16 +81,24 @@ class Dealer:
                 return set(res.keys())
             return res
 
+        def load_compiled(fnm):
+            # compiled by rag/nlp/compiled_dict.py, memory-mapped and shared by all processes
+            try:
+                return CompiledMap(fnm) if os.path.exists(fnm) else None
+            except Exception:
+                logging.exception(f"Load {fnm} FAIL!")
+
         fnm = os.path.join(get_project_base_directory(), "rag/res")
         self.ne, self.df = {}, {}
         try:
-            self.ne = json.load(open(os.path.join(fnm, "ner.json"), "r"))
+            self.ne = load_compiled(os.path.join(fnm, "ner.dat")) or json.load(open(os.path.join(fnm, "ner.json"), "r"))
         except Exception:
             logging.warning("Load ner.json FAIL!")
         try:
-            self.df = load_dict(os.path.join(fnm, "term.freq"))
+            self.df = load_compiled(os.path.join(fnm, "term.freq.dat")) or load_dict(os.path.join(fnm, "term.freq"))
         except Exception:
             logging.warning("Load term.freq FAIL!")
+        self.token_weight_ = lru_cache(maxsize=TERM_WEIGHT_CACHE_SIZE)(self.token_weight)
 
     def pretoken(self, txt, num=False, stpwd=True):
         patt = [
@@ -159,12 +170,8 @@ class Dealer:
                 tks.append(t)
         return tks
 
-    def weights(self, tks, preprocess=True):
-        def skill(t):
-            if t not in self.sk:
-                return 1
-            return 6
-
+    def token_weight(self, t):
+        """Weight of token `t` before normalization, it only depends on the token and the dictionaries."""
         def ner(t):
             if re.match(r"[0-9,.]{2,}$", t):
                 return 2
@@ -222,23 +229,12 @@ class Dealer:
 
         def idf(s, N): return math.log10(10 + ((N - s + 0.5) / (s + 0.5)))
 
-        tw = []
-        if not preprocess:
-            idf1 = np.array([idf(freq(t), 10000000) for t in tks])
-            idf2 = np.array([idf(df(t), 1000000000) for t in tks])
-            wts = (0.3 * idf1 + 0.7 * idf2) * \
-                np.array([ner(t) * postag(t) for t in tks])
-            wts = [s for s in wts]
-            tw = list(zip(tks, wts))
-        else:
-            for tk in tks:
-                tt = self.tokenMerge(self.pretoken(tk, True))
-                idf1 = np.array([idf(freq(t), 10000000) for t in tt])
-                idf2 = np.array([idf(df(t), 1000000000) for t in tt])
-                wts = (0.3 * idf1 + 0.7 * idf2) * \
-                    np.array([ner(t) * postag(t) for t in tt])
-                wts = [s for s in wts]
-                tw.extend(zip(tt, wts))
-
-        S = np.sum([s for _, s in tw])
-        return [(t, s / S) for t, s in tw]
+        return (0.3 * idf(freq(t), 10000000) + 0.7 * idf(df(t), 1000000000)) * (ner(t) * postag(t))
+
+    def weights(self, tks, preprocess=True):
+        if preprocess:
+            tks = [t for tk in tks for t in self.tokenMerge(self.pretoken(tk, True))]
+        # Token weights are memoized unless a user dictionary may have changed them.
+        wt = self.token_weight if rag_tokenizer.tokenizer.custom_dict_ else self.token_weight_
+        wts = np.fromiter((wt(t) for t in tks), dtype=np.float64, count=len(tks))
+        return list(zip(tks, wts / np.sum(wts)))
@@ -24,7 +24,7 @@ import json_repair
 from api.utils import hash_str2int
 from rag.prompts.prompt_template import load_prompt
 from rag.settings import TAG_FLD
-from rag.utils import encoder, num_tokens_from_string
+from rag.utils import num_tokens_from_string, num_tokens_from_strings, truncate
 
 
 STOP_TOKEN="<|STOP|>"
@@ -59,13 +59,7 @@ def chunks_format(reference):
 def message_fit_in(msg, max_length=4000):
     def count():
         nonlocal msg
-        tks_cnts = []
-        for m in msg:
-            tks_cnts.append({"role": m["role"], "count": num_tokens_from_string(m["content"])})
-        total = 0
-        for m in tks_cnts:
-            total += m["count"]
-        return total
+        return sum(num_tokens_from_strings([m["content"] for m in msg]))
 
     c = count()
     if c < max_length:
@@ -82,14 +76,10 @@ def message_fit_in(msg, max_length=4000):
     ll = num_tokens_from_string(msg_[0]["content"])
     ll2 = num_tokens_from_string(msg_[-1]["content"])
     if ll / (ll + ll2) > 0.8:
-        m = msg_[0]["content"]
-        m = encoder.decode(encoder.encode(m)[: max_length - ll2])
-        msg[0]["content"] = m
+        msg[0]["content"] = truncate(msg_[0]["content"], max_length - ll2)
         return max_length, msg
 
-    m = msg_[-1]["content"]
-    m = encoder.decode(encoder.encode(m)[: max_length - ll2])
-    msg[-1]["content"] = m
+    msg[-1]["content"] = truncate(msg_[-1]["content"], max_length - ll2)
     return max_length, msg
 
 
@@ -103,7 +93,8 @@ def kb_prompt(kbinfos, max_tokens, hash_id=False):
     for i, c in enumerate(knowledges):
         if not c:
             continue
-        used_token_count += num_tokens_from_string(c)
+        # Chunks indexed with their token count are not tokenized again.
+        used_token_count += kbinfos["chunks"][i].get("token_num_int") or num_tokens_from_string(c)
         chunks_num += 1
         if max_tokens * 0.97 < used_token_count:
             knowledges = knowledges[:i]
@@ -14,6 +14,7 @@
 #  limitations under the License.
 #
 import os
+import json
 import logging
 from api.utils import get_base_config, decrypt_database_config
 from api.utils.file_utils import get_project_base_directory
@@ -71,6 +72,47 @@ try:
 except Exception:
     logging.info("can't import package 'torch'")
 
+# Number of worker processes used for PDF OCR on CPU-only hosts, 0 keeps OCR in-process.
+OCR_CPU_WORKERS = int(os.environ.get("OCR_CPU_WORKERS", 0))
+OCR_INTRA_OP_NUM_THREADS = int(os.environ.get("OCR_INTRA_OP_NUM_THREADS", 2))
+OCR_INTER_OP_NUM_THREADS = int(os.environ.get("OCR_INTER_OP_NUM_THREADS", 2))
+# Rendered PDF page images kept in memory per parser, other pages are rendered again on demand.
+PDF_PAGE_IMAGE_CACHE_SIZE = int(os.environ.get("PDF_PAGE_IMAGE_CACHE_SIZE", 16))
+# Build text lines of born-digital PDF pages from their text layer instead of OCR when it looks trustworthy.
+PDF_TEXT_LAYER_FAST_PATH = os.environ.get("PDF_TEXT_LAYER_FAST_PATH", "true").lower() in ["true", "1", "yes"]
+# Text recognition batches take up to OCR_REC_MAX_BATCH crops, as long as their padded widths sum to OCR_REC_BATCH_WIDTH at most.
+OCR_REC_MAX_BATCH = int(os.environ.get("OCR_REC_MAX_BATCH", 64))
+OCR_REC_BATCH_WIDTH = int(os.environ.get("OCR_REC_BATCH_WIDTH", 64 * 320))
+# onnxruntime sessions of deepdoc models (det, rec, layout, tsr, ...). Each model gets a pool of up to
+# DEEPDOC_SESSION_POOL_SIZE sessions. DEEPDOC_MODEL_VARIANT picks e.g. "int8"/"fp16" files (<model>.<variant>.onnx) when present.
+# DEEPDOC_SESSION_OPTIONS overrides any of these per model, e.g. {"rec": {"pool_size": 4, "intra_op_num_threads": 1, "variant": "int8"}};
+# accepted keys: pool_size, intra_op_num_threads, inter_op_num_threads, graph_optimization_level (disable/basic/extended/all),
+# variant, enable_cpu_mem_arena, providers.
+DEEPDOC_SESSION_POOL_SIZE = int(os.environ.get("DEEPDOC_SESSION_POOL_SIZE", 1))
+DEEPDOC_GRAPH_OPTIMIZATION_LEVEL = os.environ.get("DEEPDOC_GRAPH_OPTIMIZATION_LEVEL", "")
+DEEPDOC_MODEL_VARIANT = os.environ.get("DEEPDOC_MODEL_VARIANT", "")
+DEEPDOC_CPU_MEM_ARENA = os.environ.get("DEEPDOC_CPU_MEM_ARENA", "false").lower() in ["true", "1", "yes"]
+try:
+    DEEPDOC_SESSION_OPTIONS = json.loads(os.environ.get("DEEPDOC_SESSION_OPTIONS", "{}"))
+except Exception:
+    logging.exception("DEEPDOC_SESSION_OPTIONS is not valid JSON, ignored")
+    DEEPDOC_SESSION_OPTIONS = {}
+# Object storage bucket for per-page deepdoc results (OCR boxes, layouts, table structures), empty disables the cache.
+DEEPDOC_PAGE_CACHE_BUCKET = os.environ.get("DEEPDOC_PAGE_CACHE_BUCKET", "")
+# Worker processes building table HTML when a document has many tables, 0 builds them in-process.
+TABLE_CONSTRUCT_WORKERS = int(os.environ.get("TABLE_CONSTRUCT_WORKERS", 0))
+# rag_tokenizer memoizes segmentations of up to TOKENIZER_CACHE_SIZE text runs. tokenize_batch spreads batches of
+# at least TOKENIZER_BATCH_MIN texts over TOKENIZER_WORKERS processes, 0 tokenizes in-process.
+TOKENIZER_CACHE_SIZE = int(os.environ.get("TOKENIZER_CACHE_SIZE", 100000))
+TOKENIZER_WORKERS = int(os.environ.get("TOKENIZER_WORKERS", 0))
+TOKENIZER_BATCH_MIN = int(os.environ.get("TOKENIZER_BATCH_MIN", 256))
+# term_weight memoizes the weights of up to TERM_WEIGHT_CACHE_SIZE tokens.
+TERM_WEIGHT_CACHE_SIZE = int(os.environ.get("TERM_WEIGHT_CACHE_SIZE", 100000))
+# FulltextQueryer memoizes the query plans of up to QUERY_PLAN_CACHE_SIZE questions.
+QUERY_PLAN_CACHE_SIZE = int(os.environ.get("QUERY_PLAN_CACHE_SIZE", 4096))
+# Seconds between reloads of the realtime synonyms from Redis.
+SYNONYM_REFRESH_INTERVAL = int(os.environ.get("SYNONYM_REFRESH_INTERVAL", 3600))
+
 def print_rag_settings():
     logging.info(f"MAX_CONTENT_LENGTH: {DOC_MAXIMUM_SIZE}")
     logging.info(f"MAX_FILE_COUNT_PER_USER: {int(os.environ.get('MAX_FILE_NUM_PER_USER', 0))}")
@@ -50,7 +50,7 @@ from peewee import DoesNotExist
 from api.db import LLMType, ParserType
 from api.db.services.document_service import DocumentService
 from api.db.services.llm_service import LLMBundle
-from api.db.services.task_service import TaskService, has_canceled
+from api.db.services.task_service import TaskService, TaskCanceledException, has_canceled
 from api.db.services.file2document_service import File2DocumentService
 from api import settings
 from api.versions import get_AeroKG_version
@@ -60,7 +60,7 @@ from rag.app import laws, paper, presentation, manual, qa, table, book, resume,
 from rag.nlp import search, rag_tokenizer
 from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
 from rag.settings import DOC_MAXIMUM_SIZE, DOC_BULK_SIZE, EMBEDDING_BATCH_SIZE, SVR_CONSUMER_GROUP_NAME, get_svr_queue_name, get_svr_queue_names, print_rag_settings, TAG_FLD, PAGERANK_FLD
-from rag.utils import num_tokens_from_string, truncate
+from rag.utils import num_tokens_from_string, num_tokens_from_strings, truncate
 from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
 from rag.utils.storage_factory import STORAGE_IMPL
 from graphrag.utils import chat_limiter
@@ -149,10 +149,6 @@ def stop_tracemalloc(signum, frame):
     else:
         logging.info("tracemalloc not running")
 
-class TaskCanceledException(Exception):
-    def __init__(self, msg):
-        self.msg = msg
-
 
 def set_progress(task_id, from_page=0, to_page=-1, prog=None, msg="Processing..."):
     try:
@@ -270,6 +266,12 @@ async def build_chunks(task, progress_callback):
         logging.exception("Chunking {}/{} got exception".format(task["location"], task["name"]))
         raise
 
+    # Chunks without a position still sort in document order, also across the tasks a document was split into.
+    for i, ck in enumerate(cks):
+        if "page_num_int" not in ck:
+            ck["page_num_int"] = [task["from_page"] + 1]
+            ck["top_int"] = [i]
+
     docs = []
     doc = {
         "doc_id": task["doc_id"],
@@ -282,7 +284,7 @@ async def build_chunks(task, progress_callback):
     @timeout(60)
     async def upload_to_minio(document, chunk):
         try:
-            d = copy.deepcopy(document)
+            d = dict(document)
             d.update(chunk)
             d["id"] = xxhash.xxh64((chunk["content_with_weight"] + str(d["doc_id"])).encode("utf-8", "surrogatepass")).hexdigest()
             d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
@@ -444,6 +446,11 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
         tts = np.concatenate([vts for _ in range(len(tts))], axis=0)
         tk_count += c
 
+    # Stored with the chunks so prompts are assembled without tokenizing retrieved content again.
+    token_nums = await trio.to_thread.run_sync(lambda: num_tokens_from_strings([d["content_with_weight"] for d in docs]))
+    for d, n in zip(docs, token_nums):
+        d["token_num_int"] = n
+
     @timeout(60)
     def batch_encode(txts):
         nonlocal mdl
@@ -469,8 +476,10 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
 
     assert len(vects) == len(docs)
     vector_size = 0
+    # Vectors stay float32 arrays, the doc store turns them into lists as it serializes a batch.
+    vects = np.asarray(vects, dtype=np.float32)
     for i, d in enumerate(docs):
-        v = vects[i].tolist()
+        v = vects[i]
         vector_size = len(v)
         d["q_%d_vec" % len(v)] = v
     return tk_count, vector_size
@@ -505,7 +514,7 @@ async def run_raptor(row, chat_mdl, embd_mdl, vector_size, callback=None):
     res = []
     tk_count = 0
     for content, vctr in chunks[original_length:]:
-        d = copy.deepcopy(doc)
+        d = dict(doc)
         d["id"] = xxhash.xxh64((content + str(d["doc_id"])).encode("utf-8")).hexdigest()
         d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
         d["create_timestamp_flt"] = datetime.now().timestamp()
@@ -513,8 +522,9 @@ async def run_raptor(row, chat_mdl, embd_mdl, vector_size, callback=None):
         d["content_with_weight"] = content
         d["content_ltks"] = rag_tokenizer.tokenize(content)
         d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
+        d["token_num_int"] = num_tokens_from_string(content)
         res.append(d)
-        tk_count += num_tokens_from_string(content)
+        tk_count += d["token_num_int"]
     return res, tk_count
 
 
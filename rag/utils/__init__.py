@@ -16,6 +16,8 @@
 
 import os
 import re
+import threading
+from collections import OrderedDict
 
 import tiktoken
 
@@ -81,19 +83,74 @@ os.environ["TIKTOKEN_CACHE_DIR"] = tiktoken_cache_dir
 encoder = tiktoken.get_encoding("cl100k_base")
 
 
+# Bounded LRU of token counts. Keys are (length, hash) of the text so the texts themselves are not kept alive.
+TOKEN_COUNT_CACHE_SIZE = int(os.environ.get("TOKEN_COUNT_CACHE_SIZE", 100000))
+_token_counts = OrderedDict()
+_token_counts_lock = threading.Lock()
+
+
+def _cached_token_count(string):
+    with _token_counts_lock:
+        n = _token_counts.get((len(string), hash(string)))
+        if n is not None:
+            _token_counts.move_to_end((len(string), hash(string)))
+        return n
+
+
+def _cache_token_count(string, n):
+    with _token_counts_lock:
+        _token_counts[(len(string), hash(string))] = n
+        while len(_token_counts) > TOKEN_COUNT_CACHE_SIZE:
+            _token_counts.popitem(last=False)
+
+
 def num_tokens_from_string(string: str) -> int:
     """Returns the number of tokens in a text string."""
     try:
-        return len(encoder.encode(string))
+        n = _cached_token_count(string)
+        if n is None:
+            n = len(encoder.encode(string))
+            _cache_token_count(string, n)
+        return n
     except Exception:
         return 0
 
 
+def num_tokens_from_strings(strings) -> list[int]:
+    """Returns the number of tokens of every text string, encoding the ones not counted yet in one batch."""
+    strings = list(strings)
+    counts, missing = [], {}
+    for i, string in enumerate(strings):
+        n = _cached_token_count(string) if isinstance(string, str) else num_tokens_from_string(string)
+        if n is None:
+            missing.setdefault(string, []).append(i)
+        counts.append(n)
+    if missing:
+        texts = list(missing.keys())
+        try:
+            nums = [len(tks) for tks in encoder.encode_batch(texts)]
+        except Exception:
+            # A text with special tokens fails the whole batch, count them one by one.
+            nums = [num_tokens_from_string(t) for t in texts]
+        for t, n in zip(texts, nums):
+            _cache_token_count(t, n)
+            for i in missing[t]:
+                counts[i] = n
+    return counts
+
+
 def truncate(string: str, max_len: int) -> str:
     """Returns truncated text if the length of text exceed max_len."""
-    return encoder.decode(encoder.encode(string)[:max_len])
+    n = _cached_token_count(string)
+    if n is not None and n <= max_len:
+        return string
+    tks = encoder.encode(string)
+    _cache_token_count(string, len(tks))
+    if len(tks) <= max_len:
+        return string
+    return encoder.decode(tks[:max_len])
+
 
-  
 def clean_markdown_block(text):
     text = re.sub(r'^\s*```markdown\s*\n?', '', text)
     text = re.sub(r'\n?\s*```\s*$', '', text)
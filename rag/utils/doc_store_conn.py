@@ -141,6 +141,16 @@ class OrderByExpr(ABC):
     def fields(self):
         return self.fields
 
+def to_store_row(row: dict, **fields) -> dict:
+    """
+    Shallow copy of a chunk row to hand to a store client, with `fields` set and numpy vectors turned
+    into lists. Values are shared with the chunk, so they are replaced, never modified in place.
+    """
+    res = {k: v.tolist() if isinstance(v, np.ndarray) else v for k, v in row.items()}
+    res.update(fields)
+    return res
+
+
 class DocStoreConnection(ABC):
     """
     Database operations
@@ -208,6 +218,13 @@ class DocStoreConnection(ABC):
         """
         raise NotImplementedError("Not implemented")
 
+    def multiSearch(self, searches: list[dict]) -> list:
+        """
+        Run several searches, each given as the keyword arguments of `search`, and return their results in order.
+        Engines able to send them in a single round trip should override this.
+        """
+        return [self.search(**kwargs) for kwargs in searches]
+
     @abstractmethod
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         """
@@ -29,7 +29,7 @@ from rag.settings import TAG_FLD, PAGERANK_FLD
 from rag.utils import singleton, get_float
 from api.utils.file_utils import get_project_base_directory
 from rag.utils.doc_store_conn import DocStoreConnection, MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, \
-    FusionExpr
+    FusionExpr, to_store_row
 from rag.nlp import is_english, rag_tokenizer
 
 ATTEMPT_TIME = 2
@@ -154,6 +154,81 @@ class ESConnection(DocStoreConnection):
         """
         Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/query-dsl.html
         """
+        indexNames, q = self._search_body(selectFields, highlightFields, condition, matchExprs, orderBy, offset, limit,
+                                          indexNames, knowledgebaseIds, aggFields, rank_feature)
+        logger.debug(f"ESConnection.search {str(indexNames)} query: " + json.dumps(q))
+
+        for i in range(ATTEMPT_TIME):
+            try:
+                #print(json.dumps(q, ensure_ascii=False))
+                res = self.es.search(index=indexNames,
+                                     body=q,
+                                     timeout="600s",
+                                     # search_type="dfs_query_then_fetch",
+                                     track_total_hits=True,
+                                     _source=True)
+                if str(res.get("timed_out", "")).lower() == "true":
+                    raise Exception("Es Timeout.")
+                logger.debug(f"ESConnection.search {str(indexNames)} res: " + str(res))
+                return res
+            except ConnectionTimeout:
+                logger.exception("ES request timeout")
+                self._connect()
+                continue
+            except Exception as e:
+                logger.exception(f"ESConnection.search {str(indexNames)} query: " + str(q) + str(e))
+                raise e
+
+        logger.error(f"ESConnection.search timeout for {ATTEMPT_TIME} times!")
+        raise Exception("ESConnection.search timeout.")
+
+    def multiSearch(self, searches: list[dict]) -> list:
+        """
+        Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/search-multi-search.html
+        """
+        if not searches:
+            return []
+        body = []
+        for kwargs in searches:
+            indexNames, q = self._search_body(**kwargs)
+            body.append({"index": indexNames})
+            body.append({**q, "track_total_hits": True, "_source": True, "timeout": "600s"})
+        logger.debug("ESConnection.multiSearch query: " + json.dumps(body))
+
+        for i in range(ATTEMPT_TIME):
+            try:
+                res = self.es.msearch(searches=body)
+                responses = res["responses"]
+                for r in responses:
+                    if "error" in r:
+                        raise Exception(f"ESConnection.multiSearch error: {r['error']}")
+                    if str(r.get("timed_out", "")).lower() == "true":
+                        raise Exception("Es Timeout.")
+                return responses
+            except ConnectionTimeout:
+                logger.exception("ES request timeout")
+                self._connect()
+                continue
+            except Exception as e:
+                logger.exception("ESConnection.multiSearch query: " + str(body) + str(e))
+                raise e
+
+        logger.error(f"ESConnection.multiSearch timeout for {ATTEMPT_TIME} times!")
+        raise Exception("ESConnection.multiSearch timeout.")
+
+    def _search_body(
+            self, selectFields: list[str],
+            highlightFields: list[str],
+            condition: dict,
+            matchExprs: list[MatchExpr],
+            orderBy: OrderByExpr,
+            offset: int,
+            limit: int,
+            indexNames: str | list[str],
+            knowledgebaseIds: list[str],
+            aggFields: list[str] = [],
+            rank_feature: dict | None = None
+    ) -> tuple[list[str], dict]:
         if isinstance(indexNames, str):
             indexNames = indexNames.split(",")
         assert isinstance(indexNames, list) and len(indexNames) > 0
@@ -242,32 +317,7 @@ class ESConnection(DocStoreConnection):
 
         if limit > 0:
             s = s[offset:offset + limit]
-        q = s.to_dict()
-        logger.debug(f"ESConnection.search {str(indexNames)} query: " + json.dumps(q))
-
-        for i in range(ATTEMPT_TIME):
-            try:
-                #print(json.dumps(q, ensure_ascii=False))
-                res = self.es.search(index=indexNames,
-                                     body=q,
-                                     timeout="600s",
-                                     # search_type="dfs_query_then_fetch",
-                                     track_total_hits=True,
-                                     _source=True)
-                if str(res.get("timed_out", "")).lower() == "true":
-                    raise Exception("Es Timeout.")
-                logger.debug(f"ESConnection.search {str(indexNames)} res: " + str(res))
-                return res
-            except ConnectionTimeout:
-                logger.exception("ES request timeout")
-                self._connect()
-                continue
-            except Exception as e:
-                logger.exception(f"ESConnection.search {str(indexNames)} query: " + str(q) + str(e))
-                raise e
-
-        logger.error(f"ESConnection.search timeout for {ATTEMPT_TIME} times!")
-        raise Exception("ESConnection.search timeout.")
+        return indexNames, s.to_dict()
 
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         for i in range(ATTEMPT_TIME):
@@ -293,8 +343,7 @@ class ESConnection(DocStoreConnection):
         for d in documents:
             assert "_id" not in d
             assert "id" in d
-            d_copy = copy.deepcopy(d)
-            d_copy["kb_id"] = knowledgebaseId
+            d_copy = to_store_row(d, kb_id=knowledgebaseId)
             meta_id = d_copy.pop("id", "")
             operations.append(
                 {"index": {"_index": indexName, "_id": meta_id}})
@@ -19,7 +19,6 @@ import os
 import re
 import json
 import time
-import copy
 import infinity
 from infinity.common import ConflictType, InfinityException, SortType
 from infinity.index import IndexInfo, IndexType
@@ -38,6 +37,7 @@ from rag.utils.doc_store_conn import (
     MatchDenseExpr,
     FusionExpr,
     OrderByExpr,
+    to_store_row,
 )
 
 logger = logging.getLogger('ragflow.infinity_conn')
@@ -520,7 +520,7 @@ class InfinityConnection(DocStoreConnection):
                 continue
             embedding_clmns.append((n, int(r.group(1))))
 
-        docs = copy.deepcopy(documents)
+        docs = [to_store_row(d) for d in documents]
         for d in docs:
             assert "_id" not in d
             assert "id" in d
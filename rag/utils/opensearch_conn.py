@@ -29,7 +29,7 @@ from rag.settings import TAG_FLD, PAGERANK_FLD
 from rag.utils import singleton
 from api.utils.file_utils import get_project_base_directory
 from rag.utils.doc_store_conn import DocStoreConnection, MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, \
-    FusionExpr
+    FusionExpr, to_store_row
 from rag.nlp import is_english, rag_tokenizer
 
 ATTEMPT_TIME = 2
@@ -291,7 +291,7 @@ class OSConnection(DocStoreConnection):
         for d in documents:
             assert "_id" not in d
             assert "id" in d
-            d_copy = copy.deepcopy(d)
+            d_copy = to_store_row(d)
             meta_id = d_copy.pop("id", "")
             operations.append(
                 {"index": {"_index": indexName, "_id": meta_id}})
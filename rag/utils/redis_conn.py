@@ -270,6 +270,30 @@ class RedisDB:
                     self.__open__()
         return None
 
+    def queue_range(self, queue, count: int) -> list[tuple[str, dict]]:
+        """
+        Return the oldest `count` messages of a stream without consuming them.
+        https://redis.io/docs/latest/commands/xrange/
+        """
+        try:
+            messages = self.REDIS.xrange(queue, "-", "+", count)
+            return [(msg_id, json.loads(payload["message"])) for msg_id, payload in messages]
+        except Exception as e:
+            logging.warning("RedisDB.queue_range " + str(queue) + " got exception: " + str(e))
+            self.__open__()
+        return []
+
+    def queue_delete(self, queue, msg_ids: list[str]) -> bool:
+        if not msg_ids:
+            return True
+        try:
+            self.REDIS.xdel(queue, *msg_ids)
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.queue_delete " + str(queue) + " got exception: " + str(e))
+            self.__open__()
+        return False
+
     def get_unacked_iterator(self, queue_names: list[str], group_name, consumer_name):
         try:
             for queue_name in queue_names:
@@ -375,5 +399,13 @@ class RedisDistributedLock:
                 break
             await trio.sleep(10)
 
+    def refresh(self) -> bool:
+        """Reset the expiry of the lock to its timeout, False if the lock is no longer held."""
+        try:
+            return self.lock.reacquire()
+        except Exception as e:
+            logging.warning(f"RedisDistributedLock.refresh {self.lock_key} got exception: {e}")
+            return False
+
     def release(self):
         REDIS_CONN.delete_if_equal(self.lock_key, self.lock_value)